@@ -0,0 +1,33 @@
+"""
+Atmo event sourcing applications, one module per storage backend.
+
+Importing this package imports no backend. get_application_class() imports only the backend
+asked for, so e.g. tools using the Python objects backend never import SQLAlchemy.
+"""
+from importlib import import_module
+
+# Backend name -> (module, application class name).
+BACKENDS = {
+    'pythonobjects': ('atmo_eventsourcing.application.atmo.with_pythonobjects',
+                      'AtmoEventSourcingApplicationWithPythonObjects'),
+    'sqlalchemy': ('atmo_eventsourcing.application.atmo.with_sqlalchemy', 'AtmoEventSourcingApplicationWithSQLAlchemy'),
+    'logfiles': ('atmo_eventsourcing.application.atmo.with_logfiles', 'AtmoEventSourcingApplicationWithLogFiles'),
+}
+
+
+def get_application_class(backend):
+    """
+    Returns the application class for the named backend, importing its module.
+    """
+    try:
+        module_name, class_name = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("Unknown backend '{}', expected one of: {}".format(backend, ', '.join(sorted(BACKENDS))))
+    return getattr(import_module(module_name), class_name)
+
+
+def create_application(backend, **kwargs):
+    """
+    Returns a new application with the named backend, e.g. create_application('sqlalchemy', db_uri=db_uri).
+    """
+    return get_application_class(backend)(**kwargs)
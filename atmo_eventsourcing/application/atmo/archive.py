@@ -0,0 +1,46 @@
+"""
+Archives event history: moves the events of each Instance and Allocation Source from before its
+latest snapshot out of the stored events table, into the archive table.
+
+Replays from a snapshot then only read the live events after it, and the stored events table
+(and its indexes) stops growing with heartbeat-heavy histories. Queries for historical states
+read the archived events as they need them.
+
+Usage, e.g. from cron:
+
+    python -m atmo_eventsourcing.application.atmo.archive DB_URI [--checkpoint] [--until TIME]
+
+With --checkpoint, every entity is snapshotted first, so all but its latest event is archived.
+With --until (ISO 8601, or seconds since the Epoch), only events before snapshots taken before
+then are archived, e.g. to keep the last week's events live.
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+
+from atmo_eventsourcing.application.atmo.backfill import parse_time
+from atmo_eventsourcing.utils.time import uuid_from_timestamp
+
+
+def main(argv=None):
+    from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+
+    parser = argparse.ArgumentParser(description="Archive event history from before the latest snapshots.")
+    parser.add_argument('db_uri')
+    parser.add_argument('--checkpoint', action='store_true')
+    parser.add_argument('--until', default=None)
+    args = parser.parse_args(argv)
+
+    until = None if args.until is None else uuid_from_timestamp(parse_time(args.until)).hex
+    started = time.time()
+    with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=args.db_uri) as app:
+        if args.checkpoint:
+            app.take_checkpoint(until=until)
+        count = app.archive_history(until=until)
+    print("{} events archived, {:.1f} s".format(count, time.time() - started), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Imports historical Atmosphere Instance events into an event store.
+
+Input is a CSV file (with a header row) or a JSON lines file of records, in chronological order
+at least for each Instance. Each record has a `time` (ISO 8601, or seconds since the Epoch), an
+`event`, an `atmo_id`, and depending on the event:
+
+    created     name, username
+    name        value
+    status      value
+    activity    value
+    size        value
+    heartbeat
+    discarded
+
+Instances get entity IDs from make_instance_id(), and events get version 1 UUIDs made from their
+original times, so replaying an Instance until a time gives its historical state.
+
+Usage:
+
+    python -m atmo_eventsourcing.application.atmo.backfill DB_URI INPUT [--checkpoint FILE] [--batch-size N]
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from collections import namedtuple
+
+import dateutil.parser
+import six
+from eventsourcing.utils.time import utc_timezone, timestamp_long_from_uuid
+
+from atmo_eventsourcing.domain.model.instance import Instance, make_instance_id
+from atmo_eventsourcing.infrastructure.event_store import AtmoEventStore
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import AtmoJSONDecoder
+from atmo_eventsourcing.utils.time import datetime_to_timestamp, uuid_hexes_from_timestamps
+
+ImportProgress = namedtuple('ImportProgress', ['records', 'events', 'skipped', 'seconds', 'records_per_second'])
+
+ATTRIBUTE_EVENTS = ('name', 'status', 'activity', 'size')
+
+
+class InstanceHistoryImporter(object):
+    """
+    Streams history records into an event store, appending the events in batches.
+
+    Memory use doesn't grow with the number of records or Instances: each batch looks up the
+    latest stored event of the Instances it has records for, to carry on from their versions.
+
+    If a checkpoint path is given, the number of records imported is saved there after each batch
+    is stored, and a later import of the same input resumes after those records. Before a batch
+    is stored, the checkpoint also records the batch's last event, so if the import stops before
+    the checkpoint is updated, the next import can tell whether the batch was stored.
+
+    Without a checkpoint, records for an Instance at or before the time of its latest stored event
+    are skipped as already imported, which can't tell apart records at the same time as that event.
+
+    Each Instance's events get strictly increasing times, so an event at the same time as the
+    Instance's previous event is moved on by 100 ns. A 'created' record for an Instance which
+    exists and hasn't been discarded is skipped.
+    """
+
+    def __init__(self, event_store, batch_size=1000, checkpoint_path=None, progress=None):
+        assert isinstance(event_store, AtmoEventStore), event_store
+        self.event_store = event_store
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.progress = progress
+        self._stored_entity_id_prefix = Instance.__name__ + '::'
+
+    def import_records(self, records):
+        """
+        Imports the given iterable of record dicts.
+
+        :rtype: ImportProgress
+        """
+        started = time.time()
+        done = self.read_checkpoint()
+        count = events = skipped = 0
+        batch = []
+        for record in records:
+            count += 1
+            if count <= done:
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                stored = self._import_batch(batch, count, skip_stored=done == 0)
+                events += stored
+                skipped += len(batch) - stored
+                self._report(count - done, events, skipped, started)
+                batch = []
+        if batch:
+            stored = self._import_batch(batch, count, skip_stored=done == 0)
+            events += stored
+            skipped += len(batch) - stored
+        return self._report(max(count - done, 0), events, skipped, started)
+
+    def _import_batch(self, batch, count, skip_stored):
+        timestamps = [parse_time(record['time']) for record in batch]
+        event_ids = uuid_hexes_from_timestamps(timestamps)
+        # Entity ID -> [next entity version, timestamp long of latest event, whether it was stored
+        # before the batch], for this batch only.
+        entities = {}
+        domain_events = []
+        for record, event_id in zip(batch, event_ids):
+            entity_id = make_instance_id(record['atmo_id'])
+            entity = entities.get(entity_id)
+            if entity is None:
+                entity = entities[entity_id] = self._get_entity(entity_id)
+            timestamp_long = timestamp_long_from_uuid(event_id)
+            if entity[1] is not None and timestamp_long <= entity[1]:
+                if skip_stored and entity[2]:
+                    # At or before the Instance's latest stored event, so already imported.
+                    continue
+                timestamp_long = entity[1] + 1
+                event_id = make_event_id(event_id, timestamp_long)
+            if record['event'] == 'created' and entity[0] > 0:
+                continue
+            domain_event = self.make_event(record, entity_id, entity[0], event_id)
+            domain_events.append(domain_event)
+            if isinstance(domain_event, Instance.Discarded):
+                entity[0] = 0
+            else:
+                entity[0] = domain_event.entity_version + 1
+            entity[1] = timestamp_long
+            entity[2] = False
+        if domain_events:
+            last = domain_events[-1]
+            self.write_checkpoint(count - len(batch), batch=dict(records=count, entity_id=last.entity_id,
+                                                                 event_id=last.domain_event_id))
+            self.event_store.append_many(domain_events)
+        self.write_checkpoint(count)
+        return len(domain_events)
+
+    def _get_entity(self, entity_id):
+        # Carry on from any events already stored for this Instance.
+        event = self.event_store.get_most_recent_event(self._stored_entity_id_prefix + entity_id)
+        if event is None:
+            return [0, None, False]
+        version = 0 if isinstance(event, Instance.Discarded) else event.entity_version + 1
+        return [version, timestamp_long_from_uuid(event.domain_event_id), True]
+
+    @staticmethod
+    def make_event(record, entity_id, entity_version, event_id):
+        kind = record['event']
+        if kind == 'created':
+            return Instance.Created(entity_id=entity_id, atmo_id=record['atmo_id'], name=record['name'],
+                                    username=record['username'], domain_event_id=event_id)
+        elif kind in ATTRIBUTE_EVENTS:
+            return Instance.AttributeChanged(entity_id=entity_id, entity_version=entity_version,
+                                             name='_' + kind, value=record['value'], domain_event_id=event_id)
+        elif kind == 'heartbeat':
+            return Instance.Heartbeat(entity_id=entity_id, entity_version=entity_version, domain_event_id=event_id)
+        elif kind == 'discarded':
+            return Instance.Discarded(entity_id=entity_id, entity_version=entity_version, domain_event_id=event_id)
+        else:
+            raise ValueError("Unknown history event '{}' for atmo_id {}".format(kind, record['atmo_id']))
+
+    def read_checkpoint(self):
+        """
+        Returns the number of records imported, according to the checkpoint.
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        batch = checkpoint.get('batch')
+        if batch is not None:
+            # The import stopped while storing a batch, which was stored if its last event was.
+            event = self.event_store.get_most_recent_event(self._stored_entity_id_prefix + batch['entity_id'])
+            if event is not None and event.domain_event_id == batch['event_id']:
+                return batch['records']
+        return checkpoint['records']
+
+    def write_checkpoint(self, records, batch=None):
+        if self.checkpoint_path is None:
+            return
+        checkpoint = {'records': records}
+        if batch is not None:
+            checkpoint['batch'] = batch
+        # Write then rename, so the checkpoint is never half written.
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.rename(temp_path, self.checkpoint_path)
+
+    def _report(self, records, events, skipped, started):
+        seconds = time.time() - started
+        progress = ImportProgress(records=records, events=events, skipped=skipped, seconds=seconds,
+                                  records_per_second=records / seconds if seconds else 0.0)
+        if self.progress is not None:
+            self.progress(progress)
+        return progress
+
+
+def make_event_id(event_id, timestamp_long):
+    """
+    Returns the hex of the given version 1 UUID, moved to the given time (in 100 ns since the Epoch).
+    """
+    event_id = uuid.UUID(event_id)
+    timestamp = timestamp_long + 0x01b21dd213814000
+    return uuid.UUID(fields=(timestamp & 0xffffffff, (timestamp >> 32) & 0xffff, (timestamp >> 48) & 0x0fff,
+                             event_id.clock_seq_hi_variant, event_id.clock_seq_low, event_id.node), version=1).hex
+
+
+def parse_time(value):
+    """
+    Returns seconds since the Epoch, from a number or an ISO 8601 string (UTC if no timezone is given).
+    """
+    try:
+        return float(value)
+    except ValueError:
+        a_datetime = dateutil.parser.parse(value)
+        if a_datetime.tzinfo is None:
+            a_datetime = a_datetime.replace(tzinfo=utc_timezone)
+        return datetime_to_timestamp(a_datetime)
+
+
+def read_records(path):
+    """
+    Yields record dicts from a CSV file (if the path ends with .csv) or a JSON lines file.
+
+    CSV atmo_ids are read as integers. Other CSV values are strings.
+    """
+    if path.endswith('.csv'):
+        mode = 'rb' if six.PY2 else 'r'
+        with open(path, mode) as f:
+            for row in csv.DictReader(f):
+                row['atmo_id'] = int(row['atmo_id'])
+                yield row
+    else:
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line, cls=AtmoJSONDecoder)
+
+
+def main(argv=None):
+    from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+
+    parser = argparse.ArgumentParser(description="Import Atmosphere Instance history into an event store.")
+    parser.add_argument('db_uri')
+    parser.add_argument('input')
+    parser.add_argument('--checkpoint', default=None)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    def print_progress(progress):
+        print("{0.records} records, {0.events} events, {0.skipped} skipped, "
+              "{0.seconds:.1f} s, {0.records_per_second:.0f} records/s".format(progress), file=sys.stderr)
+
+    with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=args.db_uri) as app:
+        importer = InstanceHistoryImporter(app.event_store, batch_size=args.batch_size,
+                                           checkpoint_path=args.checkpoint, progress=print_progress)
+        importer.import_records(read_records(args.input))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,165 @@
+from collections import namedtuple
+
 from atmo_eventsourcing.domain.model.allocation_source import register_new_allocation_source
-from atmo_eventsourcing.domain.model.instance import register_new_instance
+from atmo_eventsourcing.domain.model.heartbeats import flush_all_heartbeats
+from atmo_eventsourcing.domain.model.instance import Instance, register_new_instance, make_instance_id
 from atmo_eventsourcing.infrastructure.event_sourced_repos.allocation_source_repo import AllocationSourceRepo
 from atmo_eventsourcing.infrastructure.event_sourced_repos.instance_repo import InstanceRepo
+from atmo_eventsourcing.infrastructure.event_store import AtmoEventStore
+from atmo_eventsourcing.infrastructure.instance_index import PythonObjectsInstanceIndex
+from atmo_eventsourcing.infrastructure.persistence_subscriber import AtmoPersistenceSubscriber, \
+    WriteBehindPersistenceSubscriber
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import AtmoJSONEncoder, AtmoJSONDecoder
+from atmo_eventsourcing.utils.instrumentation import install as install_instrumentation, \
+    get_installed as get_installed_instrumentation
 from eventsourcing.application.base import EventSourcingApplication
 
+FleetState = namedtuple('FleetState', ['instances', 'allocation_sources'])
+
 
 class AtmoEventSourcingApplication(EventSourcingApplication):
-    def __init__(self, **kwargs):
-        super(AtmoEventSourcingApplication, self).__init__(**kwargs)
-        self.allocation_source_repo = AllocationSourceRepo(self.event_store)
-        self.instance_repo = InstanceRepo(self.event_store)
+    """
+    Event sourcing application for Atmosphere Instances and Allocation Sources.
+
+    Setting `write_behind_batch_size` or `write_behind_interval` turns on write-behind persistence:
+    published events are held back and stored in batches (see WriteBehindPersistenceSubscriber).
+    Held back events are not seen by the repositories, so call flush() to make them durable
+    before reading back recent changes. The application flushes when it is closed.
+
+    Setting `deterministic_instance_ids` gives each Instance an entity ID made from its atmo_id,
+    and makes registering Instances idempotent: registering an atmo_id which is already registered
+    returns the existing Instance, and doesn't write a new Created event. Registering the atmo_id of
+    a discarded Instance appends a second Created event to the same entity's stream.
+
+    Passing an Instrumentation installs it while the application is open, to record counts and
+    latencies of publishing, mutating, appending and replaying (see atmo_eventsourcing.utils.instrumentation).
+    """
+
+    def __init__(self, snapshot_policy=None, entity_cache_size=None, write_behind_batch_size=None,
+                 write_behind_interval=None, deterministic_instance_ids=False, instrumentation=None,
+                 json_encoder_cls=AtmoJSONEncoder, json_decoder_cls=AtmoJSONDecoder, **kwargs):
+        self.instrumentation = instrumentation
+        if self.instrumentation is not None:
+            install_instrumentation(self.instrumentation)
+        self.deterministic_instance_ids = deterministic_instance_ids
+        self.write_behind_batch_size = write_behind_batch_size
+        self.write_behind_interval = write_behind_interval
+        super(AtmoEventSourcingApplication, self).__init__(json_encoder_cls=json_encoder_cls,
+                                                           json_decoder_cls=json_decoder_cls, **kwargs)
+        self.allocation_source_repo = AllocationSourceRepo(self.event_store, snapshot_policy=snapshot_policy,
+                                                           cache_size=entity_cache_size)
+        self.instance_repo = InstanceRepo(self.event_store, index=self.create_instance_index(),
+                                          snapshot_policy=snapshot_policy, cache_size=entity_cache_size)
+
+    def create_event_store(self):
+        return AtmoEventStore(self.stored_event_repo)
+
+    def create_instance_index(self):
+        return PythonObjectsInstanceIndex()
+
+    def create_persistence_subscriber(self):
+        if self.write_behind_batch_size is None and self.write_behind_interval is None:
+            return AtmoPersistenceSubscriber(self.event_store)
+        return WriteBehindPersistenceSubscriber(self.event_store, batch_size=self.write_behind_batch_size,
+                                                interval=self.write_behind_interval)
+
+    def flush(self):
+        """
+        Returns once all the events published so far are stored, after writing any heartbeats
+        which entities are holding back (see Instance.__heartbeat_batch_size__).
+        """
+        flush_all_heartbeats()
+        self.persistence_subscriber.flush()
 
     def register_new_allocation_source(self, a, b):
         return register_new_allocation_source(a=a, b=b)
 
+    def register_new_allocation_sources(self, allocation_sources):
+        """
+        Registers many Allocation Sources, storing all their Created events together.
+
+        :param allocation_sources: Iterable of dicts of arguments for register_new_allocation_source().
+        :rtype: list
+        """
+        with self.persistence_subscriber.batch():
+            return [self.register_new_allocation_source(**kwargs) for kwargs in allocation_sources]
+
     def register_new_instance(self, atmo_id, name, username):
-        return register_new_instance(atmo_id=atmo_id, name=name, username=username)
+        if not self.deterministic_instance_ids:
+            return register_new_instance(atmo_id=atmo_id, name=name, username=username)
+
+        # Check for the Instance by its most recent event, so new registrations don't replay anything.
+        # Events held back by write-behind persistence are stored first, so they are seen too.
+        self.persistence_subscriber.flush()
+        entity_id = make_instance_id(atmo_id)
+        most_recent_event = self.instance_repo.event_player.get_most_recent_event(entity_id)
+        if most_recent_event is None or isinstance(most_recent_event, Instance.Discarded):
+            return register_new_instance(atmo_id=atmo_id, name=name, username=username, entity_id=entity_id)
+        return self.instance_repo[entity_id]
+
+    def register_new_instances(self, instances):
+        """
+        Registers many Instances, storing all their Created events together.
+
+        :param instances: Iterable of dicts of arguments for register_new_instance().
+        :rtype: list
+        """
+        with self.persistence_subscriber.batch():
+            if not self.deterministic_instance_ids:
+                return [self.register_new_instance(**kwargs) for kwargs in instances]
+
+            # The batch's events aren't stored yet, so remember Instances registered in this batch.
+            registered = {}
+            entities = []
+            for kwargs in instances:
+                entity_id = make_instance_id(kwargs['atmo_id'])
+                if entity_id not in registered:
+                    registered[entity_id] = self.register_new_instance(**kwargs)
+                entities.append(registered[entity_id])
+            return entities
+
+    def take_checkpoint(self, until=None):
+        """
+        Snapshots every Instance and Allocation Source, optionally as they were at the given time.
+
+        Taking checkpoints periodically bounds the number of events get_state_at() has to replay.
+
+        :param until: Event ID (a version 1 UUID hex), e.g. uuid_from_datetime(a_datetime).hex
+        """
+        self.instance_repo.take_snapshots(until=until)
+        self.allocation_source_repo.take_snapshots(until=until)
+
+    def archive_history(self, until=None):
+        """
+        Moves the events of every Instance and Allocation Source from before its latest snapshot
+        into the archive, e.g. after take_checkpoint(). get_state_at() still works for any time.
+
+        Needs a stored event repository with archive_entity_events(), e.g. SQLAlchemy's.
+
+        :param until: Event ID (a version 1 UUID hex), to only archive up to snapshots before then.
+        :return: The number of events archived.
+        """
+        count = self.instance_repo.archive_history(until=until)
+        return count + self.allocation_source_repo.archive_history(until=until)
+
+    def get_state_at(self, until):
+        """
+        Returns every Instance and Allocation Source as they were at the given time, from the
+        latest checkpoint before then plus the events that follow it.
+
+        :param until: Event ID (a version 1 UUID hex), e.g. uuid_from_datetime(a_datetime).hex
+        :return: FleetState of dicts of entities by entity ID
+        """
+        return FleetState(
+            instances={e.id: e for e in self.instance_repo.get_entities(until=until)},
+            allocation_sources={e.id: e for e in self.allocation_source_repo.get_entities(until=until)},
+        )
+
+    def close(self):
+        # Write buffered heartbeats while the persistence subscriber can still store them.
+        flush_all_heartbeats()
+        self.instance_repo.close()
+        self.allocation_source_repo.close()
+        super(AtmoEventSourcingApplication, self).close()
+        if self.instrumentation is not None and get_installed_instrumentation() is self.instrumentation:
+            install_instrumentation(None)
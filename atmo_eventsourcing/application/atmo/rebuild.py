@@ -0,0 +1,143 @@
+"""
+Rebuilds derived data by replaying every Instance and Allocation Source, in parallel processes.
+
+Entity IDs are split into chunks, which a process pool replays. Each worker process opens its
+own application (and so its own database connection) with the given factory, replays each
+entity of its chunks, and returns the entity passed through a projection function. The main
+process merges the results.
+
+The application factory and the projection are sent to the worker processes, so they must be
+picklable, e.g. module level functions, or functools.partial() of the application class:
+
+    rebuilder = ParallelRebuilder(partial(AtmoEventSourcingApplicationWithSQLAlchemy, db_uri=db_uri))
+    state = rebuilder.rebuild()
+
+The workers must be able to open the same event store, so this needs a database rather than
+the Python objects stored event repository (unless processes=1, when entities are replayed in
+the calling process).
+"""
+import time
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+from atmo_eventsourcing.application.atmo.base import FleetState
+
+RebuildProgress = namedtuple('RebuildProgress', ['entities', 'total', 'seconds', 'entities_per_second'])
+
+REPO_NAMES = ('instance_repo', 'allocation_source_repo')
+
+# The application and projection of a worker process.
+_worker_app = None
+_worker_projection = None
+
+
+class ParallelRebuilder(object):
+
+    def __init__(self, app_factory, processes=None, chunk_size=100, projection=None, progress=None):
+        """
+        :param app_factory: Picklable callable returning an AtmoEventSourcingApplication.
+        :param processes: Number of worker processes (defaults to the number of CPUs).
+        :param chunk_size: Number of entities each worker replays at a time.
+        :param projection: Picklable callable applied to each replayed entity (defaults to the entity).
+        :param progress: Callable passed a RebuildProgress after each chunk is replayed.
+        """
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be a positive number of entities: {}".format(chunk_size))
+        self.app_factory = app_factory
+        self.processes = processes or cpu_count()
+        self.chunk_size = chunk_size
+        self.projection = projection
+        self.progress = progress
+
+    def rebuild(self, until=None):
+        """
+        Replays every Instance and Allocation Source, optionally until the given time.
+
+        Entities not yet created, or already discarded, at that time are left out.
+
+        :param until: Event ID (a version 1 UUID hex), e.g. uuid_from_datetime(a_datetime).hex
+        :return: FleetState of dicts of projected entities by entity ID
+        """
+        started = time.time()
+        chunks = self.make_chunks(until)
+        total = sum(len(chunk[1]) for chunk in chunks)
+        state = FleetState(instances={}, allocation_sources={})
+        results = {
+            'instance_repo': state.instances,
+            'allocation_source_repo': state.allocation_sources,
+        }
+
+        done = 0
+        for repo_name, replayed, chunk_results in self._replay_chunks(chunks):
+            results[repo_name].update(chunk_results)
+            done += replayed
+            self._report(done, total, started)
+        return state
+
+    def make_chunks(self, until=None):
+        """
+        Returns a list of (repo name, entity IDs, until) chunks of the entities to replay.
+        """
+        app = self.app_factory()
+        try:
+            chunks = []
+            for repo_name in REPO_NAMES:
+                entity_ids = getattr(app, repo_name).get_entity_ids()
+                for i in range(0, len(entity_ids), self.chunk_size):
+                    chunks.append((repo_name, entity_ids[i:i + self.chunk_size], until))
+            return chunks
+        finally:
+            app.close()
+
+    def _replay_chunks(self, chunks):
+        if self.processes == 1:
+            # Replay in this process.
+            _init_worker(self.app_factory, self.projection)
+            try:
+                for chunk in chunks:
+                    yield _replay_chunk(chunk)
+            finally:
+                _close_worker()
+            return
+
+        pool = Pool(self.processes, initializer=_init_worker, initargs=(self.app_factory, self.projection))
+        try:
+            for result in pool.imap_unordered(_replay_chunk, chunks):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _report(self, entities, total, started):
+        if self.progress is None:
+            return
+        seconds = time.time() - started
+        self.progress(RebuildProgress(entities=entities, total=total, seconds=seconds,
+                                      entities_per_second=entities / seconds if seconds else 0.0))
+
+
+def _init_worker(app_factory, projection):
+    global _worker_app, _worker_projection
+    _worker_app = app_factory()
+    _worker_projection = projection
+
+
+def _close_worker():
+    global _worker_app, _worker_projection
+    _worker_app.close()
+    _worker_app = _worker_projection = None
+
+
+def _replay_chunk(chunk):
+    repo_name, entity_ids, until = chunk
+    repo = getattr(_worker_app, repo_name)
+    results = {}
+    for entity_id in entity_ids:
+        entity = repo.get_entity(entity_id, until=until)
+        if entity is None:
+            continue
+        results[entity_id] = entity if _worker_projection is None else _worker_projection(entity)
+    return repo_name, len(entity_ids), results
@@ -0,0 +1,226 @@
+import json
+import os
+from collections import namedtuple
+from threading import Lock
+
+from eventsourcing.infrastructure.stored_events.transcoders import make_stored_entity_id
+from eventsourcing.utils.time import utc_now, timestamp_long_from_uuid
+
+from atmo_eventsourcing.domain.model.instance import Instance, make_size
+from atmo_eventsourcing.infrastructure.event_store import AtmoEventStore
+
+AllocationUsage = namedtuple('AllocationUsage', ['instance_hours', 'cpu_hours'])
+
+# What the engine knows about each Instance: its status, number of CPUs, Allocation Source, and
+# the time (seconds since the Epoch) its usage has been charged until.
+_InstanceUsage = namedtuple('_InstanceUsage', ['status', 'cpu', 'allocation_source_id', 'since'])
+
+_INSTANCE_EVENTS = (Instance.Created, Instance.AttributeChanged, Instance.AttributesChanged, Instance.Discarded,
+                    Instance.Heartbeat, Instance.HeartbeatsRecorded)
+
+
+class AllocationUsageEngine(object):
+    """
+    Keeps running totals of the instance-hours (and CPU-hours) charged to each Allocation Source.
+
+    The engine listens to the events appended to the event store. An Instance's time is charged
+    to its Allocation Source (see Instance.allocation_source_id) while its status is one of the
+    running statuses. Charged time is also added up in buckets of `bucket_seconds`, so usage over
+    a time window is answered from the buckets, without replaying any history. Windows are
+    rounded out to whole buckets.
+
+    The engine only knows about the events it has seen, so to account for earlier history call
+    catch_up(), which processes each Instance's stored events after the last one the engine
+    processed. Each Instance is charged separately, so only the order of an Instance's own events
+    matters, and that is the order the event store returns them in.
+
+    The engine's state can be saved with save_state(), and restored with load_state() when the
+    engine is next started. The state includes the ID of the last event processed for each
+    Instance, so catch_up() then only processes the events stored since the state was saved.
+    """
+
+    def __init__(self, event_store, bucket_seconds=3600, running_statuses=('active',)):
+        assert isinstance(event_store, AtmoEventStore), event_store
+        if bucket_seconds <= 0:
+            raise ValueError("Bucket size must be a positive number of seconds: {}".format(bucket_seconds))
+        self.event_store = event_store
+        self.bucket_seconds = bucket_seconds
+        self.running_statuses = frozenset(running_statuses)
+        self._lock = Lock()
+        self._instances = {}  # Instance entity ID -> _InstanceUsage.
+        self._totals = {}  # Allocation Source entity ID -> [seconds, CPU-seconds].
+        self._buckets = {}  # Allocation Source entity ID -> bucket number -> [seconds, CPU-seconds].
+        self._positions = {}  # Instance entity ID -> ID of the last of its events processed.
+        self.event_store.add_listener(self.process)
+
+    def process(self, domain_events):
+        """
+        Charges the time covered by the given Instance events. Other events are ignored, as are
+        events of an Instance from before the last of its events processed, or the same event again.
+        """
+        with self._lock:
+            for event in domain_events:
+                if not isinstance(event, _INSTANCE_EVENTS):
+                    continue
+                position = self._positions.get(event.entity_id)
+                if position is not None and (event.domain_event_id == position or
+                                             timestamp_long_from_uuid(event.domain_event_id) <
+                                             timestamp_long_from_uuid(position)):
+                    continue
+                self._positions[event.entity_id] = event.domain_event_id
+                if isinstance(event, Instance.Created):
+                    self._instances[event.entity_id] = _InstanceUsage(status='unknown', cpu=0,
+                                                                      allocation_source_id=None,
+                                                                      since=event.timestamp)
+                elif isinstance(event, Instance.AttributeChanged):
+                    self._attributes_changed(event.entity_id, {event.name: event.value}, event.timestamp)
+                elif isinstance(event, Instance.AttributesChanged):
+                    self._attributes_changed(event.entity_id, event.values, event.timestamp)
+                elif isinstance(event, Instance.Discarded):
+                    if event.entity_id in self._instances:
+                        self._charge(self._instances.pop(event.entity_id), event.timestamp)
+
+    def catch_up(self):
+        """
+        Processes the stored events of each Instance from after the last of its events processed,
+        e.g. after load_state(), or to account for the history stored before the engine started.
+
+        :return: The number of events processed.
+        """
+        repo = self.event_store.stored_event_repo
+        count = 0
+        for stored_entity_id in repo.get_stored_entity_ids(make_stored_entity_id(Instance.__name__, '')):
+            entity_id = stored_entity_id.partition('::')[2]
+            with self._lock:
+                position = self._positions.get(entity_id)
+            events = list(self.event_store.get_entity_events(stored_entity_id, after=position))
+            self.process(events)
+            count += len(events)
+        return count
+
+    def get_position(self, entity_id):
+        """
+        Returns the ID of the last event processed for the given Instance, or None.
+        """
+        with self._lock:
+            return self._positions.get(entity_id)
+
+    def _attributes_changed(self, entity_id, values, timestamp):
+        usage = self._instances.get(entity_id)
+        if usage is None:
+            return
+        changes = {}
+        if '_status' in values:
+            changes['status'] = values['_status']
+        if '_size' in values:
+            changes['cpu'] = max(make_size(values['_size']).cpu, 0)
+        if '_allocation_source_id' in values:
+            changes['allocation_source_id'] = values['_allocation_source_id']
+        if not changes:
+            return
+        self._charge(usage, timestamp)
+        self._instances[entity_id] = usage._replace(since=max(usage.since, timestamp), **changes)
+
+    def _charge(self, usage, until):
+        if usage.status not in self.running_statuses or usage.allocation_source_id is None:
+            return
+        totals = self._totals.setdefault(usage.allocation_source_id, [0.0, 0.0])
+        buckets = self._buckets.setdefault(usage.allocation_source_id, {})
+        for bucket, seconds in self._split(usage.since, until):
+            totals[0] += seconds
+            totals[1] += seconds * usage.cpu
+            bucket_totals = buckets.setdefault(bucket, [0.0, 0.0])
+            bucket_totals[0] += seconds
+            bucket_totals[1] += seconds * usage.cpu
+
+    def _split(self, start, end):
+        """
+        Yields the bucket numbers and number of seconds in each bucket between the given times.
+        """
+        while start < end:
+            bucket = int(start // self.bucket_seconds)
+            bucket_end = min(end, (bucket + 1) * self.bucket_seconds)
+            yield bucket, bucket_end - start
+            start = bucket_end
+
+    def get_usage(self, allocation_source_id, start=None, end=None, now=None):
+        """
+        Returns the usage charged to the given Allocation Source, optionally in a time window.
+
+        Instances still running are charged up to `now` (by default the current time).
+
+        :param start: Start of the window, in seconds since the Epoch, rounded down to a bucket.
+        :param end: End of the window, in seconds since the Epoch, rounded up to a bucket.
+        :rtype: AllocationUsage
+        """
+        now = utc_now() if now is None else now
+        first = None if start is None else int(start // self.bucket_seconds)
+        last = None if end is None else int(-(-end // self.bucket_seconds)) - 1
+
+        def in_window(bucket):
+            return (first is None or bucket >= first) and (last is None or bucket <= last)
+
+        with self._lock:
+            if first is None and last is None:
+                seconds, cpu_seconds = self._totals.get(allocation_source_id, (0.0, 0.0))
+            else:
+                seconds = cpu_seconds = 0.0
+                for bucket, bucket_totals in self._buckets.get(allocation_source_id, {}).items():
+                    if in_window(bucket):
+                        seconds += bucket_totals[0]
+                        cpu_seconds += bucket_totals[1]
+
+            # Add the time running Instances haven't been charged for yet.
+            for usage in self._instances.values():
+                if usage.allocation_source_id != allocation_source_id or usage.status not in self.running_statuses:
+                    continue
+                for bucket, bucket_seconds in self._split(usage.since, now):
+                    if in_window(bucket):
+                        seconds += bucket_seconds
+                        cpu_seconds += bucket_seconds * usage.cpu
+
+        return AllocationUsage(instance_hours=seconds / 3600.0, cpu_hours=cpu_seconds / 3600.0)
+
+    def save_state(self, path):
+        """
+        Saves the engine's state, with the ID of the last event processed for each Instance, as
+        JSON to the given path.
+        """
+        with self._lock:
+            state = {
+                'positions': self._positions,
+                'bucket_seconds': self.bucket_seconds,
+                'running_statuses': sorted(self.running_statuses),
+                'instances': {entity_id: list(usage) for entity_id, usage in self._instances.items()},
+                'totals': self._totals,
+                'buckets': {allocation_source_id: {str(bucket): totals for bucket, totals in buckets.items()}
+                            for allocation_source_id, buckets in self._buckets.items()},
+            }
+            # Write then rename, so the state is never half written.
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.rename(temp_path, path)
+
+    def load_state(self, path):
+        """
+        Replaces the engine's state with the state saved to the given path by save_state(). Call
+        catch_up() to process the events stored since.
+        """
+        with open(path) as f:
+            state = json.load(f)
+        if state['bucket_seconds'] != self.bucket_seconds:
+            raise ValueError("Saved state has buckets of {} seconds, not {}".format(state['bucket_seconds'],
+                                                                                   self.bucket_seconds))
+        if frozenset(state['running_statuses']) != self.running_statuses:
+            raise ValueError("Saved state has running statuses {}, not {}".format(
+                state['running_statuses'], sorted(self.running_statuses)))
+        with self._lock:
+            self._instances = {entity_id: _InstanceUsage(*usage) for entity_id, usage in state['instances'].items()}
+            self._totals = state['totals']
+            self._buckets = {allocation_source_id: {int(bucket): totals for bucket, totals in buckets.items()}
+                             for allocation_source_id, buckets in state['buckets'].items()}
+            self._positions = state['positions']
+
+    def close(self):
+        self.event_store.remove_listener(self.process)
@@ -0,0 +1,47 @@
+from eventsourcing.infrastructure.stored_events.transcoders import make_stored_entity_id
+
+from atmo_eventsourcing.application.atmo.base import AtmoEventSourcingApplication
+from atmo_eventsourcing.domain.model.instance import Instance
+from atmo_eventsourcing.infrastructure.instance_index import PythonObjectsInstanceIndex, INSTANCE_INDEX_TOPICS
+from atmo_eventsourcing.infrastructure.stored_events.log_file_stored_events import AtmoLogFileStoredEventRepository
+
+
+class AtmoEventSourcingApplicationWithLogFiles(AtmoEventSourcingApplication):
+    """
+    Atmo event sourcing application which stores events in append-only log files in the given
+    directory (see AtmoLogFileStoredEventRepository).
+
+    The instance index is kept in memory, and rebuilt from the Instances' Created and Discarded
+    events when the application is opened.
+
+    Only one application at a time can write to the directory. Pass `read_only=True` for others
+    which only read from it, e.g. those made by a ParallelRebuilder's app factory.
+    """
+
+    def __init__(self, path, event_codec=None, segment_size=64 * 1024 * 1024, sync=False, read_only=False,
+                 **kwargs):
+        self.path = path
+        self.event_codec = event_codec
+        self.segment_size = segment_size
+        self.sync = sync
+        self.read_only = read_only
+        super(AtmoEventSourcingApplicationWithLogFiles, self).__init__(**kwargs)
+
+    def create_stored_event_repo(self, **kwargs):
+        return AtmoLogFileStoredEventRepository(path=self.path, event_codec=self.event_codec,
+                                                segment_size=self.segment_size, sync=self.sync,
+                                                read_only=self.read_only, **kwargs)
+
+    def create_instance_index(self):
+        index = PythonObjectsInstanceIndex()
+        repo = self.stored_event_repo
+        index.update(
+            repo.deserialize(stored_event)
+            for stored_event in repo.iterate_stored_events(prefix=make_stored_entity_id(Instance.__name__, ''))
+            if stored_event.event_topic in INSTANCE_INDEX_TOPICS
+        )
+        return index
+
+    def close(self):
+        super(AtmoEventSourcingApplicationWithLogFiles, self).close()
+        self.stored_event_repo.close()
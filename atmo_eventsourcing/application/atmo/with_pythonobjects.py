@@ -1,7 +1,11 @@
 from eventsourcing.application.with_pythonobjects import EventSourcingWithPythonObjects
 
 from atmo_eventsourcing.application.atmo.base import AtmoEventSourcingApplication
+from atmo_eventsourcing.infrastructure.stored_events.python_objects_stored_events import \
+    AtmoPythonObjectsStoredEventRepository
 
 
 class AtmoEventSourcingApplicationWithPythonObjects(EventSourcingWithPythonObjects, AtmoEventSourcingApplication):
-    pass
+
+    def create_stored_event_repo(self, **kwargs):
+        return AtmoPythonObjectsStoredEventRepository()
@@ -1,7 +1,65 @@
+from itertools import islice
+
 from eventsourcing.application.with_sqlalchemy import EventSourcingWithSQLAlchemy
+from eventsourcing.infrastructure.stored_events.transcoders import make_stored_entity_id
 
 from atmo_eventsourcing.application.atmo.base import AtmoEventSourcingApplication
+from atmo_eventsourcing.domain.model.instance import Instance
+from atmo_eventsourcing.infrastructure.instance_index import INSTANCE_INDEX_TOPICS
+from atmo_eventsourcing.infrastructure.sqlalchemy_instance_index import SQLAlchemyInstanceIndex
+from atmo_eventsourcing.infrastructure.sqlite import is_sqlite_file_uri, create_sqlite_db_session
+from atmo_eventsourcing.infrastructure.stored_events.sqlalchemy_stored_events import \
+    AtmoSQLAlchemyStoredEventRepository
 
 
 class AtmoEventSourcingApplicationWithSQLAlchemy(EventSourcingWithSQLAlchemy, AtmoEventSourcingApplication):
-    pass
+    """
+    Atmo event sourcing application which stores events with SQLAlchemy.
+
+    Pass `event_codec=PackedEventCodec()` to store Instance and Allocation Source events compactly.
+    Either codec reads events stored by the other, and
+    `stored_event_repo.reencode_stored_events()` rewrites existing events with the current codec.
+
+    SQLite database files are opened with the production profile (see create_sqlite_db_session()):
+    WAL journaling, tuned PRAGMAs, pooled connections for use from several threads, and an index
+    for replaying events.
+
+    The instance index is updated in the same transaction as the events are stored in. If the
+    instance index is empty when the application is opened, e.g. on a database made before
+    the index existed, it is rebuilt from the Instances' stored Created and Discarded events.
+    """
+
+    def __init__(self, event_codec=None, db_session=None, **kwargs):
+        self.event_codec = event_codec
+        self._owns_db_session = db_session is None
+        super(AtmoEventSourcingApplicationWithSQLAlchemy, self).__init__(db_session=db_session, **kwargs)
+
+    @staticmethod
+    def create_db_session(uri):
+        if is_sqlite_file_uri(uri):
+            return create_sqlite_db_session(uri)
+        return EventSourcingWithSQLAlchemy.create_db_session(uri)
+
+    def create_stored_event_repo(self, **kwargs):
+        return AtmoSQLAlchemyStoredEventRepository(db_session=self.db_session, event_codec=self.event_codec,
+                                                   **kwargs)
+
+    def create_instance_index(self):
+        index = SQLAlchemyInstanceIndex(db_session=self.db_session, stored_event_repo=self.stored_event_repo)
+        if index.is_empty():
+            repo = self.stored_event_repo
+            stored_events = repo.iterate_stored_events(prefix=make_stored_entity_id(Instance.__name__, ''),
+                                                       topics=INSTANCE_INDEX_TOPICS)
+            # Update the index a page at a time, each page in one transaction.
+            while True:
+                events = [repo.deserialize(stored_event) for stored_event in islice(stored_events, 1000)]
+                if not events:
+                    break
+                index.update(events)
+        return index
+
+    def close(self):
+        super(AtmoEventSourcingApplicationWithSQLAlchemy, self).close()
+        if self._owns_db_session:
+            # Close the pooled connections.
+            self.db_session.get_bind().dispose()
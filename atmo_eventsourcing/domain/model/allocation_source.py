@@ -1,17 +1,32 @@
 import uuid
+from collections import namedtuple
+from functools import reduce
 
 from eventsourcing.domain.model.entity import EventSourcedEntity, mutableproperty, EntityRepository, entity_mutator, \
     singledispatch
-from eventsourcing.domain.model.events import publish, DomainEvent
+from eventsourcing.domain.model.events import DomainEvent
 
+from atmo_eventsourcing.domain.model.dispatch import MutatorTable
+from atmo_eventsourcing.domain.model.heartbeats import HeartbeatsMixin, heartbeat_mutator, \
+    heartbeats_recorded_mutator
+from atmo_eventsourcing.utils import instrumentation
+from atmo_eventsourcing.utils.instrumentation import publish
 
-class AllocationSource(EventSourcedEntity):
+# Compact, immutable copy of the state of an Allocation Source.
+AllocationSourceState = namedtuple('AllocationSourceState', ['id', 'version', 'a', 'b', 'heartbeats'])
+
+
+class AllocationSource(HeartbeatsMixin, EventSourcedEntity):
     """
     An event sourced domain model entity for Allocation Sources
     """
 
     __page_size__ = 1000  # Needed to get an event history longer than 10000 in Cassandra.
 
+    # Setting this makes setting an attribute to the value it already has write nothing. Suppressed
+    # writes are counted as 'suppressed_writes' by the installed instrumentation.
+    __suppress_unchanged_attributes__ = False
+
     class Created(EventSourcedEntity.Created):
         pass
 
@@ -24,6 +39,11 @@ class AllocationSource(EventSourcedEntity):
     class Heartbeat(DomainEvent):
         pass
 
+    class HeartbeatsRecorded(DomainEvent):
+        """
+        Records `count` heartbeats, which happened between the `first` and `last` timestamps.
+        """
+
     def __init__(self, a, b, **kwargs):
         super(AllocationSource, self).__init__(**kwargs)
         self._a = a
@@ -38,18 +58,37 @@ class AllocationSource(EventSourcedEntity):
     def b(self):
         return self._b
 
-    def beat_heart(self):
+    def _change_attribute(self, name, value):
+        self.flush_heartbeats()
         self._assert_not_discarded()
-        event = self.Heartbeat(entity_id=self._id, entity_version=self._version)
-        self._apply(event)
-        publish(event)
+        if self.__suppress_unchanged_attributes__ and getattr(self, name) == value:
+            instrumentation.increment('suppressed_writes', self.AttributeChanged)
+            return
+        instrumentation.call('publish', self.AttributeChanged, super(AllocationSource, self)._change_attribute,
+                             name, value)
 
-    def count_heartbeats(self):
-        return self._count_heartbeats
+    def get_state(self):
+        """
+        Returns a compact copy of the state of this Allocation Source.
+
+        :rtype: AllocationSourceState
+        """
+        return AllocationSourceState(id=self._id, version=self._version, a=self._a, b=self._b,
+                                     heartbeats=self.count_heartbeats())
 
     @staticmethod
     def _mutator(event, initial):
-        return allocation_source_mutator(event, initial)
+        return instrumentation.mutate(allocation_source_mutators.apply, event, initial)
+
+    @classmethod
+    def mutate_all(cls, events, entity=None):
+        """
+        Applies the given events in order, like calling mutate() for each, and returns the resulting entity.
+        """
+        if instrumentation.get_installed() is not None:
+            # Record each event's mutation.
+            return reduce(cls.mutate, events, entity)
+        return allocation_source_mutators.apply_all(events, entity)
 
 
 @singledispatch
@@ -57,13 +96,12 @@ def allocation_source_mutator(event, initial):
     return entity_mutator(event, initial)
 
 
-@allocation_source_mutator.register(AllocationSource.Heartbeat)
-def heartbeat_mutator(event, self):
-    self._validate_originator(event)
-    assert isinstance(self, AllocationSource), self
-    self._count_heartbeats += 1
-    self._increment_version()
-    return self
+allocation_source_mutator.register(AllocationSource.Heartbeat)(heartbeat_mutator)
+allocation_source_mutator.register(AllocationSource.HeartbeatsRecorded)(heartbeats_recorded_mutator)
+
+
+# Applies events through handlers looked up once per event class, instead of dispatching each event.
+allocation_source_mutators = MutatorTable(AllocationSource, allocation_source_mutator)
 
 
 class AllocationSourceRepository(EntityRepository):
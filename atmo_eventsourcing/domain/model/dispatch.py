@@ -0,0 +1,59 @@
+from eventsourcing.domain.model.entity import entity_mutator
+
+
+class MutatorTable(object):
+    """
+    Table from event class to the function which applies events of that class to an entity of the
+    given domain class.
+
+    Each event class is resolved through the given singledispatch mutator once, falling through
+    to eventsourcing's entity_mutator for event classes the mutator doesn't register itself (e.g.
+    Created and Discarded). After that, applying an event is a dict lookup and a call. The table
+    is rebuilt if functions are registered with the mutator later.
+    """
+
+    def __init__(self, domain_class, mutator):
+        self.domain_class = domain_class
+        self.mutator = mutator
+        self._handlers = {}
+        self._registry_size = None
+
+    def get(self, event_class):
+        """
+        Returns the function which applies events of the given class.
+        """
+        self._check_registry()
+        handler = self._handlers.get(event_class)
+        if handler is None:
+            handler = self.mutator.dispatch(event_class)
+            if handler is self.mutator.dispatch(object):
+                handler = entity_mutator.dispatch(event_class)
+            self._handlers[event_class] = handler
+        return handler
+
+    def _check_registry(self):
+        if len(self.mutator.registry) != self._registry_size:
+            self._handlers.clear()
+            self._registry_size = len(self.mutator.registry)
+
+    def apply(self, event, initial):
+        return self.get(type(event))(event, initial)
+
+    def apply_all(self, events, initial):
+        """
+        Applies the given events in order, and returns the resulting entity, like calling the domain
+        class's mutate() for each event. Events following a discard (or the start, if the initial
+        state is None) are applied to the domain class.
+        """
+        self._check_registry()
+        handlers = self._handlers
+        get = self.get
+        domain_class = self.domain_class
+        entity = initial
+        for event in events:
+            event_class = type(event)
+            handler = handlers.get(event_class)
+            if handler is None:
+                handler = get(event_class)
+            entity = handler(event, entity if entity is not None else domain_class)
+        return entity
@@ -0,0 +1,144 @@
+"""
+Coalescing of heartbeats, shared by Instances and Allocation Sources (see HeartbeatsMixin).
+
+Buffers of heartbeats which haven't been written yet are registered here, so
+flush_all_heartbeats() (called when an application is flushed or closed) writes them. Entities are
+only referred to weakly, so a buffered entity isn't kept alive: if it is dropped, its buffer is
+still written, as the entity would have written it. Like event publishing, this is process wide.
+"""
+import threading
+import weakref
+from itertools import count as counter
+
+from eventsourcing.utils.time import utc_now
+
+from atmo_eventsourcing.utils import instrumentation
+from atmo_eventsourcing.utils.instrumentation import publish
+from atmo_eventsourcing.utils.time import uuid_from_timestamp, get_node
+
+_lock = threading.Lock()
+_keys = counter()
+# Key -> (weak reference to the entity, entity class, entity ID, entity version, buffer).
+_pending = {}
+
+
+class HeartbeatsMixin(object):
+    """
+    Heartbeats for an event sourced entity with Heartbeat and HeartbeatsRecorded events, and a
+    `_count_heartbeats` attribute. Put it before EventSourcedEntity in the bases.
+    """
+
+    # Setting either of these coalesces heartbeats: calls to beat_heart() are buffered on the
+    # entity, and written as a single HeartbeatsRecorded event when the buffer holds this many
+    # heartbeats, or has been open for this many seconds (checked on each beat). Buffered
+    # heartbeats are written before any other event, and call flush_heartbeats() (or the
+    # application's flush()) to write out a partial buffer.
+    __heartbeat_batch_size__ = None
+    __heartbeat_batch_interval__ = None
+
+    # Heartbeats not yet written, as [count, first, last, key] (timestamps in seconds since the
+    # Epoch, and the key of the buffer's registration).
+    _heartbeat_buffer = None
+
+    def beat_heart(self):
+        self._assert_not_discarded()
+        if self.__heartbeat_batch_size__ is None and self.__heartbeat_batch_interval__ is None:
+            self.flush_heartbeats()
+            event = self.Heartbeat(entity_id=self._id, entity_version=self._version)
+            self._apply(event)
+            publish(event)
+            return
+
+        now = utc_now()
+        if self._heartbeat_buffer is None:
+            self._heartbeat_buffer = _add_pending(self, now)
+        self._heartbeat_buffer[0] += 1
+        self._heartbeat_buffer[2] = now
+
+        count, first = self._heartbeat_buffer[:2]
+        if self.__heartbeat_batch_size__ is not None and count >= self.__heartbeat_batch_size__:
+            self.flush_heartbeats()
+        elif self.__heartbeat_batch_interval__ is not None and now - first >= self.__heartbeat_batch_interval__:
+            self.flush_heartbeats()
+
+    def flush_heartbeats(self):
+        """
+        Writes any buffered heartbeats as a single HeartbeatsRecorded event, at the time of the last.
+        """
+        if self._heartbeat_buffer is None:
+            return
+        self._assert_not_discarded()
+        buffer = self._heartbeat_buffer
+        # Drop the buffer from the entity, so the entity compares equal to its replayed state.
+        del self._heartbeat_buffer
+        with _lock:
+            _pending.pop(buffer[3], None)
+        event = make_heartbeats_recorded(type(self), self._id, self._version, buffer)
+        self._apply(event)
+        publish(event)
+
+    def count_heartbeats(self):
+        if self._heartbeat_buffer is None:
+            return self._count_heartbeats
+        return self._count_heartbeats + self._heartbeat_buffer[0]
+
+    def discard(self):
+        self.flush_heartbeats()
+        # The library method applies and publishes the event, which is timed as publishing it.
+        instrumentation.call('publish', self.Discarded, super(HeartbeatsMixin, self).discard)
+
+
+def make_heartbeats_recorded(entity_class, entity_id, entity_version, buffer):
+    """
+    Returns a HeartbeatsRecorded event for the given buffer, with an event ID at the time of the
+    last heartbeat, so historical queries count heartbeats as of when they happened.
+    """
+    count, first, last = buffer[:3]
+    return entity_class.HeartbeatsRecorded(entity_id=entity_id, entity_version=entity_version, count=count,
+                                           first=first, last=last,
+                                           domain_event_id=uuid_from_timestamp(last, node=get_node()).hex)
+
+
+def heartbeat_mutator(event, self):
+    self._validate_originator(event)
+    self._count_heartbeats += 1
+    self._increment_version()
+    return self
+
+
+def heartbeats_recorded_mutator(event, self):
+    self._validate_originator(event)
+    self._count_heartbeats += event.count
+    self._increment_version()
+    return self
+
+
+def _add_pending(entity, now):
+    # Returns a new buffer for the entity, registered so flush_all_heartbeats() writes it.
+    with _lock:
+        key = next(_keys)
+        buffer = [0, now, now, key]
+        _pending[key] = (weakref.ref(entity), type(entity), entity.id, entity.version, buffer)
+    return buffer
+
+
+def flush_all_heartbeats():
+    """
+    Writes the buffered heartbeats of every entity, as HeartbeatsRecorded events.
+
+    :return: The number of buffers written.
+    """
+    with _lock:
+        pending = list(_pending.values())
+    for entity_ref, entity_class, entity_id, entity_version, buffer in pending:
+        entity = entity_ref()
+        if entity is not None:
+            entity.flush_heartbeats()
+            continue
+        # The entity has been dropped, so write the buffer for it. Its version didn't change
+        # while it was buffering, since any other event writes the buffer first.
+        with _lock:
+            if _pending.pop(buffer[3], None) is None:
+                continue
+        publish(make_heartbeats_recorded(entity_class, entity_id, entity_version, buffer))
+    return len(pending)
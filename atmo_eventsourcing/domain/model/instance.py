@@ -1,17 +1,47 @@
 import uuid
+from abc import abstractmethod
+from collections import namedtuple
+from functools import reduce
 
+import six
 from eventsourcing.domain.model.entity import EventSourcedEntity, mutableproperty, EntityRepository, entity_mutator, \
     singledispatch
-from eventsourcing.domain.model.events import publish, DomainEvent
+from eventsourcing.domain.model.events import DomainEvent
 
+from atmo_eventsourcing.domain.model.dispatch import MutatorTable
+from atmo_eventsourcing.domain.model.heartbeats import HeartbeatsMixin, heartbeat_mutator, \
+    heartbeats_recorded_mutator
+from atmo_eventsourcing.utils import instrumentation
+from atmo_eventsourcing.utils.instrumentation import publish
 
-class Instance(EventSourcedEntity):
+# The size of an Instance, as numbers of CPUs, MB of memory and GB of disk. Unknown values are -1.
+InstanceSize = namedtuple('InstanceSize', ['cpu', 'mem', 'disk'])
+
+UNKNOWN_SIZE = InstanceSize(cpu=-1, mem=-1, disk=-1)
+
+# Mutable properties which Instance.update() can change together.
+UPDATABLE_ATTRIBUTES = ('name', 'status', 'activity', 'size', 'allocation_source_id')
+
+# Compact, immutable copy of the state of an Instance, e.g. for keeping many Instances in memory.
+InstanceState = namedtuple('InstanceState', ['id', 'version', 'atmo_id', 'name', 'username', 'status', 'activity',
+                                             'size', 'heartbeats'])
+
+
+class Instance(HeartbeatsMixin, EventSourcedEntity):
     """
     An event sourced domain model entity for Instances
     """
 
     __page_size__ = 1000  # Needed to get an event history longer than 10000 in Cassandra.
 
+    # Setting this makes setting an attribute to the value it already has write nothing. Suppressed
+    # writes are counted as 'suppressed_writes' by the installed instrumentation.
+    __suppress_unchanged_attributes__ = False
+
+    # Entity ID of the Allocation Source the Instance's usage is charged to. Only set in the
+    # instance's __dict__ once assigned, so Instances replayed from older snapshots compare equal.
+    _allocation_source_id = None
+
     class Created(EventSourcedEntity.Created):
         pass
 
@@ -24,6 +54,17 @@ class Instance(EventSourcedEntity):
     class Heartbeat(DomainEvent):
         pass
 
+    class HeartbeatsRecorded(DomainEvent):
+        """
+        Records `count` heartbeats, which happened between the `first` and `last` timestamps.
+        """
+
+    class AttributesChanged(DomainEvent):
+        """
+        Records several attributes changed together. `values` maps the attribute names (e.g.
+        '_status') to their new values.
+        """
+
     def __init__(self, atmo_id, name, username, **kwargs):
         super(Instance, self).__init__(**kwargs)
         self._atmo_id = atmo_id
@@ -32,7 +73,7 @@ class Instance(EventSourcedEntity):
 
         self._status = 'unknown'
         self._activity = ''
-        self._size = {-1, -1, -1}
+        self._size = UNKNOWN_SIZE
         self._count_heartbeats = 0
 
     @property
@@ -56,21 +97,95 @@ class Instance(EventSourcedEntity):
         return self._activity
 
     @mutableproperty
+    def allocation_source_id(self):
+        return self._allocation_source_id
+
+    @property
     def size(self):
-        return self._size
+        """
+        :rtype: InstanceSize
+        """
+        if isinstance(self._size, InstanceSize):
+            return self._size
+        # Snapshots taken before sizes were tuples hold the old default size, a set.
+        return read_size(self._size)
+
+    @size.setter
+    def size(self, value):
+        self._change_attribute(name='_size', value=make_size(value))
 
-    def beat_heart(self):
+    def update(self, **changes):
+        """
+        Changes several mutable properties together, with a single AttributesChanged event, e.g.
+        instance.update(status='active', activity='', size=size) after polling the cloud.
+
+        If __suppress_unchanged_attributes__ is set, attributes which already have the given values
+        are left out of the event, and nothing is written if none of them change.
+
+        :param changes: New values of any of name, status, activity, size and allocation_source_id.
+        """
+        unknown = set(changes).difference(UPDATABLE_ATTRIBUTES)
+        if unknown:
+            raise TypeError("Can't update Instance attributes: {}".format(', '.join(sorted(unknown))))
+        if not changes:
+            return
+        self.flush_heartbeats()
         self._assert_not_discarded()
-        event = self.Heartbeat(entity_id=self._id, entity_version=self._version)
+        values = {'_' + name: make_size(value) if name == 'size' else value for name, value in changes.items()}
+        if self.__suppress_unchanged_attributes__:
+            values = {name: value for name, value in values.items() if not self._is_unchanged(name, value)}
+            if not values:
+                instrumentation.increment('suppressed_writes', self.AttributesChanged)
+                return
+        event = self.AttributesChanged(values=values, entity_id=self._id, entity_version=self._version)
         self._apply(event)
         publish(event)
 
-    def count_heartbeats(self):
-        return self._count_heartbeats
+    def _change_attribute(self, name, value):
+        self.flush_heartbeats()
+        self._assert_not_discarded()
+        if self.__suppress_unchanged_attributes__ and self._is_unchanged(name, value):
+            instrumentation.increment('suppressed_writes', self.AttributeChanged)
+            return
+        instrumentation.call('publish', self.AttributeChanged, super(Instance, self)._change_attribute, name, value)
+
+    def _is_unchanged(self, name, value):
+        # Compare sizes as InstanceSize, since snapshots store them as lists.
+        current = self.size if name == '_size' else getattr(self, name)
+        return current == value
+
+    def __eq__(self, other):
+        if not isinstance(other, Instance):
+            return super(Instance, self).__eq__(other)
+        # Snapshots store the size as a JSON list, so compare sizes as InstanceSize.
+        return dict(self.__dict__, _size=self.size) == dict(other.__dict__, _size=other.size)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get_state(self):
+        """
+        Returns a compact copy of the state of this Instance.
+
+        :rtype: InstanceState
+        """
+        return InstanceState(id=self._id, version=self._version, atmo_id=self._atmo_id, name=self._name,
+                             username=self._username, status=self._status, activity=self._activity,
+                             size=self.size, heartbeats=self.count_heartbeats())
 
     @staticmethod
     def _mutator(event, initial):
-        return instance_mutator(event, initial)
+        return instrumentation.mutate(instance_mutators.apply, event, initial)
+
+    @classmethod
+    def mutate_all(cls, events, entity=None):
+        """
+        Applies the given events in order, like calling mutate() for each, and returns the resulting entity.
+        """
+        if instrumentation.get_installed() is not None:
+            # Record each event's mutation.
+            return reduce(cls.mutate, events, entity)
+        return instance_mutators.apply_all(events, entity)
 
 
 @singledispatch
@@ -78,28 +193,122 @@ def instance_mutator(event, initial):
     return entity_mutator(event, initial)
 
 
-@instance_mutator.register(Instance.Heartbeat)
-def heartbeat_mutator(event, self):
+@instance_mutator.register(Instance.AttributeChanged)
+def attribute_changed_mutator(event, self):
+    assert isinstance(self, Instance), self
     self._validate_originator(event)
+    _set_attribute(self, event.name, event.value)
+    self._increment_version()
+    return self
+
+
+@instance_mutator.register(Instance.AttributesChanged)
+def attributes_changed_mutator(event, self):
     assert isinstance(self, Instance), self
-    self._count_heartbeats += 1
+    self._validate_originator(event)
+    for name, value in event.values.items():
+        _set_attribute(self, name, value)
     self._increment_version()
     return self
 
 
+def _set_attribute(instance, name, value):
+    if name == '_size':
+        # Sizes are stored as JSON lists.
+        value = read_size(value)
+    elif name in ('_status', '_activity'):
+        # There are only a few statuses and activities, so Instances can share the strings.
+        value = intern_value(value)
+    setattr(instance, name, value)
+
+
+instance_mutator.register(Instance.Heartbeat)(heartbeat_mutator)
+instance_mutator.register(Instance.HeartbeatsRecorded)(heartbeats_recorded_mutator)
+
+
+# Applies events through handlers looked up once per event class, instead of dispatching each event.
+instance_mutators = MutatorTable(Instance, instance_mutator)
+
+
+def make_size(value):
+    """
+    Returns an InstanceSize from a dict with 'cpu', 'mem' and 'disk' keys, or a (cpu, mem, disk)
+    sequence. Missing values are -1.
+
+    :rtype: InstanceSize
+    """
+    if isinstance(value, InstanceSize):
+        return value
+    if isinstance(value, (set, frozenset)):
+        # The old default size, which was {-1, -1, -1} (so {-1}).
+        return UNKNOWN_SIZE
+    if isinstance(value, dict):
+        value = [value.get(name, -1) for name in InstanceSize._fields]
+    return InstanceSize(*[int(v) for v in value])
+
+
+def read_size(value):
+    """
+    Returns an InstanceSize from a stored size, like make_size(), but the unknown size if it
+    can't be read, e.g. an imported size of None, so replaying an Instance doesn't fail.
+
+    :rtype: InstanceSize
+    """
+    try:
+        return make_size(value)
+    except (TypeError, ValueError):
+        return UNKNOWN_SIZE
+
+
+_interned_values = {}
+
+
+def intern_value(value):
+    """
+    Returns a shared copy of the given string (of any type), or the given value if it isn't a string.
+    """
+    if not isinstance(value, six.string_types):
+        return value
+    return _interned_values.setdefault(value, value)
+
+
 class InstanceRepository(EntityRepository):
-    pass
+
+    @abstractmethod
+    def get_by_atmo_id(self, atmo_id):
+        """
+        Returns the most recently registered Instance with the given atmo_id.
+        """
+
+    @abstractmethod
+    def find_by_username(self, username):
+        """
+        Returns a list of the Instances belonging to the given username.
+        """
+
+
+# Namespace for the name-based entity IDs of Instances, made from their atmo_id.
+INSTANCE_ID_NAMESPACE = uuid.UUID('5b1d8a0e-6c8f-4f4e-9b7a-0d7e3c2a9f41')
+
+
+def make_instance_id(atmo_id):
+    """
+    Returns the name-based (version 5) UUID hex for the Instance with the given atmo_id.
+
+    The same atmo_id always gives the same entity ID.
+    """
+    return uuid.uuid5(INSTANCE_ID_NAMESPACE, str(atmo_id)).hex
 
 
-def register_new_instance(atmo_id, name, username):
+def register_new_instance(atmo_id, name, username, entity_id=None):
     """
     Factory method for Instance entities.
 
+    :param entity_id: ID for the new entity, e.g. from make_instance_id(). If not given a random ID is used.
     :rtype: Instance
     """
-    # Instead of generating a random entity_id, maybe we should generate a UUID from the atmo_id passed in?
-    # entity_id = uuid.UUID(int=atmo_id, version=4).hex
-    entity_id = uuid.uuid4().hex
+    if entity_id is None:
+        entity_id = uuid.uuid4().hex
     event = Instance.Created(entity_id=entity_id, atmo_id=atmo_id, name=name, username=username)
     entity = Instance.mutate(event=event)
     publish(event=event)
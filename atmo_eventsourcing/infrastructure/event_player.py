@@ -0,0 +1,86 @@
+from eventsourcing.infrastructure.event_player import EventPlayer
+from eventsourcing.utils.time import timestamp_long_from_uuid
+
+
+class AtmoEventPlayer(EventPlayer):
+    """
+    Event player which applies each entity's events together, with the domain class's mutate_all().
+
+    If the domain class has a page size, events are replayed as a stream: each page of stored
+    events is fetched when the previous one has been applied, then decoded and applied, so the
+    memory used doesn't grow with the length of the entity's history.
+    """
+
+    def __init__(self, event_store, id_prefix, mutate_func, mutate_all_func, **kwargs):
+        super(AtmoEventPlayer, self).__init__(event_store, id_prefix, mutate_func, **kwargs)
+        self.mutate_all = mutate_all_func
+
+    def replay_events(self, entity_id, after=None, until=None, initial_state=None):
+        # Copy initial state, to preserve state of given object.
+        if initial_state is not None:
+            initial_state_copy = object.__new__(type(initial_state))
+            initial_state_copy.__dict__.update(initial_state.__dict__)
+            initial_state = initial_state_copy
+
+        stored_entity_id = self.make_stored_entity_id(entity_id)
+        if not self.page_size:
+            # Get entity's domain events from the event store.
+            domain_events = self.event_store.get_entity_events(
+                stored_entity_id=stored_entity_id,
+                after=after,
+                until=until,
+                is_short=self.is_short
+            )
+            return self.mutate_all(domain_events, initial_state)
+
+        entity = initial_state
+        for domain_events in self.iterate_pages(stored_entity_id, after=after, until=until):
+            entity = self.mutate_all(domain_events, entity)
+        return entity
+
+    def iterate_pages(self, stored_entity_id, after=None, until=None):
+        """
+        Yields lists of up to `page_size` of the entity's domain events, in order, fetching each
+        page only when it is needed.
+
+        Each page after the first starts after the time of the last event of the page before, so
+        a page ending with events at the same time as the next stored event is extended with all
+        the events at that time, rather than the next page skipping them.
+        """
+        stored_event_repo = self.event_store.stored_event_repo
+        while True:
+            # Get one more event than a page, to see whether the page ends within events at the same time.
+            stored_events = stored_event_repo.get_entity_events(
+                stored_entity_id=stored_entity_id,
+                after=after,
+                until=until,
+                limit=self.page_size + 1,
+            )
+            if not stored_events:
+                return
+            is_last_page = len(stored_events) <= self.page_size
+            if not is_last_page:
+                next_timestamp = timestamp_long_from_uuid(stored_events.pop().event_id)
+                if next_timestamp == timestamp_long_from_uuid(stored_events[-1].event_id):
+                    self._complete_last_time(stored_event_repo, stored_events, after)
+            yield [stored_event_repo.deserialize(stored_event) for stored_event in stored_events]
+            if is_last_page:
+                return
+            after = stored_events[-1].event_id
+
+    @staticmethod
+    def _complete_last_time(stored_event_repo, stored_events, after):
+        """
+        Replaces the events at the time of the last of the given stored events with all the
+        entity's events at that time.
+        """
+        last = stored_events[-1]
+        timestamp = timestamp_long_from_uuid(last.event_id)
+        start = len(stored_events) - 1
+        while start > 0 and timestamp_long_from_uuid(stored_events[start - 1].event_id) == timestamp:
+            start -= 1
+        stored_events[start:] = stored_event_repo.get_entity_events(
+            stored_entity_id=last.stored_entity_id,
+            after=stored_events[start - 1].event_id if start else after,
+            until=last.event_id,
+        )
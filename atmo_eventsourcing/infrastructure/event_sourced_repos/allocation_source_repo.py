@@ -1,9 +1,8 @@
-from eventsourcing.infrastructure.event_sourced_repo import EventSourcedRepository
-
 from atmo_eventsourcing.domain.model.allocation_source import AllocationSourceRepository, AllocationSource
+from atmo_eventsourcing.infrastructure.event_sourced_repos.base import AtmoEventSourcedRepository
 
 
-class AllocationSourceRepo(EventSourcedRepository, AllocationSourceRepository):
+class AllocationSourceRepo(AtmoEventSourcedRepository, AllocationSourceRepository):
     """
     Event sourced repository for the AllocationSource domain model entity.
     """
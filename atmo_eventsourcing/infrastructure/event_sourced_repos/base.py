@@ -0,0 +1,275 @@
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from timeit import default_timer
+
+from eventsourcing.domain.model.entity import EntityVersionConsistencyError
+from eventsourcing.domain.model.events import subscribe, unsubscribe, DomainEvent
+from eventsourcing.domain.model.exceptions import ProgrammingError
+from eventsourcing.infrastructure.event_sourced_repo import EventSourcedRepository
+from eventsourcing.infrastructure.stored_events.transcoders import id_prefix_from_event
+
+from atmo_eventsourcing.infrastructure.event_player import AtmoEventPlayer
+from atmo_eventsourcing.infrastructure.persistence_subscriber import in_batch
+from atmo_eventsourcing.utils import instrumentation
+
+
+class SnapshotPolicy(object):
+    """
+    Decides when an entity is due a new snapshot.
+
+    A snapshot is due every `period` events (counted by entity version), or when
+    `interval` seconds have passed since the entity's last snapshot, whichever comes first.
+    """
+
+    def __init__(self, period=None, interval=None):
+        if period is None and interval is None:
+            raise ValueError("Snapshot policy needs a period or an interval")
+        if period is not None and period < 1:
+            raise ValueError("Snapshot period must be a positive number of events: {}".format(period))
+        if interval is not None and interval <= 0:
+            raise ValueError("Snapshot interval must be a positive number of seconds: {}".format(interval))
+        self.period = period
+        self.interval = interval
+
+    def is_due(self, entity_version, seconds_since_snapshot=None):
+        """
+        Returns True if an entity at the given version is due a snapshot.
+
+        :param entity_version: The version of the entity after the event was applied.
+        :param seconds_since_snapshot: Seconds since the entity was last snapshotted (None if unknown).
+        :rtype: bool
+        """
+        if self.period is not None and entity_version % self.period == 0:
+            return True
+        if self.interval is not None and seconds_since_snapshot is not None:
+            return seconds_since_snapshot >= self.interval
+        return False
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'tail_replays', 'misses', 'evictions', 'size', 'maxsize'])
+
+
+class AtmoEventSourcedRepository(EventSourcedRepository):
+    """
+    Base event sourced repository for the Atmosphere domain model entities.
+
+    If a snapshot policy is given, the repository subscribes to the entity's published
+    events and takes a snapshot whenever the policy says one is due. Since get_entity()
+    starts from the latest snapshot, lookups only replay the tail of events after it.
+    Repositories with a snapshot policy must be closed. Snapshots aren't taken while the
+    publishing thread has a persistence batch open, since its events aren't stored yet.
+
+    If a cache size is given, the repository keeps up to that many reconstituted entities,
+    evicting the least recently used. Each lookup checks the entity's most recent event in
+    the event store, so a cached entity is never stale: if newer events have been stored,
+    only those events are replayed onto the cached entity.
+    """
+
+    def __init__(self, event_store, snapshot_policy=None, cache_size=None, **kwargs):
+        super(AtmoEventSourcedRepository, self).__init__(event_store, **kwargs)
+        # Replay events through the domain class's mutate_all(), rather than one mutate() call per event.
+        event_player = self.event_player
+        self.event_player = AtmoEventPlayer(event_store, id_prefix=event_player.id_prefix,
+                                            mutate_func=event_player.mutate,
+                                            mutate_all_func=self.domain_class.mutate_all,
+                                            page_size=event_player.page_size, is_short=event_player.is_short)
+        assert isinstance(snapshot_policy, (SnapshotPolicy, type(None))), snapshot_policy
+        self.snapshot_policy = snapshot_policy
+        self._last_snapshot_times = {}
+        if self.snapshot_policy is not None:
+            subscribe(self.is_domain_class_event, self.take_snapshot_if_due)
+
+        if cache_size is not None and cache_size < 1:
+            raise ValueError("Cache size must be a positive number of entities: {}".format(cache_size))
+        self.cache_size = cache_size
+        self._entity_cache = OrderedDict()  # Entity ID -> (entity, ID of the last event applied to it).
+        self._entity_cache_lock = Lock()
+        self._cache_hits = 0
+        self._cache_tail_replays = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+
+    def __getitem__(self, entity_id):
+        if self.cache_size is None:
+            return super(AtmoEventSourcedRepository, self).__getitem__(entity_id)
+
+        # Find where the entity's history currently ends.
+        most_recent_event = self.event_player.get_most_recent_event(entity_id)
+        if most_recent_event is None:
+            self._discard_cached(entity_id)
+            raise KeyError(entity_id)
+        last_event_id = most_recent_event.domain_event_id
+
+        with self._entity_cache_lock:
+            cached = self._entity_cache.pop(entity_id, None)
+
+        entity = None
+        if cached is not None:
+            cached_entity, cached_event_id = cached
+            if cached_event_id == last_event_id:
+                self._cache_hits += 1
+                entity = cached_entity
+            else:
+                # Apply the newer events to (a copy of) the cached entity. The mutators
+                # check each event follows on from the entity's version.
+                try:
+                    entity = self.event_player.replay_events(entity_id, after=cached_event_id,
+                                                             until=last_event_id, initial_state=cached_entity)
+                except EntityVersionConsistencyError:
+                    pass
+                else:
+                    self._cache_tail_replays += 1
+                    if entity is None:
+                        raise KeyError(entity_id)
+
+        if entity is None:
+            self._cache_misses += 1
+            entity = self.get_entity(entity_id, until=last_event_id)
+            if entity is None:
+                raise KeyError(entity_id)
+
+        self._put_cached(entity_id, entity, last_event_id)
+
+        # Return a copy, so changes made by the caller don't leak into the cache.
+        return copy_entity(entity)
+
+    def _put_cached(self, entity_id, entity, last_event_id):
+        with self._entity_cache_lock:
+            self._entity_cache[entity_id] = (entity, last_event_id)
+            while len(self._entity_cache) > self.cache_size:
+                self._entity_cache.popitem(last=False)
+                self._cache_evictions += 1
+
+    def _discard_cached(self, entity_id):
+        with self._entity_cache_lock:
+            self._entity_cache.pop(entity_id, None)
+
+    def cache_info(self):
+        """
+        Returns statistics about the entity cache.
+
+        :rtype: CacheInfo
+        """
+        return CacheInfo(
+            hits=self._cache_hits,
+            tail_replays=self._cache_tail_replays,
+            misses=self._cache_misses,
+            evictions=self._cache_evictions,
+            size=len(self._entity_cache),
+            maxsize=self.cache_size,
+        )
+
+    def cache_clear(self):
+        with self._entity_cache_lock:
+            self._entity_cache.clear()
+
+    def get_entity(self, entity_id, until=None):
+        installed = instrumentation.get_installed()
+        if installed is None:
+            return super(AtmoEventSourcedRepository, self).get_entity(entity_id, until=until)
+        started = default_timer()
+        try:
+            return super(AtmoEventSourcedRepository, self).get_entity(entity_id, until=until)
+        finally:
+            installed.observe('replay', self.domain_class.__name__, default_timer() - started)
+
+    def get_entity_ids(self):
+        """
+        Returns the IDs of all the entities of the domain class which have events in the event store.
+
+        Needs a stored event repository with get_stored_entity_ids().
+        """
+        stored_event_repo = self.event_store.stored_event_repo
+        if not hasattr(stored_event_repo, 'get_stored_entity_ids'):
+            raise ProgrammingError("Can't list entity IDs in {}".format(type(stored_event_repo).__name__))
+        prefix = self.event_player.make_stored_entity_id('')
+        return [i[len(prefix):] for i in stored_event_repo.get_stored_entity_ids(prefix)]
+
+    def get_entities(self, until=None):
+        """
+        Yields all the entities of the domain class, optionally as they were at the given time.
+
+        Each entity is replayed from its latest snapshot before that time, so taking snapshots
+        periodically (see take_snapshots()) bounds the number of events replayed.
+        Entities not yet created, or already discarded, at that time are left out.
+        """
+        for entity_id in self.get_entity_ids():
+            entity = self.get_entity(entity_id, until=until)
+            if entity is not None:
+                yield entity
+
+    def take_snapshots(self, until=None):
+        """
+        Snapshots all the entities of the domain class, optionally as they were at the given time.
+
+        :return: The number of entities snapshotted.
+        """
+        count = 0
+        for entity_id in self.get_entity_ids():
+            # The event player can't snapshot discarded entities.
+            most_recent_event = self.event_player.get_most_recent_event(entity_id, until=until)
+            if most_recent_event is None or isinstance(most_recent_event, self.domain_class.Discarded):
+                continue
+            self.event_player.take_snapshot(entity_id, until=until)
+            count += 1
+        return count
+
+    def archive_history(self, until=None):
+        """
+        Archives each entity's events from before its latest snapshot (optionally, its latest
+        snapshot before the given time), so replays from the snapshot only read the live tail of
+        the entity's history. Historical states are still replayed, from the archive. Entities
+        without a snapshot are left as they are.
+
+        Needs a stored event repository with archive_entity_events().
+
+        :return: The number of events archived.
+        """
+        stored_event_repo = self.event_store.stored_event_repo
+        if not hasattr(stored_event_repo, 'archive_entity_events'):
+            raise ProgrammingError("Can't archive events in {}".format(type(stored_event_repo).__name__))
+        count = 0
+        for entity_id in self.get_entity_ids():
+            snapshot = self.event_player.get_snapshot(entity_id, until=until)
+            if snapshot is not None:
+                count += stored_event_repo.archive_entity_events(self.event_player.make_stored_entity_id(entity_id),
+                                                                 before=snapshot.at_event_id)
+        return count
+
+    def is_domain_class_event(self, event):
+        return isinstance(event, DomainEvent) and id_prefix_from_event(event) == self.domain_class.__name__
+
+    def take_snapshot_if_due(self, event):
+        entity_id = event.entity_id
+
+        # Discarded entities are never snapshotted again.
+        if isinstance(event, self.domain_class.Discarded):
+            self._last_snapshot_times.pop(entity_id, None)
+            return
+
+        # The event store doesn't have the batch's events yet, so wait for a later event.
+        if in_batch():
+            return
+
+        # Start the clock on entities we haven't seen before.
+        now = time.time()
+        last_snapshot_time = self._last_snapshot_times.setdefault(entity_id, now)
+
+        # The event carries the version the entity had before the event was applied.
+        if self.snapshot_policy.is_due(event.entity_version + 1, now - last_snapshot_time):
+            self.event_player.take_snapshot(entity_id)
+            self._last_snapshot_times[entity_id] = now
+
+    def close(self):
+        if self.snapshot_policy is not None:
+            unsubscribe(self.is_domain_class_event, self.take_snapshot_if_due)
+
+
+def copy_entity(entity):
+    """
+    Returns a shallow copy of the given entity, in the same way the event player copies initial state.
+    """
+    entity_copy = object.__new__(type(entity))
+    entity_copy.__dict__.update(entity.__dict__)
+    return entity_copy
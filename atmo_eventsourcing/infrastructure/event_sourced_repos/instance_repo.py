@@ -1,10 +1,57 @@
-from eventsourcing.infrastructure.event_sourced_repo import EventSourcedRepository
+from eventsourcing.domain.model.exceptions import ProgrammingError
 
 from atmo_eventsourcing.domain.model.instance import InstanceRepository, Instance
+from atmo_eventsourcing.infrastructure.event_sourced_repos.base import AtmoEventSourcedRepository
+from atmo_eventsourcing.infrastructure.event_store import AtmoEventStore
+from atmo_eventsourcing.infrastructure.instance_index import InstanceIndex
 
 
-class InstanceRepo(EventSourcedRepository, InstanceRepository):
+class InstanceRepo(AtmoEventSourcedRepository, InstanceRepository):
     """
     Event sourced repository for the Instance domain model entity.
+
+    If an instance index is given, the repository keeps it up to date with the Instance.Created
+    and Instance.Discarded events appended to the event store (unless the index is updated as the
+    events are stored), and uses it to find Instances by atmo_id and username.
     """
     domain_class = Instance
+
+    def __init__(self, event_store, index=None, **kwargs):
+        super(InstanceRepo, self).__init__(event_store, **kwargs)
+        assert isinstance(index, (InstanceIndex, type(None))), index
+        self.index = index
+        if self.index is not None and not self.index.updated_when_stored:
+            assert isinstance(event_store, AtmoEventStore), event_store
+            event_store.add_listener(self.update_index)
+
+    def update_index(self, domain_events):
+        index_events = [e for e in domain_events if isinstance(e, (Instance.Created, Instance.Discarded))]
+        if index_events:
+            self.index.update(index_events)
+
+    def get_by_atmo_id(self, atmo_id):
+        entity_id = self._get_index().get_entity_id(atmo_id)
+        if entity_id is None:
+            raise KeyError(atmo_id)
+        return self[entity_id]
+
+    def find_by_username(self, username):
+        entities = []
+        for entity_id in self._get_index().find_entity_ids(username):
+            try:
+                entities.append(self[entity_id])
+            except KeyError:
+                # Discarded since it was looked up in the index.
+                pass
+        return entities
+
+    def _get_index(self):
+        if self.index is None:
+            raise ProgrammingError("Instance repository has no index")
+        return self.index
+
+    def close(self):
+        super(InstanceRepo, self).close()
+        if self.index is not None:
+            self.event_store.remove_listener(self.update_index)
+            self.index.close()
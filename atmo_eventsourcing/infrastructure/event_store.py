@@ -0,0 +1,68 @@
+from timeit import default_timer
+
+from eventsourcing.infrastructure.event_store import EventStore
+
+from atmo_eventsourcing.utils import instrumentation
+
+
+class AtmoEventStore(EventStore):
+    """
+    Event store which can append several events together, and tells listeners about appended events.
+
+    Listeners are called with a list of the domain events, after they have been stored.
+    """
+
+    def __init__(self, stored_event_repo):
+        super(AtmoEventStore, self).__init__(stored_event_repo)
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def append(self, domain_event):
+        installed = instrumentation.get_installed()
+        if installed is None:
+            super(AtmoEventStore, self).append(domain_event)
+        else:
+            started = default_timer()
+            super(AtmoEventStore, self).append(domain_event)
+            installed.observe('append', instrumentation.event_type_name(domain_event), default_timer() - started)
+        self._notify_listeners([domain_event])
+
+    def append_many(self, domain_events):
+        """
+        Appends the given domain events together.
+
+        Stored event repositories which can write several events at once provide append_many(),
+        otherwise the events are appended one at a time.
+        """
+        installed = instrumentation.get_installed()
+        if installed is not None:
+            started = default_timer()
+
+        # Serialize the domain events.
+        stored_events = [self.stored_event_repo.serialize(domain_event) for domain_event in domain_events]
+
+        # Append the stored events to the stored event repo.
+        append_many = getattr(self.stored_event_repo, 'append_many', None)
+        if append_many is not None:
+            append_many(stored_events)
+        else:
+            for stored_event in stored_events:
+                self.stored_event_repo.append(stored_event)
+
+        if installed is not None and domain_events:
+            # Each event is recorded as taking its share of the time to append them all.
+            seconds = (default_timer() - started) / len(domain_events)
+            for domain_event in domain_events:
+                installed.observe('append', instrumentation.event_type_name(domain_event), seconds)
+
+        self._notify_listeners(domain_events)
+
+    def _notify_listeners(self, domain_events):
+        for listener in self._listeners:
+            listener(domain_events)
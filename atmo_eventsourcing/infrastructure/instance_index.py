@@ -0,0 +1,95 @@
+from abc import ABCMeta, abstractmethod
+
+import six
+from eventsourcing.domain.model.events import topic_from_domain_class
+
+from atmo_eventsourcing.domain.model.instance import Instance
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import EVENT_TOPIC_IDS
+
+# Topics of the events the instance index is made from, as stored by either event codec.
+INSTANCE_INDEX_TOPICS = frozenset(
+    [topic_from_domain_class(Instance.Created), topic_from_domain_class(Instance.Discarded)] +
+    [topic_id for topic_id, event_class in EVENT_TOPIC_IDS.items()
+     if event_class in (Instance.Created, Instance.Discarded)]
+)
+
+
+class InstanceIndex(six.with_metaclass(ABCMeta)):
+    """
+    Lookup index from Instance atmo_id and username to Instance entity IDs.
+
+    Several Instances may share an atmo_id (or a username). Lookups by atmo_id return the most
+    recently added entity ID, and lookups by username return entity IDs in the order they were added.
+    The atmo_id is indexed as a string, so it can be looked up whatever its type.
+    """
+
+    # Whether the index is updated as events are stored, by the stored event repository, so it
+    # needn't be updated with the events afterwards (see InstanceRepo).
+    updated_when_stored = False
+
+    def update(self, events):
+        """
+        Updates the index with the given Instance.Created and Instance.Discarded events.
+        """
+        for event in events:
+            if isinstance(event, Instance.Created):
+                self.add(event.entity_id, atmo_id=event.atmo_id, username=event.username)
+            else:
+                self.remove(event.entity_id)
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def add(self, entity_id, atmo_id, username):
+        """Adds an Instance to the index."""
+
+    @abstractmethod
+    def remove(self, entity_id):
+        """Removes an Instance from the index, if it is there."""
+
+    @abstractmethod
+    def get_entity_id(self, atmo_id):
+        """Returns the entity ID for the given atmo_id, or None if there isn't one.
+
+        :rtype: str, NoneType
+        """
+
+    @abstractmethod
+    def find_entity_ids(self, username):
+        """Returns the entity IDs for the given username.
+
+        :rtype: list
+        """
+
+
+class PythonObjectsInstanceIndex(InstanceIndex):
+
+    def __init__(self):
+        self._by_entity_id = {}
+        self._by_atmo_id = {}
+        self._by_username = {}
+
+    def add(self, entity_id, atmo_id, username):
+        self.remove(entity_id)
+        atmo_id = str(atmo_id)
+        self._by_entity_id[entity_id] = (atmo_id, username)
+        self._by_atmo_id.setdefault(atmo_id, []).append(entity_id)
+        self._by_username.setdefault(username, []).append(entity_id)
+
+    def remove(self, entity_id):
+        if entity_id not in self._by_entity_id:
+            return
+        atmo_id, username = self._by_entity_id.pop(entity_id)
+        for index, key in ((self._by_atmo_id, atmo_id), (self._by_username, username)):
+            entity_ids = index[key]
+            entity_ids.remove(entity_id)
+            if not entity_ids:
+                del index[key]
+
+    def get_entity_id(self, atmo_id):
+        entity_ids = self._by_atmo_id.get(str(atmo_id))
+        return entity_ids[-1] if entity_ids else None
+
+    def find_entity_ids(self, username):
+        return list(self._by_username.get(username, []))
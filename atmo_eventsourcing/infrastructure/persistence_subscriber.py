@@ -0,0 +1,168 @@
+import threading
+from contextlib import contextmanager
+from threading import RLock
+
+from eventsourcing.infrastructure.persistence_subscriber import PersistenceSubscriber
+from eventsourcing.utils.time import utc_now
+
+from atmo_eventsourcing.infrastructure.event_store import AtmoEventStore
+
+# Number of batches open in each thread, in any persistence subscriber.
+_open_batches = threading.local()
+
+
+def in_batch():
+    """
+    Returns True if the current thread has a batch open, so the events it publishes are held back.
+    """
+    return getattr(_open_batches, 'depth', 0) > 0
+
+
+class AtmoPersistenceSubscriber(PersistenceSubscriber):
+    """
+    Persistence subscriber which can hold back published domain events and store them together.
+
+    Batches belong to the thread which opens them: events published by other threads meanwhile
+    are stored as usual.
+    """
+
+    def __init__(self, event_store):
+        assert isinstance(event_store, AtmoEventStore), event_store
+        super(AtmoPersistenceSubscriber, self).__init__(event_store)
+        self._local = threading.local()
+
+    @property
+    def _batch(self):
+        """
+        The events held back by the current thread's batch, or None if it has no batch open.
+        """
+        return getattr(self._local, 'batch', None)
+
+    def store_domain_event(self, event):
+        batch = self._batch
+        if batch is not None:
+            batch.append(event)
+        else:
+            super(AtmoPersistenceSubscriber, self).store_domain_event(event)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager which stores all the domain events published inside it (by the current
+        thread) together, on exit.
+
+        If the block raises an exception, none of its events are stored. Batches can be nested,
+        in which case the events are stored when the outermost batch exits. The events aren't in
+        the event store until then, so repositories don't take snapshots while a batch is open.
+        """
+        local = self._local
+        if getattr(local, 'depth', 0) == 0:
+            local.batch = []
+            local.depth = 0
+        local.depth += 1
+        _open_batches.depth = getattr(_open_batches, 'depth', 0) + 1
+        try:
+            yield
+        except:
+            local.depth -= 1
+            _open_batches.depth -= 1
+            if local.depth == 0:
+                local.batch = None
+            raise
+        else:
+            local.depth -= 1
+            _open_batches.depth -= 1
+            if local.depth == 0:
+                events, local.batch = local.batch, None
+                if events:
+                    self.event_store.append_many(events)
+
+    def flush(self):
+        """
+        Stores any domain events held back by this subscriber, outside of a batch.
+        """
+
+
+class WriteBehindPersistenceSubscriber(AtmoPersistenceSubscriber):
+    """
+    Persistence subscriber which holds back published domain events, and stores them in batches.
+
+    The pending events are stored together when there are `batch_size` of them, or once the oldest
+    pending event is `interval` seconds old: when an event is published, or else by a timer thread,
+    so pending events are stored even if nothing more is published. Until then they are not
+    visible to the event store. Call flush() to wait until all pending events are stored.
+    """
+
+    def __init__(self, event_store, batch_size=None, interval=None):
+        if batch_size is None and interval is None:
+            raise ValueError("Write-behind needs a batch size or an interval")
+        super(WriteBehindPersistenceSubscriber, self).__init__(event_store)
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending = []
+        self._pending_since = None
+        self._pending_lock = RLock()
+        self._timer = None
+
+    def store_domain_event(self, event):
+        # Events published inside an explicit batch are stored with that batch.
+        batch = self._batch
+        if batch is not None:
+            batch.append(event)
+            return
+
+        with self._pending_lock:
+            now = utc_now()
+            if not self._pending:
+                self._pending_since = now
+                if self.interval is not None:
+                    self._start_timer()
+            self._pending.append(event)
+
+            if self.batch_size is not None and len(self._pending) >= self.batch_size:
+                self.flush()
+            elif self.interval is not None and now - self._pending_since >= self.interval:
+                self.flush()
+
+    def _start_timer(self):
+        self._timer = threading.Timer(self.interval, self._flush_when_due)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_when_due(self):
+        with self._pending_lock:
+            if not self._pending:
+                return
+            due = self._pending_since + self.interval - utc_now()
+            if due > 0:
+                # The events pending when the timer was started have been stored since.
+                self._timer = threading.Timer(due, self._flush_when_due)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+            try:
+                self.flush()
+            except Exception:
+                # Try again after another interval.
+                self._start_timer()
+                raise
+
+    def flush(self):
+        with self._pending_lock:
+            if not self._pending:
+                return
+            events, self._pending = self._pending, []
+            try:
+                self.event_store.append_many(events)
+            except:
+                # Keep the events, so they can be stored by the next flush.
+                self._pending = events + self._pending
+                raise
+            self._pending_since = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def close(self):
+        self.flush()
+        super(WriteBehindPersistenceSubscriber, self).close()
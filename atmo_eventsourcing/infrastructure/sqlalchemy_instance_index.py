@@ -0,0 +1,124 @@
+from sqlalchemy.ext.declarative.api import declarative_base
+from sqlalchemy.orm.scoping import ScopedSession
+from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.schema import Column, Sequence
+from sqlalchemy.sql.sqltypes import Integer, String
+
+from atmo_eventsourcing.domain.model.instance import Instance
+from atmo_eventsourcing.infrastructure.instance_index import InstanceIndex, INSTANCE_INDEX_TOPICS
+
+
+Base = declarative_base()
+
+
+class SqlInstanceIndexEntry(Base):
+
+    __tablename__ = 'instance_index'
+
+    id = Column(Integer, Sequence('instance_index_id_seq'), primary_key=True)
+    entity_id = Column(String(), unique=True)
+    atmo_id = Column(String(), index=True)
+    username = Column(String(), index=True)
+
+
+class SQLAlchemyInstanceIndex(InstanceIndex):
+    """
+    Instance index kept in an SQL table, next to the stored events.
+
+    Given the stored event repository, the index is updated in the same transaction as the events
+    are stored in, so it can't miss events which were stored, e.g. if the process stops between
+    the two. The index is only updated as events are stored, so an empty index on a database which
+    already has Instances must be rebuilt from their events (see AtmoEventSourcingApplicationWithSQLAlchemy).
+    """
+
+    def __init__(self, db_session, stored_event_repo=None):
+        assert isinstance(db_session, ScopedSession)
+        self.db_session = db_session
+        Base.metadata.create_all(self.db_session.get_bind())
+        self.stored_event_repo = stored_event_repo
+        if self.stored_event_repo is not None:
+            assert self.stored_event_repo.db_session is self.db_session
+            self.stored_event_repo.add_append_listener(self._update_with_stored_events)
+
+    @property
+    def updated_when_stored(self):
+        return self.stored_event_repo is not None
+
+    def update(self, events):
+        """
+        Updates the index with the given events in one transaction.
+        """
+        try:
+            self._update(events)
+            self.db_session.commit()
+        except:
+            self.db_session.rollback()
+            raise
+        finally:
+            self.db_session.close()
+
+    def _update(self, events):
+        for event in events:
+            self._remove(event.entity_id)
+            if isinstance(event, Instance.Created):
+                self._add(event.entity_id, event.atmo_id, event.username)
+
+    def _update_with_stored_events(self, stored_events):
+        # Called in the transaction which appends the stored events, which commits the changes.
+        self._update([self.stored_event_repo.deserialize(stored_event) for stored_event in stored_events
+                      if stored_event.event_topic in INSTANCE_INDEX_TOPICS])
+
+    def close(self):
+        if self.stored_event_repo is not None:
+            self.stored_event_repo.remove_append_listener(self._update_with_stored_events)
+
+    def is_empty(self):
+        try:
+            return self.db_session.query(SqlInstanceIndexEntry.id).first() is None
+        finally:
+            self.db_session.close()
+
+    def add(self, entity_id, atmo_id, username):
+        try:
+            self._remove(entity_id)
+            self._add(entity_id, atmo_id, username)
+            self.db_session.commit()
+        except:
+            self.db_session.rollback()
+            raise
+        finally:
+            self.db_session.close()
+
+    def remove(self, entity_id):
+        try:
+            self._remove(entity_id)
+            self.db_session.commit()
+        except:
+            self.db_session.rollback()
+            raise
+        finally:
+            self.db_session.close()
+
+    def _add(self, entity_id, atmo_id, username):
+        self.db_session.add(SqlInstanceIndexEntry(entity_id=entity_id, atmo_id=str(atmo_id), username=username))
+
+    def _remove(self, entity_id):
+        self.db_session.query(SqlInstanceIndexEntry).filter_by(entity_id=entity_id).delete()
+
+    def get_entity_id(self, atmo_id):
+        try:
+            query = self.db_session.query(SqlInstanceIndexEntry.entity_id)
+            query = query.filter_by(atmo_id=str(atmo_id)).order_by(desc(SqlInstanceIndexEntry.id))
+            row = query.first()
+        finally:
+            self.db_session.close()
+        return None if row is None else row.entity_id
+
+    def find_entity_ids(self, username):
+        try:
+            query = self.db_session.query(SqlInstanceIndexEntry.entity_id)
+            query = query.filter_by(username=username).order_by(SqlInstanceIndexEntry.id)
+            entity_ids = [row.entity_id for row in query]
+        finally:
+            self.db_session.close()
+        return entity_ids
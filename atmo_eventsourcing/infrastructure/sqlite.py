@@ -0,0 +1,64 @@
+"""
+Production profile for storing events in a SQLite database file.
+"""
+from eventsourcing.infrastructure.stored_events.sqlalchemy_stored_events import Base, SqlStoredEvent
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.schema import Index
+
+# Replays select an entity's events in a range of timestamps (taken from the event IDs), ordered
+# by row ID, so one index covers the whole range scan.
+STORED_EVENTS_REPLAY_INDEX = Index('stored_events_replay_idx', SqlStoredEvent.stored_entity_id,
+                                   SqlStoredEvent.timestamp_long, SqlStoredEvent.id)
+
+# WAL lets readers carry on while a writer appends, and with WAL, synchronous=NORMAL only risks
+# the last transactions (not corruption) on power loss. The cache size is in KiB when negative.
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -65536),
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'ON'),
+)
+
+
+def is_sqlite_file_uri(uri):
+    """
+    Returns True if the given database URI is for a SQLite database file (not in memory).
+    """
+    return uri is not None and uri.startswith('sqlite:///') and uri != 'sqlite:///:memory:'
+
+
+def create_sqlite_db_session(uri, pragmas=DEFAULT_PRAGMAS, pool_size=5, busy_timeout=30):
+    """
+    Returns a scoped session for the given SQLite database file, creating its tables and indexes.
+
+    Connections are pooled, so each thread's session checks out its own connection, and each new
+    connection is set up with the given PRAGMAs. Writers wait up to `busy_timeout` seconds for
+    the database to be free.
+    """
+    engine = create_engine(uri, poolclass=QueuePool, pool_size=pool_size,
+                           connect_args={'check_same_thread': False, 'timeout': busy_timeout})
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
+        finally:
+            cursor.close()
+
+    Base.metadata.create_all(engine)
+    create_indexes(engine)
+    return scoped_session(sessionmaker(bind=engine))
+
+
+def create_indexes(engine):
+    """
+    Creates the replay index on an existing stored events table, if it isn't there already.
+    """
+    existing = {index['name'] for index in inspect(engine).get_indexes(SqlStoredEvent.__tablename__)}
+    if STORED_EVENTS_REPLAY_INDEX.name not in existing:
+        STORED_EVENTS_REPLAY_INDEX.create(engine)
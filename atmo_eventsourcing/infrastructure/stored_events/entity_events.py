@@ -0,0 +1,59 @@
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+
+class EntityEvents(object):
+    """
+    An entity's events (or their positions in storage), in the order they were appended, with
+    the timestamps (100-ns intervals, from timestamp_long_from_uuid()) of their event IDs.
+
+    Events in a range of timestamps are found by bisecting the timestamps, so selecting a page of
+    events takes time and memory in proportion to the page, not to the length of the history.
+    """
+    __slots__ = ('timestamps', 'items', 'ordered')
+
+    def __init__(self):
+        self.timestamps = []
+        self.items = []
+        self.ordered = True  # Whether the timestamps are in order, so they can be bisected.
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, timestamp, item):
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            self.ordered = False
+        self.timestamps.append(timestamp)
+        self.items.append(item)
+
+    def select(self, after=None, until=None, limit=None, query_ascending=True):
+        """
+        Returns up to `limit` items in the given range of timestamps, in query order, like the
+        SQLAlchemy repository selects rows: when querying in ascending order, items after `after`
+        and up to `until`, and otherwise items from `after` and before `until`.
+        """
+        if not self.ordered:
+            indexes = range(len(self.items)) if query_ascending else range(len(self.items) - 1, -1, -1)
+            timestamps = self.timestamps
+            selected = (self.items[i] for i in indexes if _in_range(timestamps[i], after, until, query_ascending))
+            return list(islice(selected, limit))
+
+        bisect = bisect_right if query_ascending else bisect_left
+        start = 0 if after is None else bisect(self.timestamps, after)
+        end = len(self.timestamps) if until is None else bisect(self.timestamps, until)
+        if query_ascending:
+            if limit is not None:
+                end = min(end, start + limit)
+            return self.items[start:end]
+        if limit is not None:
+            start = max(start, end - limit)
+        return self.items[start:end][::-1]
+
+
+def _in_range(timestamp, after, until, query_ascending):
+    if query_ascending:
+        return (after is None or timestamp > after) and (until is None or timestamp <= until)
+    return (after is None or timestamp >= after) and (until is None or timestamp < until)
@@ -0,0 +1,312 @@
+"""
+Stored event repository which appends events to segmented log files, and reads them back through mmap.
+
+Each record in a segment is a header followed by the event ID, stored entity ID, topic and
+attributes, encoded as UTF-8:
+
+    body length, CRC-32, timestamp (from the event ID), event ID length, entity ID length, topic length
+
+The CRC covers everything after it, so a record torn by a crash is found (and cut off) when the
+log is opened again for writing. Segments are named by number, and a new one is started once the
+current segment is `segment_size` bytes or more.
+
+A log has a single writer: opening it for writing takes an exclusive lock on its directory (with
+fcntl.flock(), where available), so a second writer can't interleave its records, or cut off a
+record the first is still appending. Any number of readers can open it read-only alongside.
+"""
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from mmap import mmap, ACCESS_READ
+from threading import RLock
+
+from eventsourcing.domain.model.exceptions import ProgrammingError
+from eventsourcing.infrastructure.stored_events.base import StoredEventRepository
+from eventsourcing.infrastructure.stored_events.transcoders import StoredEvent
+from eventsourcing.utils.time import timestamp_long_from_uuid
+
+from atmo_eventsourcing.infrastructure.stored_events.entity_events import EntityEvents
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import JSONEventCodec
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_HEADER = struct.Struct('>IIqHHH')
+
+_SEGMENT_NAME = '{:08d}.log'
+
+
+class AtmoLogFileStoredEventRepository(StoredEventRepository):
+    """
+    Stored event repository which keeps events in append-only log files in the given directory.
+
+    Appends are written to the end of the current segment file, and reads are served from
+    read-only memory maps of the segments, through an in-memory index of the position of each
+    entity's events. The index is rebuilt by scanning the segments when the repository is opened.
+
+    Events are flushed to the operating system as they are appended, so they survive the process
+    crashing. Pass `sync=True` to also fsync() each append, so they survive the machine crashing.
+    Like the SQLAlchemy repository, discarded entities keep their history.
+
+    Only one repository at a time can open the directory for writing, and opening a second raises
+    ProgrammingError. Pass `read_only=True` to open it for reading alongside the writer, e.g. in
+    ParallelRebuilder workers. A read-only repository sees the events stored when it was opened,
+    never cuts off a torn record (which the writer may still be appending), and can't append.
+    """
+
+    serialize_with_uuid1 = True
+
+    def __init__(self, path, event_codec=None, segment_size=64 * 1024 * 1024, sync=False, read_only=False,
+                 **kwargs):
+        super(AtmoLogFileStoredEventRepository, self).__init__(**kwargs)
+        if segment_size <= 0:
+            raise ValueError("Segment size must be a positive number of bytes: {}".format(segment_size))
+        self.path = path
+        self.event_codec = event_codec if event_codec is not None else JSONEventCodec()
+        self.segment_size = segment_size
+        self.sync = sync
+        self.read_only = read_only
+        self._lock = RLock()
+        self._index = OrderedDict()  # Stored entity ID -> EntityEvents of (segment number, offset) positions.
+        self._maps = {}  # Segment number -> (mmap, mapped size).
+        self._sizes = []  # Size of each segment, by segment number.
+        self._file = None
+        self._directory_fd = None
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        if not self.read_only:
+            self._lock_directory()
+        try:
+            self._open_segments()
+        except Exception:
+            self.close()
+            raise
+
+    def _lock_directory(self):
+        if fcntl is None:
+            return
+        self._directory_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            fcntl.flock(self._directory_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(self._directory_fd)
+            self._directory_fd = None
+            raise ProgrammingError("Log {} is already open for writing".format(self.path))
+
+    def serialize(self, domain_event):
+        return self.event_codec.serialize(domain_event, json_encoder_cls=self.json_encoder_cls,
+                                          with_uuid1=self.serialize_with_uuid1)
+
+    def deserialize(self, stored_event):
+        return self.event_codec.deserialize(stored_event, json_decoder_cls=self.json_decoder_cls,
+                                            with_uuid1=self.serialize_with_uuid1)
+
+    def _segment_path(self, number):
+        return os.path.join(self.path, _SEGMENT_NAME.format(number))
+
+    def _open_segments(self):
+        names = sorted(name for name in os.listdir(self.path) if name.endswith('.log'))
+        numbers = [int(name[:-len('.log')]) for name in names]
+        if numbers != list(range(len(numbers))):
+            raise ValueError("Log segments in {} are not numbered consecutively: {}".format(self.path, names))
+        for number in numbers:
+            is_last = number == len(numbers) - 1
+            self._sizes.append(self._scan_segment(number, is_last=is_last))
+        if not self._sizes:
+            self._sizes.append(0)
+        if not self.read_only:
+            self._file = open(self._segment_path(len(self._sizes) - 1), 'ab')
+
+    def _scan_segment(self, number, is_last):
+        """
+        Adds the records in the given segment to the index, and returns the size of its valid records.
+
+        A torn record at the end of the last segment is cut off when writing (holding the lock on
+        the directory), and ignored when reading.
+        """
+        path = self._segment_path(number)
+        size = os.path.getsize(path)
+        offset = 0
+        if size:
+            with open(path, 'rb') as f:
+                data = mmap(f.fileno(), 0, access=ACCESS_READ)
+                try:
+                    while offset < size:
+                        record = _read_record_ids(data, offset, size)
+                        if record is None:
+                            break
+                        stored_entity_id, timestamp, length = record
+                        self._index_record(stored_entity_id, timestamp, (number, offset))
+                        offset += length
+                finally:
+                    data.close()
+        if offset < size:
+            if not is_last:
+                raise ValueError("Corrupt record in log segment {} at offset {}".format(path, offset))
+            if not self.read_only:
+                # Cut off the record torn by a crash while it was being appended.
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+        return offset
+
+    def _index_record(self, stored_entity_id, timestamp, position):
+        entity_events = self._index.get(stored_entity_id)
+        if entity_events is None:
+            entity_events = self._index[stored_entity_id] = EntityEvents()
+        entity_events.add(timestamp, position)
+
+    def append(self, stored_event):
+        self.append_many([stored_event])
+
+    def append_many(self, stored_events):
+        """
+        Appends the given stored events to the log with one write.
+        """
+        if self.read_only:
+            raise ProgrammingError("Log {} is open read-only".format(self.path))
+        if not stored_events:
+            return
+        with self._lock:
+            if self._sizes[-1] >= self.segment_size:
+                self._start_segment()
+            number = len(self._sizes) - 1
+            offset = self._sizes[-1]
+            records = []
+            positions = []
+            for stored_event in stored_events:
+                assert isinstance(stored_event, StoredEvent), stored_event
+                timestamp = timestamp_long_from_uuid(stored_event.event_id)
+                record = _encode_record(stored_event, timestamp)
+                positions.append((stored_event.stored_entity_id, timestamp, (number, offset)))
+                records.append(record)
+                offset += len(record)
+            self._file.write(b''.join(records))
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self._sizes[-1] = offset
+            for stored_entity_id, timestamp, position in positions:
+                self._index_record(stored_entity_id, timestamp, position)
+
+    def _start_segment(self):
+        self._file.close()
+        self._sizes.append(0)
+        self._file = open(self._segment_path(len(self._sizes) - 1), 'ab')
+
+    def get_entity_events(self, stored_entity_id, after=None, until=None, limit=None, query_ascending=True,
+                          results_ascending=True):
+        with self._lock:
+            entity_events = self._index.get(stored_entity_id)
+            if entity_events is None:
+                return []
+            positions = entity_events.select(
+                after=None if after is None else timestamp_long_from_uuid(after),
+                until=None if until is None else timestamp_long_from_uuid(until),
+                limit=limit,
+                query_ascending=query_ascending,
+            )
+            stored_events = [self._read_record(number, offset)[0] for number, offset in positions]
+        if results_ascending != query_ascending:
+            stored_events.reverse()
+        return stored_events
+
+    def iterate_stored_events(self, prefix=''):
+        """
+        Yields the stored events of the entities whose stored entity IDs start with the given prefix,
+        in the order they were appended.
+        """
+        with self._lock:
+            sizes = list(self._sizes)
+        for number, size in enumerate(sizes):
+            offset = 0
+            while offset < size:
+                with self._lock:
+                    stored_event, length = self._read_record(number, offset)
+                if stored_event.stored_entity_id.startswith(prefix):
+                    yield stored_event
+                offset += length
+
+    def _read_record(self, number, offset):
+        """
+        Returns the stored event at the given position, and the length of its record.
+        """
+        data = self._get_map(number, offset)
+        length, _, _, event_id_length, entity_id_length, topic_length = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        body = data[start:start + length - _HEADER.size]
+        event_id_end = event_id_length
+        entity_id_end = event_id_end + entity_id_length
+        topic_end = entity_id_end + topic_length
+        stored_event = StoredEvent(
+            event_id=body[:event_id_end].decode('utf-8'),
+            stored_entity_id=body[event_id_end:entity_id_end].decode('utf-8'),
+            event_topic=body[entity_id_end:topic_end].decode('utf-8'),
+            event_attrs=body[topic_end:].decode('utf-8'),
+        )
+        return stored_event, length
+
+    def _get_map(self, number, offset):
+        """
+        Returns a memory map of the given segment, remapping it if it has grown past the given offset.
+        """
+        mapped = self._maps.get(number)
+        if mapped is None or mapped[1] <= offset:
+            if mapped is not None:
+                mapped[0].close()
+            size = self._sizes[number]
+            with open(self._segment_path(number), 'rb') as f:
+                mapped = self._maps[number] = (mmap(f.fileno(), size, access=ACCESS_READ), size)
+        return mapped[0]
+
+    def get_stored_entity_ids(self, prefix):
+        """
+        Returns the stored entity IDs which start with the given prefix, in the order they were first appended.
+        """
+        with self._lock:
+            return [i for i in self._index if i.startswith(prefix)]
+
+    def close(self):
+        """
+        Closes the current segment file and the memory maps, and releases the lock on the directory.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            for data, _ in self._maps.values():
+                data.close()
+            self._maps.clear()
+            if self._directory_fd is not None:
+                # Closing the descriptor releases the lock.
+                os.close(self._directory_fd)
+                self._directory_fd = None
+
+
+def _encode_record(stored_event, timestamp):
+    event_id = stored_event.event_id.encode('utf-8')
+    stored_entity_id = stored_event.stored_entity_id.encode('utf-8')
+    topic = stored_event.event_topic.encode('utf-8')
+    attrs = stored_event.event_attrs.encode('utf-8')
+    body = b''.join((event_id, stored_entity_id, topic, attrs))
+    length = _HEADER.size + len(body)
+    checked = struct.pack('>qHHH', timestamp, len(event_id), len(stored_entity_id), len(topic)) + body
+    return struct.pack('>II', length, zlib.crc32(checked) & 0xffffffff) + checked
+
+
+def _read_record_ids(data, offset, size):
+    """
+    Returns the stored entity ID, timestamp and length of the record at the given offset, or None
+    if the record is incomplete or its checksum doesn't match.
+    """
+    if offset + _HEADER.size > size:
+        return None
+    length, crc, timestamp, event_id_length, entity_id_length, _ = _HEADER.unpack_from(data, offset)
+    if length < _HEADER.size or offset + length > size:
+        return None
+    if zlib.crc32(data[offset + 8:offset + length]) & 0xffffffff != crc:
+        return None
+    start = offset + _HEADER.size + event_id_length
+    return data[start:start + entity_id_length].decode('utf-8'), timestamp, length
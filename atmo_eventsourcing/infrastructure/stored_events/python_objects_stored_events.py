@@ -0,0 +1,46 @@
+from eventsourcing.infrastructure.stored_events.python_objects_stored_events import PythonObjectsStoredEventRepository
+from eventsourcing.infrastructure.stored_events.transcoders import StoredEvent
+from eventsourcing.utils.time import timestamp_long_from_uuid
+
+from atmo_eventsourcing.infrastructure.stored_events.entity_events import EntityEvents
+
+
+class AtmoPythonObjectsStoredEventRepository(PythonObjectsStoredEventRepository):
+    """
+    Python objects stored event repository which keeps each entity's events in EntityEvents, so
+    each page of a paged replay is found by bisecting, rather than by copying and filtering the
+    entity's whole history.
+
+    Unlike PythonObjectsStoredEventRepository, the events of discarded entities are kept, so
+    historical queries (e.g. get_state_at()) see entities as they were before being discarded.
+    """
+
+    def append(self, stored_event):
+        assert isinstance(stored_event, StoredEvent)
+        stored_entity_id = stored_event.stored_entity_id
+        entity_events = self._by_stored_entity_id.get(stored_entity_id)
+        if entity_events is None:
+            entity_events = self._by_stored_entity_id[stored_entity_id] = EntityEvents()
+        entity_events.add(timestamp_long_from_uuid(stored_event.event_id), stored_event)
+        self._by_id[stored_event.event_id] = stored_event
+
+    def get_entity_events(self, stored_entity_id, after=None, until=None, limit=None, query_ascending=True,
+                          results_ascending=True):
+        entity_events = self._by_stored_entity_id.get(stored_entity_id)
+        if entity_events is None:
+            return []
+        stored_events = entity_events.select(
+            after=None if after is None else timestamp_long_from_uuid(after),
+            until=None if until is None else timestamp_long_from_uuid(until),
+            limit=limit,
+            query_ascending=query_ascending,
+        )
+        if results_ascending != query_ascending:
+            stored_events.reverse()
+        return stored_events
+
+    def get_stored_entity_ids(self, prefix):
+        """
+        Returns the stored entity IDs which start with the given prefix.
+        """
+        return [i for i in self._by_stored_entity_id if i.startswith(prefix)]
@@ -0,0 +1,248 @@
+from heapq import merge
+
+from eventsourcing.infrastructure.stored_events.sqlalchemy_stored_events import SQLAlchemyStoredEventRepository, \
+    SqlStoredEvent, Base
+from eventsourcing.infrastructure.stored_events.transcoders import StoredEvent
+from eventsourcing.utils.time import timestamp_long_from_uuid
+from sqlalchemy import asc, desc, and_, select
+from sqlalchemy.sql.schema import Column, Index
+from sqlalchemy.sql.sqltypes import Integer, String, BigInteger
+
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import JSONEventCodec
+
+ARCHIVED_COLUMNS = ('id', 'event_id', 'timestamp_long', 'stored_entity_id', 'event_topic', 'event_attrs')
+
+
+class SqlArchivedEvent(Base):
+    """
+    Stored events moved out of the stored events table by archive_entity_events(), keeping their row IDs.
+    """
+
+    __tablename__ = 'archived_stored_events'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    event_id = Column(String())
+    timestamp_long = Column(BigInteger())
+    stored_entity_id = Column(String())
+    event_topic = Column(String())
+    event_attrs = Column(String())
+
+    __table_args__ = (
+        Index('archived_stored_events_replay_idx', 'stored_entity_id', 'timestamp_long', 'id'),
+    )
+
+
+def from_sql_row(row):
+    """
+    Returns a stored event from a row of either the stored events table or the archive.
+    """
+    return StoredEvent(
+        event_id=row.event_id,
+        stored_entity_id=row.stored_entity_id,
+        event_attrs=row.event_attrs,
+        event_topic=row.event_topic,
+    )
+
+
+class AtmoSQLAlchemyStoredEventRepository(SQLAlchemyStoredEventRepository):
+    """
+    SQLAlchemy stored event repository, which stores events with the given event codec (by default
+    JSONEventCodec, which stores them as eventsourcing does).
+
+    An entity's older events can be moved to the archive table (see archive_entity_events()), so the
+    stored events table, and its indexes, only hold the live tail of each entity's history. Queries
+    read the archive too, but archived events all come before the entity's live events, so a query
+    whose range starts after them (e.g. replaying from a snapshot) finds no archived events with one
+    index lookup, and one for the latest events is answered from the stored events table alone.
+
+    Append listeners are called with the stored events being appended, in the same transaction,
+    before it is committed, so whatever they write to the database is stored with the events or
+    not at all.
+    """
+
+    def __init__(self, db_session, event_codec=None, **kwargs):
+        super(AtmoSQLAlchemyStoredEventRepository, self).__init__(db_session=db_session, **kwargs)
+        self.event_codec = event_codec if event_codec is not None else JSONEventCodec()
+        self._append_listeners = []
+
+    def add_append_listener(self, listener):
+        self._append_listeners.append(listener)
+
+    def remove_append_listener(self, listener):
+        if listener in self._append_listeners:
+            self._append_listeners.remove(listener)
+
+    def serialize(self, domain_event):
+        return self.event_codec.serialize(domain_event, json_encoder_cls=self.json_encoder_cls,
+                                          with_uuid1=self.serialize_with_uuid1)
+
+    def deserialize(self, stored_event):
+        return self.event_codec.deserialize(stored_event, json_decoder_cls=self.json_decoder_cls,
+                                            with_uuid1=self.serialize_with_uuid1)
+
+    def get_entity_events(self, stored_entity_id, after=None, until=None, limit=None, query_ascending=True,
+                          results_ascending=True):
+        after = None if after is None else timestamp_long_from_uuid(after)
+        until = None if until is None else timestamp_long_from_uuid(until)
+        # Archived events come first in ascending order, and last in descending order.
+        tables = (SqlArchivedEvent, SqlStoredEvent) if query_ascending else (SqlStoredEvent, SqlArchivedEvent)
+        events = []
+        try:
+            for table in tables:
+                if limit is not None and len(events) >= limit:
+                    break
+                query = self._select_entity_events(table, stored_entity_id, after, until, query_ascending)
+                if limit is not None:
+                    query = query.limit(limit - len(events))
+                events.extend(from_sql_row(row) for row in query)
+        finally:
+            self.db_session.close()
+        if results_ascending and not query_ascending:
+            events.reverse()
+        return events
+
+    def _select_entity_events(self, table, stored_entity_id, after, until, query_ascending):
+        # Like the base class: in ascending order, after is exclusive and until is inclusive,
+        # and in descending order, after is inclusive and until is exclusive.
+        query = self.db_session.query(table).filter(table.stored_entity_id == stored_entity_id)
+        if query_ascending:
+            query = query.order_by(asc(table.id))
+            if after is not None:
+                query = query.filter(table.timestamp_long > after)
+            if until is not None:
+                query = query.filter(table.timestamp_long <= until)
+        else:
+            query = query.order_by(desc(table.id))
+            if after is not None:
+                query = query.filter(table.timestamp_long >= after)
+            if until is not None:
+                query = query.filter(table.timestamp_long < until)
+        return query
+
+    def archive_entity_events(self, stored_entity_id, before):
+        """
+        Moves the entity's events from before the given event ID (e.g. its latest snapshot's
+        at_event_id) into the archive table, in one transaction. The event itself stays, so each
+        entity keeps at least one event in the stored events table.
+
+        :return: The number of events archived.
+        """
+        live = SqlStoredEvent.__table__
+        condition = and_(live.c.stored_entity_id == stored_entity_id,
+                         live.c.timestamp_long < timestamp_long_from_uuid(before))
+        try:
+            self.db_session.execute(SqlArchivedEvent.__table__.insert().from_select(
+                ARCHIVED_COLUMNS, select([live.c[name] for name in ARCHIVED_COLUMNS]).where(condition)))
+            count = self.db_session.execute(live.delete().where(condition)).rowcount
+            self.db_session.commit()
+        except:
+            self.db_session.rollback()
+            raise
+        finally:
+            self.db_session.close()
+        return count
+
+    def append(self, stored_event):
+        self.append_many([stored_event])
+
+    def append_many(self, stored_events):
+        """
+        Saves the given stored events in one transaction, inserting all the rows with one executemany() INSERT.
+        """
+        if not stored_events:
+            return
+        rows = [
+            {
+                'event_id': stored_event.event_id,
+                'timestamp_long': timestamp_long_from_uuid(stored_event.event_id),
+                'stored_entity_id': stored_event.stored_entity_id,
+                'event_attrs': stored_event.event_attrs,
+                'event_topic': stored_event.event_topic,
+            }
+            for stored_event in stored_events
+        ]
+        try:
+            self.db_session.execute(SqlStoredEvent.__table__.insert(), rows)
+            for listener in self._append_listeners:
+                listener(stored_events)
+            self.db_session.commit()
+        except:
+            self.db_session.rollback()
+            raise
+        finally:
+            self.db_session.close()  # Begins a new transaction
+
+    def get_stored_entity_ids(self, prefix):
+        """
+        Returns the distinct stored entity IDs which start with the given prefix.
+        """
+        try:
+            query = self.db_session.query(SqlStoredEvent.stored_entity_id).distinct()
+            query = query.filter(SqlStoredEvent.stored_entity_id.startswith(prefix))
+            return [row.stored_entity_id for row in query]
+        finally:
+            self.db_session.close()
+
+    def iterate_stored_events(self, prefix='', topics=None, page_size=1000):
+        """
+        Yields the stored events, archived or not, whose stored entity IDs start with the given prefix,
+        in the order they were stored, optionally only those with the given topics. Events are read a
+        page at a time.
+        """
+        pages = [self._iterate_rows(table, prefix, topics, page_size) for table in (SqlArchivedEvent, SqlStoredEvent)]
+        for _, stored_event in merge(*pages):
+            yield stored_event
+
+    def _iterate_rows(self, table, prefix, topics, page_size):
+        # Yields (row ID, stored event) pairs from the given table, in row ID order.
+        last_id = None
+        while True:
+            try:
+                query = self.db_session.query(table).filter(table.stored_entity_id.startswith(prefix))
+                if topics is not None:
+                    query = query.filter(table.event_topic.in_(topics))
+                if last_id is not None:
+                    query = query.filter(table.id > last_id)
+                rows = query.order_by(asc(table.id)).limit(page_size).all()
+            finally:
+                self.db_session.close()
+            for row in rows:
+                yield row.id, from_sql_row(row)
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1].id
+
+    def reencode_stored_events(self, page_size=1000):
+        """
+        Rewrites the stored events, archived or not, which the event codec would now store
+        differently, e.g. to move a database's existing events to the packed codec. Events are
+        rewritten a page at a time, each page in one transaction.
+
+        :return: The number of events rewritten.
+        """
+        return sum(self._reencode_rows(table, page_size) for table in (SqlArchivedEvent, SqlStoredEvent))
+
+    def _reencode_rows(self, table, page_size):
+        count = 0
+        last_id = None
+        while True:
+            try:
+                query = self.db_session.query(table).order_by(asc(table.id))
+                if last_id is not None:
+                    query = query.filter(table.id > last_id)
+                rows = query.limit(page_size).all()
+                if not rows:
+                    return count
+                for row in rows:
+                    stored_event = self.serialize(self.deserialize(from_sql_row(row)))
+                    if (stored_event.event_topic, stored_event.event_attrs) != (row.event_topic, row.event_attrs):
+                        row.event_topic = stored_event.event_topic
+                        row.event_attrs = stored_event.event_attrs
+                        count += 1
+                last_id = rows[-1].id
+                self.db_session.commit()
+            except:
+                self.db_session.rollback()
+                raise
+            finally:
+                self.db_session.close()
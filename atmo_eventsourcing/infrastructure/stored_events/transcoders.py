@@ -0,0 +1,241 @@
+import base64
+import binascii
+import json
+import re
+import struct
+import uuid
+
+import six
+from eventsourcing.infrastructure.stored_events.transcoders import ObjectJSONEncoder, ObjectJSONDecoder, \
+    StoredEvent, serialize_domain_event, deserialize_domain_event, make_stored_entity_id, id_prefix_from_event
+
+from atmo_eventsourcing.domain.model.allocation_source import AllocationSource
+from atmo_eventsourcing.domain.model.instance import Instance
+
+
+class AtmoJSONEncoder(ObjectJSONEncoder):
+    """
+    JSON encoder for stored events and snapshots, which also encodes sets.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, (set, frozenset)):
+            return {'__set__': sorted(obj)}
+        return super(AtmoJSONEncoder, self).default(obj)
+
+
+class AtmoJSONDecoder(ObjectJSONDecoder):
+
+    def __init__(self, **kwargs):
+        # Skip ObjectJSONDecoder.__init__(), which fixes its own object hook.
+        json.JSONDecoder.__init__(self, object_hook=AtmoJSONDecoder.from_jsonable, **kwargs)
+
+    @staticmethod
+    def from_jsonable(d):
+        if '__set__' in d:
+            return set(d['__set__'])
+        return ObjectJSONDecoder.from_jsonable(d)
+
+
+# Short IDs stored in place of the topics of the Instance and Allocation Source events, by the
+# packed event codec. IDs must never be reused or changed, since stored events refer to them.
+EVENT_TOPIC_IDS = {
+    '1': Instance.Created,
+    '2': Instance.AttributeChanged,
+    '3': Instance.Discarded,
+    '4': Instance.Heartbeat,
+    '5': Instance.HeartbeatsRecorded,
+    '6': AllocationSource.Created,
+    '7': AllocationSource.AttributeChanged,
+    '8': AllocationSource.Discarded,
+    '9': AllocationSource.Heartbeat,
+    '10': AllocationSource.HeartbeatsRecorded,
+    '11': Instance.AttributesChanged,
+}
+
+_topic_ids_by_class = {event_class: topic_id for topic_id, event_class in EVENT_TOPIC_IDS.items()}
+
+# Strings packed as the 16 bytes of a UUID: the hex of UUIDs, as used for entity and event IDs.
+_uuid_hex_pattern = re.compile(r'[0-9a-f]{32}\Z')
+
+
+class JSONEventCodec(object):
+    """
+    Stores events as their topic and their attributes as JSON, like eventsourcing does by default.
+
+    Reads both JSON and packed stored events, so a database can be moved back from the packed codec.
+    """
+
+    def serialize(self, domain_event, json_encoder_cls=None, with_uuid1=False):
+        return serialize_domain_event(domain_event, json_encoder_cls=json_encoder_cls, with_uuid1=with_uuid1)
+
+    def deserialize(self, stored_event, json_decoder_cls=None, with_uuid1=False):
+        event_class = EVENT_TOPIC_IDS.get(stored_event.event_topic)
+        if event_class is None:
+            return deserialize_domain_event(stored_event, json_decoder_cls=json_decoder_cls, with_uuid1=with_uuid1)
+
+        attrs = unpack_values(base64.b64decode(stored_event.event_attrs), json_decoder_cls=json_decoder_cls)
+        entity_version, event_attrs = attrs[0], attrs[1]
+        # The entity ID isn't packed, since the stored entity ID has it.
+        event_attrs['entity_id'] = stored_event.stored_entity_id.partition('::')[2]
+        event_attrs['entity_version'] = entity_version
+        if with_uuid1:
+            event_attrs['domain_event_id'] = stored_event.event_id
+        domain_event = object.__new__(event_class)
+        domain_event.__dict__.update(event_attrs)
+        return domain_event
+
+
+class PackedEventCodec(JSONEventCodec):
+    """
+    Stores Instance and Allocation Source events compactly: the topic is replaced with a short ID
+    (see EVENT_TOPIC_IDS), the entity ID is left out (the stored entity ID has it), and the other
+    attributes are packed in a binary format, base64 encoded to fit the text column. UUID hex
+    strings among the attributes, e.g. an Allocation Source ID, are packed as their 16 bytes. Other
+    events, e.g. snapshots, are stored as JSON.
+
+    Reads both packed and JSON stored events, so existing databases can switch to this codec, and
+    AtmoSQLAlchemyStoredEventRepository.reencode_stored_events() can repack their old events.
+    """
+
+    def serialize(self, domain_event, json_encoder_cls=None, with_uuid1=False):
+        topic_id = _topic_ids_by_class.get(type(domain_event))
+        if topic_id is None:
+            return super(PackedEventCodec, self).serialize(domain_event, json_encoder_cls=json_encoder_cls,
+                                                           with_uuid1=with_uuid1)
+
+        event_attrs = domain_event.__dict__.copy()
+        if with_uuid1:
+            event_id = event_attrs.pop('domain_event_id')
+        else:
+            event_id = uuid.uuid4().hex
+        entity_id = event_attrs.pop('entity_id')
+        entity_version = event_attrs.pop('entity_version')
+        packed = pack_values([entity_version, event_attrs], json_encoder_cls=json_encoder_cls)
+        return StoredEvent(
+            event_id=event_id,
+            stored_entity_id=make_stored_entity_id(id_prefix_from_event(domain_event), entity_id),
+            event_topic=topic_id,
+            event_attrs=base64.b64encode(packed).decode('ascii'),
+        )
+
+
+def pack_values(values, json_encoder_cls=None):
+    """
+    Returns the given list of values packed as bytes.
+
+    None, bools, numbers, strings, lists, tuples (unpacked as lists) and dicts with string keys
+    are packed directly, anything else is packed as JSON. Strings which are the lower case hex of
+    a UUID are packed as its 16 bytes.
+    """
+    out = bytearray()
+    _pack_value(values, out, json_encoder_cls or AtmoJSONEncoder)
+    return bytes(out)
+
+
+def unpack_values(packed, json_decoder_cls=None):
+    """
+    Returns the values packed by pack_values().
+    """
+    value, _ = _unpack_value(bytearray(packed), 0, json_decoder_cls or AtmoJSONDecoder)
+    return value
+
+
+def _pack_value(value, out, json_encoder_cls):
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, six.integer_types):
+        out += b'i'
+        # Zigzag encode, so small negative numbers are short too.
+        _pack_varint(value * 2 if value >= 0 else -value * 2 - 1, out)
+    elif isinstance(value, float):
+        out += b'f'
+        out += struct.pack('>d', value)
+    elif isinstance(value, (six.text_type, six.binary_type)):
+        if len(value) == 32 and _uuid_hex_pattern.match(value):
+            out += b'u'
+            out += binascii.unhexlify(value)
+            return
+        if isinstance(value, six.text_type):
+            value = value.encode('utf8')
+        out += b's'
+        _pack_varint(len(value), out)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out += b'l'
+        _pack_varint(len(value), out)
+        for item in value:
+            _pack_value(item, out, json_encoder_cls)
+    elif isinstance(value, dict) and all(isinstance(k, six.string_types) for k in value):
+        out += b'm'
+        _pack_varint(len(value), out)
+        for key in sorted(value):
+            _pack_value(key, out, json_encoder_cls)
+            _pack_value(value[key], out, json_encoder_cls)
+    else:
+        value = json.dumps(value, separators=(',', ':'), sort_keys=True, cls=json_encoder_cls).encode('utf8')
+        out += b'j'
+        _pack_varint(len(value), out)
+        out += value
+
+
+def _unpack_value(packed, pos, json_decoder_cls):
+    tag = chr(packed[pos])
+    pos += 1
+    if tag == 'N':
+        return None, pos
+    if tag == 'T':
+        return True, pos
+    if tag == 'F':
+        return False, pos
+    if tag == 'i':
+        n, pos = _unpack_varint(packed, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    if tag == 'f':
+        return struct.unpack('>d', bytes(packed[pos:pos + 8]))[0], pos + 8
+    if tag == 'u':
+        return binascii.hexlify(bytes(packed[pos:pos + 16])).decode('ascii'), pos + 16
+    if tag in ('s', 'j'):
+        length, pos = _unpack_varint(packed, pos)
+        text = bytes(packed[pos:pos + length]).decode('utf8')
+        if tag == 'j':
+            return json.loads(text, cls=json_decoder_cls), pos + length
+        return text, pos + length
+    if tag == 'l':
+        length, pos = _unpack_varint(packed, pos)
+        items = []
+        for _ in range(length):
+            item, pos = _unpack_value(packed, pos, json_decoder_cls)
+            items.append(item)
+        return items, pos
+    if tag == 'm':
+        length, pos = _unpack_varint(packed, pos)
+        d = {}
+        for _ in range(length):
+            key, pos = _unpack_value(packed, pos, json_decoder_cls)
+            d[key], pos = _unpack_value(packed, pos, json_decoder_cls)
+        return d, pos
+    raise ValueError("Unknown packed value tag {!r} at {}".format(tag, pos - 1))
+
+
+def _pack_varint(n, out):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _unpack_varint(packed, pos):
+    n = 0
+    shift = 0
+    while True:
+        byte = packed[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
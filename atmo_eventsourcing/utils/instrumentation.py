@@ -0,0 +1,197 @@
+"""
+Optional instrumentation of the hot paths: publishing events, mutating entities, appending events to
+the event store, and replaying entities. Also counts events which were never written, such as
+attribute changes suppressed because the value didn't change.
+
+Instrumentation is process wide, like event publishing. Nothing is recorded until an Instrumentation
+is installed (e.g. by passing one to an AtmoEventSourcingApplication), and until then each hot path
+only pays for a check of the installed instrumentation.
+"""
+import threading
+from bisect import bisect_left
+from timeit import default_timer
+
+from eventsourcing.domain.model import events
+
+# Upper bounds of the latency histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+STAGES = ('publish', 'mutate', 'append', 'replay')
+
+_installed = None
+
+
+class Instrumentation(object):
+    """
+    Records how many times each stage ran for each event type, and a histogram of how long it took,
+    and counters by event type.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._metrics = {}  # (stage, event type) -> [count, sum, bucket counts...]
+        self._counters = {}  # (counter name, event type) -> count
+
+    def observe(self, stage, event_type, seconds):
+        """
+        Records that the given stage took the given number of seconds, for an event of the given type.
+        """
+        key = (stage, event_type)
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = [0, 0.0] + [0] * (len(self.buckets) + 1)
+            metric[0] += 1
+            metric[1] += seconds
+            metric[2 + bisect_left(self.buckets, seconds)] += 1
+
+    def increment(self, name, event_type, amount=1):
+        """
+        Adds to the named counter, for events of the given type.
+        """
+        key = (name, event_type)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+            self._counters.clear()
+
+    def counters(self):
+        """
+        Returns the counters, as a dict of counter name -> event type -> count.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        result = {}
+        for (name, event_type), count in counters.items():
+            result.setdefault(name, {})[event_type] = count
+        return result
+
+    def snapshot(self):
+        """
+        Returns the recorded metrics, as a dict of stage -> event type -> dict with the `count`, the
+        total `seconds` and the cumulative `buckets`, a list of (upper bound, count) pairs ending
+        with (inf, count).
+        """
+        with self._lock:
+            metrics = {key: list(metric) for key, metric in self._metrics.items()}
+        snapshot = {}
+        for (stage, event_type), metric in metrics.items():
+            cumulative = 0
+            buckets = []
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), metric[2:]):
+                cumulative += bucket_count
+                buckets.append((bound, cumulative))
+            snapshot.setdefault(stage, {})[event_type] = {
+                'count': metric[0],
+                'seconds': metric[1],
+                'buckets': buckets,
+            }
+        return snapshot
+
+    def prometheus_text(self):
+        """
+        Returns the recorded metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP atmo_eventsourcing_stage_seconds Time spent in each stage, by event type.',
+            '# TYPE atmo_eventsourcing_stage_seconds histogram',
+        ]
+        for stage, by_event_type in sorted(self.snapshot().items()):
+            for event_type, metric in sorted(by_event_type.items()):
+                labels = 'stage="{}",event_type="{}"'.format(stage, event_type)
+                for bound, count in metric['buckets']:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('atmo_eventsourcing_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, count))
+                lines.append('atmo_eventsourcing_stage_seconds_sum{{{}}} {!r}'.format(labels, metric['seconds']))
+                lines.append('atmo_eventsourcing_stage_seconds_count{{{}}} {}'.format(labels, metric['count']))
+        for name, by_event_type in sorted(self.counters().items()):
+            lines.append('# TYPE atmo_eventsourcing_{}_total counter'.format(name))
+            for event_type, count in sorted(by_event_type.items()):
+                lines.append('atmo_eventsourcing_{}_total{{event_type="{}"}} {}'.format(name, event_type, count))
+        return '\n'.join(lines) + '\n'
+
+    def wsgi_app(self, environ, start_response):
+        """
+        WSGI application serving the metrics for Prometheus to scrape.
+        """
+        body = self.prometheus_text().encode('utf8')
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def install(instrumentation):
+    """
+    Starts recording the hot paths with the given instrumentation (or stops recording, given None).
+    """
+    global _installed
+    assert isinstance(instrumentation, (Instrumentation, type(None))), instrumentation
+    _installed = instrumentation
+
+
+def get_installed():
+    """
+    :rtype: Instrumentation
+    """
+    return _installed
+
+
+def event_type_name(event):
+    return type(event).__qualname__
+
+
+def publish(event):
+    """
+    Publishes the given event, recording how long its subscribers took.
+    """
+    instrumentation = _installed
+    if instrumentation is None:
+        return events.publish(event)
+    started = default_timer()
+    try:
+        events.publish(event)
+    finally:
+        instrumentation.observe('publish', event_type_name(event), default_timer() - started)
+
+
+def increment(name, event_type):
+    """
+    Adds one to the named counter, for events of the given type (a class), if instrumentation is installed.
+    """
+    instrumentation = _installed
+    if instrumentation is not None:
+        instrumentation.increment(name, event_type.__qualname__)
+
+
+def call(stage, event_type, func, *args):
+    """
+    Calls func(*args), recording how long it took as the given stage, for events of the given type (a class).
+
+    For timing library methods which publish events, e.g. EventSourcedEntity.discard(), as a whole.
+    """
+    instrumentation = _installed
+    if instrumentation is None:
+        return func(*args)
+    started = default_timer()
+    try:
+        return func(*args)
+    finally:
+        instrumentation.observe(stage, event_type.__qualname__, default_timer() - started)
+
+
+def mutate(mutator, event, initial):
+    """
+    Applies the given event with the given mutator, recording how long it took.
+    """
+    instrumentation = _installed
+    if instrumentation is None:
+        return mutator(event, initial)
+    started = default_timer()
+    try:
+        return mutator(event, initial)
+    finally:
+        instrumentation.observe('mutate', event_type_name(event), default_timer() - started)
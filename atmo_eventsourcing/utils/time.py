@@ -1,8 +1,15 @@
+import binascii
 import datetime
+import random
 import uuid
 
 from eventsourcing.utils.time import utc_timezone
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def datetime_to_timestamp(a_datetime):
     """Generate a Unix timestamp for a datetime.
@@ -46,3 +53,113 @@ def uuid_from_timestamp(unix_timestamp, node=None, clock_seq=None):
 
 def uuid_from_datetime(a_datetime):
     return uuid_from_timestamp(datetime_to_timestamp(a_datetime))
+
+
+_node = None
+
+
+def get_node():
+    """Returns the hardware address from uuid.getnode(), looking it up only once.
+    """
+    global _node
+    if _node is None:
+        _node = uuid.getnode()
+    return _node
+
+
+def uuids_from_timestamps(unix_timestamps, node=None, clock_seq=None):
+    """Generate version 1 UUIDs for a batch of Unix timestamps.
+
+    Gives the same UUIDs as calling uuid_from_timestamp() for each timestamp with the same
+    'clock_seq', except that timestamps which are equal (to 100 ns) are moved on by 100 ns at a
+    time, in the order given, until each UUID has a time of its own. So the UUIDs' times strictly
+    increase with the timestamps, and stores which compare event IDs by time (timestamp_long)
+    never see two events of a batch at the same time.
+
+    :param unix_timestamps: Sequence or NumPy array of (float) times in seconds since the Epoch.
+    :param node: If 'node' is not given, uuid.getnode() is used to obtain the hardware address
+    :param clock_seq: The sequence number. If not given a random 14-bit sequence number is chosen
+    :return: list of uuid.UUID
+    """
+    return [uuid.UUID(hex=h) for h in uuid_hexes_from_timestamps(unix_timestamps, node=node, clock_seq=clock_seq)]
+
+
+def uuid_hexes_from_timestamps(unix_timestamps, node=None, clock_seq=None):
+    """Generate the hex strings of version 1 UUIDs for a batch of Unix timestamps.
+
+    See uuids_from_timestamps(). Uses NumPy to make all the UUIDs in one pass, if it is installed.
+
+    :return: list of str
+    """
+    if node is None:
+        node = get_node()
+    if clock_seq is None:
+        clock_seq = random.randrange(1 << 14)
+    if numpy is not None:
+        return _uuid_hexes_with_numpy(unix_timestamps, node, clock_seq)
+    else:
+        return _uuid_hexes_with_python(unix_timestamps, node, clock_seq)
+
+
+def _uuid_hexes_with_python(unix_timestamps, node, clock_seq):
+    # As uuid_from_timestamp().
+    timestamps = [int(unix_timestamp * 1e9) // 100 + 0x01b21dd213814000 for unix_timestamp in unix_timestamps]
+
+    # Move each timestamp on past the ones before it in time order (equal ones in the order given).
+    last = None
+    for i in sorted(range(len(timestamps)), key=timestamps.__getitem__):
+        if last is not None and timestamps[i] <= last:
+            timestamps[i] = last + 1
+        last = timestamps[i]
+
+    node_hex = '%012x' % node
+    clock_seq_hex = '%02x%02x' % (((clock_seq >> 8) & 0x3f) | 0x80, clock_seq & 0xff)
+    return [
+        '%08x%04x%04x%s%s' % (
+            timestamp & 0xffffffff,
+            (timestamp >> 32) & 0xffff,
+            ((timestamp >> 48) & 0x0fff) | 0x1000,
+            clock_seq_hex,
+            node_hex,
+        )
+        for timestamp in timestamps
+    ]
+
+
+_uuid_dtype = None if numpy is None else numpy.dtype([
+    ('time_low', '>u4'),
+    ('time_mid', '>u2'),
+    ('time_hi_version', '>u2'),
+    ('clock_seq_hi_variant', 'u1'),
+    ('clock_seq_low', 'u1'),
+    ('node_hi', '>u2'),
+    ('node_low', '>u4'),
+])
+
+
+def _uuid_hexes_with_numpy(unix_timestamps, node, clock_seq):
+    unix_timestamps = numpy.asarray(unix_timestamps, dtype=numpy.float64)
+    count = len(unix_timestamps)
+    if count == 0:
+        return []
+
+    # As uuid_from_timestamp(), with int64 arithmetic.
+    timestamps = (unix_timestamps * 1e9).astype(numpy.int64) // 100 + 0x01b21dd213814000
+
+    # Move each timestamp on past the ones before it in time order (equal ones in the order given):
+    # in time order, the i-th is at least the largest of the earlier (timestamp - position), plus i.
+    order = numpy.argsort(timestamps, kind='mergesort')
+    positions = numpy.arange(count)
+    timestamps[order] = numpy.maximum.accumulate(timestamps[order] - positions) + positions
+
+    # Lay out the fields in a big-endian record per UUID, and hexlify all the records at once.
+    records = numpy.empty(count, dtype=_uuid_dtype)
+    records['time_low'] = timestamps & 0xffffffff
+    records['time_mid'] = (timestamps >> 32) & 0xffff
+    records['time_hi_version'] = ((timestamps >> 48) & 0x0fff) | 0x1000
+    records['clock_seq_hi_variant'] = ((clock_seq >> 8) & 0x3f) | 0x80
+    records['clock_seq_low'] = clock_seq & 0xff
+    records['node_hi'] = (node >> 32) & 0xffff
+    records['node_low'] = node & 0xffffffff
+    all_hex = binascii.hexlify(records.tobytes()).decode('ascii')
+    return [all_hex[i:i + 32] for i in range(0, count * 32, 32)]
@@ -0,0 +1,56 @@
+"""
+Compares the size of stored events, and how fast they are encoded and decoded, with the JSON and
+packed event codecs.
+
+Run from the project root:
+
+    python benchmarks/bench_codecs.py [number_of_events]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+sys.path.insert(0, '.')
+
+from atmo_eventsourcing.domain.model.instance import Instance  # noqa: E402
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import JSONEventCodec, PackedEventCodec, \
+    AtmoJSONEncoder, AtmoJSONDecoder  # noqa: E402
+
+
+def make_events(count):
+    entity_id = '2606ef2ae1a243a688a45f334c0e8880'
+    return {
+        'Heartbeat': [Instance.Heartbeat(entity_id=entity_id, entity_version=i) for i in range(count)],
+        'AttributeChanged': [Instance.AttributeChanged(entity_id=entity_id, entity_version=i, name='_status',
+                                                       value='active') for i in range(count)],
+        'Created': [Instance.Created(entity_id=entity_id, atmo_id=i, name='Ubuntu 14.04.2 XFCE Base',
+                                     username='amitj') for i in range(count)],
+    }
+
+
+def main(count=10000, repeat=3):
+    print('{} events of each type'.format(count))
+    print('{:<18} {:<8} {:>12} {:>14} {:>14}'.format('event', 'codec', 'bytes/event', 'encode/s', 'decode/s'))
+    for name, events in sorted(make_events(count).items()):
+        for codec in [JSONEventCodec(), PackedEventCodec()]:
+            def encode():
+                return [codec.serialize(e, json_encoder_cls=AtmoJSONEncoder, with_uuid1=True) for e in events]
+
+            stored_events = encode()
+
+            def decode():
+                return [codec.deserialize(s, json_decoder_cls=AtmoJSONDecoder, with_uuid1=True)
+                        for s in stored_events]
+
+            # The event ID and stored entity ID columns are the same for both codecs.
+            size = sum(len(s.event_topic) + len(s.event_attrs) for s in stored_events)
+            encode_seconds = min(timeit.repeat(encode, number=1, repeat=repeat))
+            decode_seconds = min(timeit.repeat(decode, number=1, repeat=repeat))
+            print('{:<18} {:<8} {:>12.1f} {:>14.0f} {:>14.0f}'.format(
+                name, type(codec).__name__.replace('EventCodec', ''), float(size) / count,
+                count / encode_seconds, count / decode_seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
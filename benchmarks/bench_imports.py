@@ -0,0 +1,58 @@
+"""
+Measures cold start: the time to import the domain model, and each backend's application by name,
+each in a new Python process. Also shows how many modules each import loads, and whether
+SQLAlchemy is among them.
+
+Run from the project root:
+
+    python benchmarks/bench_imports.py [repeat]
+"""
+from __future__ import print_function
+
+import json
+import subprocess
+import sys
+
+sys.path.insert(0, '.')
+
+from atmo_eventsourcing.application.atmo import BACKENDS  # noqa: E402
+
+# Run in each new process: times the statement, and reports the modules it imported.
+SCRIPT = """
+import json, sys, time
+sys.path.insert(0, '.')
+before = set(sys.modules)
+started = time.time()
+{}
+seconds = time.time() - started
+loaded = [m for m in set(sys.modules) - before if sys.modules[m] is not None]
+print(json.dumps([seconds, len(loaded), any(m.split('.')[0] == 'sqlalchemy' for m in loaded)]))
+"""
+
+CASES = [
+    ('domain model', 'import atmo_eventsourcing.domain.model.instance, '
+                     'atmo_eventsourcing.domain.model.allocation_source'),
+    ('application package', 'import atmo_eventsourcing.application.atmo'),
+] + [
+    ('backend ' + name, 'from atmo_eventsourcing.application.atmo import get_application_class; '
+                        'get_application_class({!r})'.format(name))
+    for name in sorted(BACKENDS)
+]
+
+
+def time_import(statement):
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(statement)])
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def main(repeat=5):
+    print('{:<25} {:>10} {:>8} {:>11}'.format('import', 'best ms', 'modules', 'sqlalchemy'))
+    for name, statement in CASES:
+        results = [time_import(statement) for _ in range(repeat)]
+        seconds = min(r[0] for r in results)
+        count, uses_sqlalchemy = results[0][1:]
+        print('{:<25} {:>10.1f} {:>8} {:>11}'.format(name, seconds * 1000, count, 'yes' if uses_sqlalchemy else 'no'))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
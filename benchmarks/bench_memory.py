@@ -0,0 +1,67 @@
+"""
+Compares the memory used per Instance when keeping Instance entities in memory, and when keeping
+their compact InstanceState.
+
+Objects shared between Instances (e.g. interned status strings) are counted once, so the figures
+are the cost of each extra Instance.
+
+Run from the project root:
+
+    python benchmarks/bench_memory.py [number_of_instances]
+"""
+from __future__ import print_function
+
+import sys
+
+sys.path.insert(0, '.')
+
+from atmo_eventsourcing.domain.model.instance import Instance  # noqa: E402
+
+
+def deep_size(objects):
+    """
+    Returns the number of bytes used by the given objects, and everything they refer to.
+    """
+    seen = set()
+    total = 0
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+            pending.append(obj.__dict__)
+    return total
+
+
+def make_instances(count):
+    instances = []
+    for atmo_id in range(count):
+        instance = Instance.mutate(event=Instance.Created(entity_id='%032x' % atmo_id, atmo_id=atmo_id,
+                                                          name='Ubuntu 14.04.2 XFCE Base', username='amitj'))
+        instance = Instance.mutate(instance, Instance.AttributeChanged(
+            entity_id=instance.id, entity_version=instance.version, name='_status', value=''.join(['act', 'ive'])))
+        instance = Instance.mutate(instance, Instance.AttributeChanged(
+            entity_id=instance.id, entity_version=instance.version, name='_size', value=[16, 65536, 0]))
+        instances.append(instance)
+    return instances
+
+
+def main(count=10000):
+    instances = make_instances(count)
+    states = [instance.get_state() for instance in instances]
+
+    print('{} instances'.format(count))
+    for label, objects in [('Instance entities', instances), ('InstanceState', states)]:
+        print('{:<20} {:>8.0f} bytes/instance'.format(label, float(deep_size(objects)) / count))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
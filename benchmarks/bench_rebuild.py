@@ -0,0 +1,52 @@
+"""
+Compares rebuilding every Instance with ParallelRebuilder using different numbers of processes.
+
+Run from the project root:
+
+    python benchmarks/bench_rebuild.py [number_of_instances] [events_per_instance]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from functools import partial
+from multiprocessing import cpu_count
+
+sys.path.insert(0, '.')
+
+from atmo_eventsourcing.application.atmo.rebuild import ParallelRebuilder  # noqa: E402
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy  # noqa: E402,E501
+
+
+def main(count=2000, events=20):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        app_factory = partial(AtmoEventSourcingApplicationWithSQLAlchemy,
+                              db_uri='sqlite:///' + os.path.join(temp_dir, 'events.db'))
+        with app_factory(write_behind_batch_size=10000) as app:
+            for atmo_id in range(count):
+                instance = app.register_new_instance(atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base',
+                                                     username='amitj')
+                for _ in range(events - 1):
+                    instance.beat_heart()
+
+        print('{} instances, {} events each, {} CPUs'.format(count, events, cpu_count()))
+        processes = 1
+        baseline = None
+        while processes <= cpu_count():
+            started = time.time()
+            ParallelRebuilder(app_factory, processes=processes).rebuild()
+            seconds = time.time() - started
+            baseline = baseline or seconds
+            print('{:>3} processes {:>10.3f} s {:>10.0f} instances/s {:>6.2f}x'.format(
+                processes, seconds, count / seconds, baseline / seconds))
+            processes *= 2
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
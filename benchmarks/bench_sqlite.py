@@ -0,0 +1,108 @@
+"""
+Measures append and replay throughput of the SQLAlchemy application on a SQLite database file
+with the production profile, as the database grows to millions of events.
+
+Events are appended in batches (as with write-behind persistence) to a fleet of Instances. After
+each step, a sample of Instances is replayed in full, and over a range of their history.
+
+Run from the project root:
+
+    python benchmarks/bench_sqlite.py [number_of_events] [number_of_instances] [--keep path]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy  # noqa: E402,E501
+from atmo_eventsourcing.domain.model.instance import Instance, make_instance_id  # noqa: E402
+from atmo_eventsourcing.utils.time import uuid_hexes_from_timestamps  # noqa: E402
+
+START = 1451606400.0  # 2016-01-01T00:00:00Z
+
+
+def append_events(app, instances, versions, count, batch_size, clock):
+    """
+    Appends the given number of heartbeats to random Instances, and returns the number of seconds taken.
+    """
+    seconds = 0.0
+    for _ in range(0, count, batch_size):
+        entity_ids = [random.choice(instances) for _ in range(batch_size)]
+        timestamps = [clock[0] + i * 0.001 for i in range(batch_size)]
+        clock[0] += batch_size * 0.001
+        events = []
+        for entity_id, event_id in zip(entity_ids, uuid_hexes_from_timestamps(timestamps)):
+            events.append(Instance.Heartbeat(entity_id=entity_id, entity_version=versions[entity_id],
+                                             domain_event_id=event_id))
+            versions[entity_id] += 1
+        started = time.time()
+        app.event_store.append_many(events)
+        seconds += time.time() - started
+    return seconds
+
+
+def replay(app, entity_ids, until=None):
+    events = 0
+    started = time.time()
+    for entity_id in entity_ids:
+        events += app.instance_repo.get_entity(entity_id, until=until).version
+    return time.time() - started, events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite production profile.")
+    parser.add_argument('events', type=int, nargs='?', default=3000000)
+    parser.add_argument('instances', type=int, nargs='?', default=20000)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--sample', type=int, default=200, help="Number of Instances replayed after each step.")
+    parser.add_argument('--keep', default=None, help="Keep the database at this path.")
+    args = parser.parse_args(argv)
+
+    random.seed(0)
+    temp_dir = tempfile.mkdtemp()
+    db_path = args.keep or os.path.join(temp_dir, 'events.db')
+    try:
+        with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///' + db_path) as app:
+            # Register the Instances directly in the event store, with increasing timestamps.
+            clock = [START]
+            instances = [make_instance_id(atmo_id) for atmo_id in range(args.instances)]
+            event_ids = uuid_hexes_from_timestamps([START + i * 0.001 for i in range(args.instances)])
+            clock[0] += args.instances * 0.001
+            app.event_store.append_many([
+                Instance.Created(entity_id=entity_id, atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base',
+                                 username='amitj', domain_event_id=event_id)
+                for atmo_id, (entity_id, event_id) in enumerate(zip(instances, event_ids))
+            ])
+            versions = dict.fromkeys(instances, 1)
+
+            print('{:>10} {:>12} {:>14} {:>16} {:>16}'.format('events', 'db MB', 'append/s', 'replay events/s',
+                                                               'range events/s'))
+            total = args.instances
+            step = (args.events - total) // args.steps
+            for _ in range(args.steps):
+                append_seconds = append_events(app, instances, versions, step, args.batch_size, clock)
+                total += step
+
+                sample = random.sample(instances, min(args.sample, len(instances)))
+                replay_seconds, replayed = replay(app, sample)
+                # Replay up to the middle of the history so far.
+                until = uuid_hexes_from_timestamps([(START + clock[0]) / 2])[0]
+                range_seconds, range_replayed = replay(app, sample, until=until)
+
+                print('{:>10} {:>12.1f} {:>14.0f} {:>16.0f} {:>16.0f}'.format(
+                    total, os.path.getsize(db_path) / 1e6, step / append_seconds, replayed / replay_seconds,
+                    range_replayed / range_seconds))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Benchmarks the domain model against the storage backends: the Python objects backend, the
+SQLAlchemy backend with a SQLite database file, and the log files backend.
+
+Each benchmark is run several times, each time with a new application, and the best time is kept.
+Results are printed, and can be written as JSON and compared with an earlier run:
+
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --compare before.json
+
+Run from the project root.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+
+from eventsourcing.domain.model.events import create_domain_event_id  # noqa: E402
+
+from atmo_eventsourcing.application.atmo import create_application  # noqa: E402
+
+
+def register_new_instance(app, count, history):
+    def run():
+        for atmo_id in range(count):
+            app.register_new_instance(atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+    return run
+
+
+def beat_heart(app, count, history):
+    instance = make_instance(app, history)
+
+    def run():
+        for _ in range(count):
+            instance.beat_heart()
+    return run
+
+
+def change_attribute(app, count, history):
+    instance = make_instance(app, history)
+
+    def run():
+        for i in range(count):
+            instance.status = 'active' if i % 2 else 'suspended'
+    return run
+
+
+def update_attributes(app, count, history):
+    instance = make_instance(app, history)
+
+    def run():
+        for i in range(count):
+            instance.update(status='active' if i % 2 else 'suspended', activity='', size=(i % 8 + 1, 4096, 20))
+    return run
+
+
+def get_instance(app, count, history):
+    instance = make_instance(app, history)
+
+    def run():
+        for _ in range(count):
+            app.instance_repo[instance.id]
+    return run
+
+
+def take_snapshot(app, count, history):
+    # A snapshot is only taken if there are events since the last, so snapshot a new Instance each time.
+    instances = [make_instance(app, history, atmo_id=atmo_id) for atmo_id in range(count)]
+
+    def run():
+        for instance in instances:
+            app.instance_repo.event_player.take_snapshot(instance.id)
+    return run
+
+
+def replay_until(app, count, history):
+    instance = make_instance(app, history // 2)
+    until = create_domain_event_id()
+    for _ in range(history - history // 2):
+        instance.beat_heart()
+
+    def run():
+        for _ in range(count):
+            app.instance_repo.get_entity(instance.id, until=until)
+    return run
+
+
+def make_instance(app, history, atmo_id=27216):
+    """
+    Returns a new Instance with the given number of events.
+    """
+    instance = app.register_new_instance(atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+    for _ in range(history - 1):
+        instance.beat_heart()
+    return instance
+
+
+# Name, function and (count, history) parameters of each benchmark.
+BENCHMARKS = [
+    ('register_new_instance', register_new_instance, [(1000, 0)]),
+    ('beat_heart', beat_heart, [(1000, 1)]),
+    ('change_attribute', change_attribute, [(1000, 1)]),
+    ('update_attributes', update_attributes, [(1000, 1)]),
+    ('get_instance', get_instance, [(100, 10), (100, 100), (20, 1000)]),
+    ('take_snapshot', take_snapshot, [(100, 10), (100, 100), (20, 1000)]),
+    ('replay_until', replay_until, [(100, 10), (100, 100), (20, 1000)]),
+]
+
+
+class Backends(object):
+    """
+    Makes new applications for each backend, with the SQLite databases and log files in a temporary directory.
+    """
+
+    names = ['pythonobjects', 'sqlalchemy', 'logfiles']
+
+    def __init__(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.count = 0
+
+    def create_app(self, name):
+        if name == 'pythonobjects':
+            return create_application(name)
+        self.count += 1
+        if name == 'logfiles':
+            return create_application(name, path=os.path.join(self.temp_dir, 'log{}'.format(self.count)))
+        db_path = os.path.join(self.temp_dir, 'events{}.db'.format(self.count))
+        return create_application(name, db_uri='sqlite:///' + db_path)
+
+    def close(self):
+        shutil.rmtree(self.temp_dir)
+
+
+def run_benchmarks(backend_names, repeat, names=None):
+    backends = Backends()
+    results = []
+    try:
+        for name, func, params in BENCHMARKS:
+            if names and name not in names:
+                continue
+            for count, history in params:
+                for backend in backend_names:
+                    best = None
+                    for _ in range(repeat):
+                        with backends.create_app(backend) as app:
+                            run = func(app, count, history)
+                            started = time.time()
+                            run()
+                            seconds = time.time() - started
+                        best = seconds if best is None else min(best, seconds)
+                    result = {
+                        'name': name,
+                        'backend': backend,
+                        'count': count,
+                        'history': history,
+                        'seconds': best,
+                        'ops_per_second': count / best if best else None,
+                    }
+                    results.append(result)
+                    yield result
+    finally:
+        backends.close()
+
+
+def result_key(result):
+    return result['name'], result['backend'], result['history']
+
+
+def format_result(result, baseline=None):
+    line = '{name:<22} {backend:<14} {history:>7} {count:>7} {seconds:>10.4f} s {ops_per_second:>12.0f} /s'
+    line = line.format(**result)
+    if baseline is not None and baseline['seconds']:
+        line += ' {:>+8.1%}'.format(result['seconds'] / baseline['seconds'] - 1)
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the domain model and storage backends.")
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file.")
+    parser.add_argument('--compare', default=None, help="Show the change in time since this JSON results file.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backend', action='append', choices=Backends.names, default=None)
+    parser.add_argument('--benchmark', action='append', choices=[b[0] for b in BENCHMARKS], default=None)
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = {result_key(r): r for r in json.load(f)['results']}
+
+    print('{:<22} {:<14} {:>7} {:>7} {:>12} {:>15}'.format('benchmark', 'backend', 'history', 'count', 'time',
+                                                           'rate'))
+    results = []
+    for result in run_benchmarks(args.backend or Backends.names, args.repeat, names=args.benchmark):
+        results.append(result)
+        print(format_result(result, baselines.get(result_key(result))))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'repeat': args.repeat,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Compares making event IDs with uuid_from_timestamp() one at a time, and with the batch functions.
+
+Run from the project root:
+
+    python benchmarks/bench_uuids.py [number_of_timestamps]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+sys.path.insert(0, '.')
+
+from atmo_eventsourcing.utils import time as time_utils  # noqa: E402
+
+
+def main(count=100000, repeat=3):
+    timestamps = [1451606400.0 + i * 0.001 for i in range(count)]
+    cases = [
+        ('uuid_from_timestamp (scalar)', lambda: [time_utils.uuid_from_timestamp(t) for t in timestamps]),
+        ('uuids_from_timestamps', lambda: time_utils.uuids_from_timestamps(timestamps)),
+        ('uuid_hexes_from_timestamps', lambda: time_utils.uuid_hexes_from_timestamps(timestamps)),
+    ]
+    if time_utils.numpy is not None:
+        array = time_utils.numpy.array(timestamps)
+        cases.append(('uuid_hexes_from_timestamps (array)', lambda: time_utils.uuid_hexes_from_timestamps(array)))
+
+    print('{} timestamps, numpy {}'.format(count, 'installed' if time_utils.numpy is not None else 'not installed'))
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+        print('{:<40} {:>10.3f} s {:>12.0f} /s'.format(name, seconds, count / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
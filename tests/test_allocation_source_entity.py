@@ -1,6 +1,9 @@
 import unittest
 
-from atmo_eventsourcing.domain.model.allocation_source import register_new_allocation_source, AllocationSource
+import mock
+
+from atmo_eventsourcing.domain.model.allocation_source import register_new_allocation_source, AllocationSource, \
+    AllocationSourceState
 from atmo_eventsourcing.infrastructure.event_sourced_repos.allocation_source_repo import AllocationSourceRepo
 from eventsourcing.domain.model.entity import EntityIDConsistencyError, \
     EntityVersionConsistencyError
@@ -9,6 +12,9 @@ from eventsourcing.infrastructure.event_store import EventStore
 from eventsourcing.infrastructure.persistence_subscriber import PersistenceSubscriber
 from eventsourcing.infrastructure.stored_events.python_objects_stored_events import PythonObjectsStoredEventRepository
 
+from atmo_eventsourcing.utils import instrumentation
+from atmo_eventsourcing.utils.instrumentation import Instrumentation
+
 
 class TestAllocationSourceEntity(unittest.TestCase):
     def setUp(self):
@@ -89,6 +95,32 @@ class TestAllocationSourceEntity(unittest.TestCase):
             DomainEvent(entity_id=entity2.id, entity_version=entity2.version)
         )
 
+    def test_suppress_unchanged_attributes(self):
+        entity = register_new_allocation_source(a=1, b=2)
+        metrics = Instrumentation()
+        instrumentation.install(metrics)
+        try:
+            with mock.patch.object(AllocationSource, '__suppress_unchanged_attributes__', True):
+                entity.a = 1
+                entity.b = 2
+                self.assertEqual(1, entity.version)
+                entity.a = 10
+                self.assertEqual(2, entity.version)
+        finally:
+            instrumentation.install(None)
+        self.assertEqual({'suppressed_writes': {'AllocationSource.AttributeChanged': 2}}, metrics.counters())
+
+        # Check unchanged values are written when the mode is off.
+        entity.a = 10
+        self.assertEqual(3, entity.version)
+
+    def test_compact_state(self):
+        repo = AllocationSourceRepo(self.event_store)
+        entity = register_new_allocation_source(a=10, b=20)
+        entity.beat_heart()
+        self.assertEqual(AllocationSourceState(id=entity.id, version=2, a=10, b=20, heartbeats=1),
+                         repo[entity.id].get_state())
+
     def test_not_implemented_error(self):
         # Define an event class.
         class UnsupportedEvent(DomainEvent):
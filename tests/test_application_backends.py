@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+
+from atmo_eventsourcing.application.atmo import BACKENDS, create_application, get_application_class
+from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(statement):
+    """
+    Returns the names of the modules imported by a new Python process after running the statement.
+    """
+    script = 'import json, sys\n{}\nprint(json.dumps(sorted(sys.modules)))'.format(statement)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=PROJECT_ROOT)
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+class TestApplicationBackends(unittest.TestCase):
+    def test_get_application_class(self):
+        self.assertIs(AtmoEventSourcingApplicationWithPythonObjects, get_application_class('pythonobjects'))
+        for name in BACKENDS:
+            self.assertEqual(BACKENDS[name][1], get_application_class(name).__name__)
+
+    def test_get_application_class_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_application_class('cassandra')
+
+    def test_create_application(self):
+        assert_event_handlers_empty()
+        app = create_application('pythonobjects')
+        try:
+            self.assertIsInstance(app, AtmoEventSourcingApplicationWithPythonObjects)
+        finally:
+            app.close()
+        assert_event_handlers_empty()
+
+    def test_backends_are_imported_only_when_requested(self):
+        modules = imported_modules('import atmo_eventsourcing.application.atmo')
+        self.assertFalse([m for m in modules if m.startswith('atmo_eventsourcing.application.atmo.with_')])
+
+        for name in ('pythonobjects', 'logfiles'):
+            modules = imported_modules('from atmo_eventsourcing.application.atmo import get_application_class\n'
+                                       'get_application_class({!r})'.format(name))
+            self.assertNotIn('sqlalchemy', modules)
+            self.assertNotIn('atmo_eventsourcing.application.atmo.with_sqlalchemy', modules)
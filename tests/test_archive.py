@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.domain.model.exceptions import ProgrammingError
+
+from atmo_eventsourcing.application.atmo.archive import main
+from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.infrastructure.stored_events.sqlalchemy_stored_events import SqlArchivedEvent
+from eventsourcing.infrastructure.stored_events.sqlalchemy_stored_events import SqlStoredEvent
+
+
+class TestArchiveHistory(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_uri = 'sqlite:///' + os.path.join(self.temp_dir, 'events.db')
+        self.app = AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri)
+
+    def tearDown(self):
+        self.app.close()
+        shutil.rmtree(self.temp_dir)
+        assert_event_handlers_empty()
+
+    def count_rows(self, table, stored_entity_id):
+        try:
+            return self.app.db_session.query(table).filter(table.stored_entity_id == stored_entity_id).count()
+        finally:
+            self.app.db_session.close()
+
+    def make_history(self, heartbeats=10):
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        instance.status = 'active'
+        for _ in range(heartbeats):
+            instance.beat_heart()
+        return instance
+
+    def get_event_ids(self, stored_entity_id):
+        return [e.event_id for e in self.app.stored_event_repo.get_entity_events(stored_entity_id)]
+
+    def test_archive_history(self):
+        instance = self.make_history()
+        stored_entity_id = 'Instance::' + instance.id
+        event_ids = self.get_event_ids(stored_entity_id)
+        self.assertEqual(12, len(event_ids))
+
+        # Without snapshots, nothing is archived.
+        self.assertEqual(0, self.app.archive_history())
+
+        self.app.take_checkpoint()
+        self.assertEqual(11, self.app.archive_history())
+        self.assertEqual(1, self.count_rows(SqlStoredEvent, stored_entity_id))
+        self.assertEqual(11, self.count_rows(SqlArchivedEvent, stored_entity_id))
+        self.assertEqual(0, self.app.archive_history())
+
+        # The entity and its history are unchanged.
+        self.assertEqual(event_ids, self.get_event_ids(stored_entity_id))
+        self.assertEqual(10, self.app.instance_repo[instance.id].count_heartbeats())
+        self.assertEqual([instance.id], self.app.instance_repo.get_entity_ids())
+        historical = self.app.instance_repo.get_entity(instance.id, until=event_ids[1])
+        self.assertEqual('active', historical.status)
+        self.assertEqual(0, historical.count_heartbeats())
+
+        # New events are stored in the live table, and can be archived after the next snapshot.
+        instance = self.app.instance_repo[instance.id]
+        instance.beat_heart()
+        self.assertEqual(11, self.app.instance_repo[instance.id].count_heartbeats())
+        self.app.take_checkpoint()
+        self.assertEqual(1, self.app.archive_history())
+        self.assertEqual(1, self.count_rows(SqlStoredEvent, stored_entity_id))
+        self.assertEqual(11, self.app.instance_repo[instance.id].count_heartbeats())
+
+    def test_archive_history_until(self):
+        instance = self.make_history()
+        stored_entity_id = 'Instance::' + instance.id
+        event_ids = self.get_event_ids(stored_entity_id)
+        # Snapshot at event 5 (the last before event 6), and at the last event.
+        self.app.take_checkpoint(until=event_ids[6])
+        self.app.take_checkpoint()
+
+        # Only events before the snapshot at event 5 are archived.
+        self.assertEqual(5, self.app.archive_history(until=event_ids[6]))
+        self.assertEqual(7, self.count_rows(SqlStoredEvent, stored_entity_id))
+        self.assertEqual(event_ids, self.get_event_ids(stored_entity_id))
+
+    def test_get_entity_events_across_archive(self):
+        instance = self.make_history()
+        stored_entity_id = 'Instance::' + instance.id
+        repo = self.app.stored_event_repo
+        event_ids = self.get_event_ids(stored_entity_id)
+
+        queries = [
+            dict(after=after, until=until, limit=limit, query_ascending=query_ascending,
+                 results_ascending=results_ascending)
+            for after in (None, event_ids[2], event_ids[6], event_ids[9])
+            for until in (None, event_ids[3], event_ids[7], event_ids[10])
+            for limit in (None, 1, 3, 20)
+            for query_ascending in (True, False)
+            for results_ascending in (True, False)
+        ]
+        expected = [repo.get_entity_events(stored_entity_id, **query) for query in queries]
+
+        repo.archive_entity_events(stored_entity_id, before=event_ids[7])
+        self.assertEqual(5, self.count_rows(SqlStoredEvent, stored_entity_id))
+        for query, events in zip(queries, expected):
+            self.assertEqual(events, repo.get_entity_events(stored_entity_id, **query), query)
+
+    def test_main(self):
+        instance = self.make_history()
+        self.app.close()
+        main([self.db_uri, '--checkpoint'])
+        self.app = AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri)
+        self.assertEqual(1, self.count_rows(SqlStoredEvent, 'Instance::' + instance.id))
+        self.assertEqual(10, self.app.instance_repo[instance.id].count_heartbeats())
+
+    def test_archive_history_needs_archive(self):
+        with AtmoEventSourcingApplicationWithPythonObjects() as app:
+            with self.assertRaises(ProgrammingError):
+                app.archive_history()
@@ -1,4 +1,11 @@
-from atmo_eventsourcing.domain.model.instance import Instance
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+
+from atmo_eventsourcing.domain.model.instance import Instance, make_instance_id
 from atmo_eventsourcing.infrastructure.event_sourced_repos.instance_repo import InstanceRepo
 from eventsourcing.infrastructure.event_store import EventStore
 from eventsourcing.infrastructure.persistence_subscriber import PersistenceSubscriber
@@ -6,10 +13,13 @@ from eventsourcing.infrastructure.stored_events.base import StoredEventRepositor
 from eventsourcingtests.test_stored_events import AbstractTestCase
 
 from atmo_eventsourcing.application.atmo.base import AtmoEventSourcingApplication
+from atmo_eventsourcing.application.atmo.with_logfiles import AtmoEventSourcingApplicationWithLogFiles
 from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
 from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
 from atmo_eventsourcing.domain.model.allocation_source import AllocationSource
 from atmo_eventsourcing.infrastructure.event_sourced_repos.allocation_source_repo import AllocationSourceRepo
+from atmo_eventsourcing.infrastructure.sqlalchemy_instance_index import SQLAlchemyInstanceIndex
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import PackedEventCodec
 
 
 class AtmoEventSourcingApplicationTestCase(AbstractTestCase):
@@ -17,7 +27,7 @@ class AtmoEventSourcingApplicationTestCase(AbstractTestCase):
         super(AtmoEventSourcingApplicationTestCase, self).setUp()
         self.app = self.create_app()
 
-    def create_app(self):
+    def create_app(self, **kwargs):
         raise AtmoEventSourcingApplication()
 
     def tearDown(self):
@@ -91,12 +101,202 @@ class AtmoEventSourcingApplicationTestCase(AbstractTestCase):
         entity1 = self.app.instance_repo[instance1.id]
         self.assertEqual('Ubuntu 16.04.1 XFCE Base', entity1.name)
 
+    def test_register_new_instances(self):
+        instances = self.app.register_new_instances(
+            dict(atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base', username='amitj') for atmo_id in range(100)
+        )
+        self.assertEqual(100, len(instances))
+        for atmo_id, instance in enumerate(instances):
+            self.assertIsInstance(instance, Instance)
+            self.assertEqual(instance, self.app.instance_repo[instance.id])
+            self.assertEqual(atmo_id, self.app.instance_repo[instance.id].atmo_id)
+
+        # Check nothing is stored if registration fails part way through.
+        def failing_instances():
+            yield dict(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+            raise ValueError()
+
+        with mock.patch.object(self.app.event_store, 'append_many') as append_many:
+            with self.assertRaises(ValueError):
+                self.app.register_new_instances(failing_instances())
+            self.assertEqual(0, append_many.call_count)
+
+        # Check events published by other threads during a batch aren't held back with it.
+        with mock.patch.object(self.app.event_store, 'append') as append:
+            with self.app.persistence_subscriber.batch():
+                thread = threading.Thread(target=self.app.register_new_instance,
+                                          kwargs=dict(atmo_id=27218, name='CentOS 7', username='julianp'))
+                thread.start()
+                thread.join()
+                self.assertEqual(1, append.call_count)
+
+        # Check events are stored one at a time again after the batch.
+        instance = self.app.register_new_instance(atmo_id=27217, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        self.assertIn(instance.id, self.app.instance_repo)
+
+    def test_instance_index(self):
+        instance1 = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        instance2 = self.app.register_new_instance(atmo_id=27217, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        instance3 = self.app.register_new_instance(atmo_id=27218, name='Ubuntu 14.04.2 XFCE Base', username='julianp')
+
+        # Check Instances can be found by atmo_id.
+        self.assertEqual(instance1, self.app.instance_repo.get_by_atmo_id(27216))
+        self.assertEqual(instance3, self.app.instance_repo.get_by_atmo_id('27218'))
+        self.assertRaises(KeyError, self.app.instance_repo.get_by_atmo_id, 1)
+
+        # Check Instances can be found by username.
+        self.assertEqual([instance1, instance2], self.app.instance_repo.find_by_username('amitj'))
+        self.assertEqual([instance3], self.app.instance_repo.find_by_username('julianp'))
+        self.assertEqual([], self.app.instance_repo.find_by_username('nobody'))
+
+        # Check the most recently registered Instance is found for a reused atmo_id.
+        instance4 = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 16.04.1 XFCE Base', username='amitj')
+        self.assertEqual(instance4, self.app.instance_repo.get_by_atmo_id(27216))
+
+        # Check discarded Instances are removed from the index.
+        instance4.discard()
+        self.assertEqual(instance1, self.app.instance_repo.get_by_atmo_id(27216))
+        instance1.discard()
+        self.assertRaises(KeyError, self.app.instance_repo.get_by_atmo_id, 27216)
+        self.assertEqual([instance2], self.app.instance_repo.find_by_username('amitj'))
+
+    def test_deterministic_instance_ids(self):
+        self.app.close()
+        self.app = self.create_app(deterministic_instance_ids=True)
+
+        instance1 = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        self.assertEqual(make_instance_id(27216), instance1.id)
+
+        # Check registering the same atmo_id again returns the existing Instance, without a new event.
+        instance1.beat_heart()
+        with mock.patch.object(self.app.event_store, 'append') as append:
+            instance2 = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                                       username='amitj')
+        self.assertEqual(0, append.call_count)
+        self.assertEqual(instance1, instance2)
+
+        # Check a bulk registration only creates the new Instances, once each.
+        instances = self.app.register_new_instances([
+            dict(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj'),
+            dict(atmo_id=27217, name='Ubuntu 14.04.2 XFCE Base', username='amitj'),
+            dict(atmo_id=27217, name='Ubuntu 14.04.2 XFCE Base', username='amitj'),
+        ])
+        self.assertEqual([instance1.id, make_instance_id(27217), make_instance_id(27217)], [i.id for i in instances])
+        self.assertEqual(1, self.app.instance_repo[instances[1].id].version)
+
+        # Check registering a new atmo_id doesn't replay anything.
+        with mock.patch.object(self.app.instance_repo, 'get_entity') as get_entity:
+            self.app.register_new_instance(atmo_id=27219, name='CentOS 7', username='julianp')
+            self.assertEqual(0, get_entity.call_count)
+
+        # Check an atmo_id can be registered again after its Instance is discarded.
+        instance2.discard()
+        instance3 = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 16.04.1 XFCE Base', username='amitj')
+        self.assertEqual(instance1.id, instance3.id)
+        self.assertEqual('Ubuntu 16.04.1 XFCE Base', self.app.instance_repo[instance3.id].name)
+
+    def test_flush_buffered_heartbeats(self):
+        with mock.patch.object(Instance, '__heartbeat_batch_size__', 100):
+            instance_id = self.app.register_new_instance(atmo_id=27216, name='Ubuntu', username='amitj').id
+            instance = self.app.instance_repo[instance_id]
+            instance.beat_heart()
+            instance.beat_heart()
+            # Check the heartbeats are written even though the entity has been dropped.
+            del instance
+            self.app.flush()
+            self.assertEqual(2, self.app.instance_repo[instance_id].count_heartbeats())
+
+            # Check closing the application writes buffered heartbeats.
+            instance = self.app.instance_repo[instance_id]
+            instance.beat_heart()
+            del instance
+            with mock.patch.object(self.app.event_store, 'append', wraps=self.app.event_store.append) as append:
+                self.app.close()
+            self.assertIsInstance(append.call_args[0][0], Instance.HeartbeatsRecorded)
+            self.app = self.create_app()
+
+    def test_register_new_allocation_sources(self):
+        allocation_sources = self.app.register_new_allocation_sources([dict(a=1, b=2), dict(a=3, b=4)])
+        self.assertEqual(2, len(allocation_sources))
+        self.assertEqual(3, self.app.allocation_source_repo[allocation_sources[1].id].a)
+        self.assertEqual([], self.app.register_new_allocation_sources([]))
+
 
 class TestAtmoEventSourcingApplicationWithSQLAlchemy(AtmoEventSourcingApplicationTestCase):
-    def create_app(self):
-        return AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///:memory:')
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///:memory:', **kwargs)
+
+    def test_register_new_instances_in_one_transaction(self):
+        with mock.patch.object(self.app.stored_event_repo, 'append') as append:
+            repo = self.app.stored_event_repo
+            with mock.patch.object(repo, 'append_many', wraps=repo.append_many) as append_many:
+                instances = self.app.register_new_instances(
+                    dict(atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base', username='amitj') for atmo_id in range(100)
+                )
+        self.assertEqual(0, append.call_count)
+        self.assertEqual(1, append_many.call_count)
+        self.assertEqual(100, len(append_many.call_args[0][0]))
+        self.assertEqual(99, self.app.instance_repo[instances[-1].id].atmo_id)
+
+    def test_instance_index_rebuilt_on_existing_database(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            db_uri = 'sqlite:///' + os.path.join(temp_dir, 'events.db')
+            with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=db_uri) as app:
+                instance1 = app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+                instance2 = app.register_new_instance(atmo_id=27217, name='CentOS 7', username='amitj')
+                instance3 = app.register_new_instance(atmo_id=27216, name='Ubuntu 16.04.1 XFCE Base', username='amitj')
+                instance3.discard()
+                instance2.status = 'active'
+                # Created events can be in the archive.
+                app.take_checkpoint()
+                app.archive_history()
+                # Make the database as it was before the index existed.
+                app.db_session.get_bind().execute('DROP TABLE instance_index')
+
+            with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=db_uri) as app:
+                self.assertEqual(instance1.id, app.instance_repo.get_by_atmo_id(27216).id)
+                self.assertEqual('active', app.instance_repo.get_by_atmo_id(27217).status)
+                self.assertEqual([instance1.id, instance2.id],
+                                 [i.id for i in app.instance_repo.find_by_username('amitj')])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_instance_index_updated_with_events(self):
+        # Check the events aren't stored if the index can't be updated, so the index can't miss them.
+        with mock.patch.object(SQLAlchemyInstanceIndex, '_update', side_effect=IOError()):
+            self.assertRaises(IOError, self.app.register_new_instance, atmo_id=27216,
+                              name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        self.assertEqual([], list(self.app.stored_event_repo.iterate_stored_events()))
+        self.assertRaises(KeyError, self.app.instance_repo.get_by_atmo_id, 27216)
+
+        # Check the index is updated once, as the events are stored.
+        with mock.patch.object(SQLAlchemyInstanceIndex, 'update') as update:
+            instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                                      username='amitj')
+        self.assertEqual(0, update.call_count)
+        self.assertEqual(instance.id, self.app.instance_repo.get_by_atmo_id(27216).id)
+
+
+class TestAtmoEventSourcingApplicationWithPackedEvents(TestAtmoEventSourcingApplicationWithSQLAlchemy):
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///:memory:', event_codec=PackedEventCodec(),
+                                                          **kwargs)
 
 
 class TestAtmoEventSourcingApplicationWithPythonObjects(AtmoEventSourcingApplicationTestCase):
-    def create_app(self):
-        return AtmoEventSourcingApplicationWithPythonObjects()
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithPythonObjects(**kwargs)
+
+
+class TestAtmoEventSourcingApplicationWithLogFiles(AtmoEventSourcingApplicationTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        super(TestAtmoEventSourcingApplicationWithLogFiles, self).setUp()
+
+    def tearDown(self):
+        super(TestAtmoEventSourcingApplicationWithLogFiles, self).tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithLogFiles(path=self.temp_dir, **kwargs)
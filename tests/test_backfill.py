@@ -0,0 +1,166 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.utils.time import timestamp_long_from_uuid
+
+from atmo_eventsourcing.application.atmo.backfill import InstanceHistoryImporter, read_records, parse_time, main
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.domain.model.instance import make_instance_id
+from atmo_eventsourcing.utils.time import uuid_from_timestamp
+
+HISTORY = [
+    {'time': '2016-01-01T00:00:00Z', 'event': 'created', 'atmo_id': 27216, 'name': 'Ubuntu 14.04.2 XFCE Base',
+     'username': 'amitj'},
+    {'time': '2016-01-01T00:00:00Z', 'event': 'created', 'atmo_id': 27217, 'name': 'CentOS 7', 'username': 'julianp'},
+    {'time': '2016-01-01T00:01:00Z', 'event': 'status', 'atmo_id': 27216, 'value': 'build'},
+    {'time': '2016-01-01T00:05:00Z', 'event': 'status', 'atmo_id': 27216, 'value': 'active'},
+    {'time': '2016-01-01T00:05:00Z', 'event': 'size', 'atmo_id': 27216, 'value': {'cpu': 16, 'mem': 65536}},
+    {'time': '2016-01-01T00:06:00Z', 'event': 'heartbeat', 'atmo_id': 27216},
+    {'time': '2016-01-01T00:07:00Z', 'event': 'heartbeat', 'atmo_id': 27216},
+    {'time': '2016-01-02T00:00:00Z', 'event': 'activity', 'atmo_id': 27216, 'value': 'suspending'},
+    {'time': '2016-01-02T00:00:01Z', 'event': 'status', 'atmo_id': 27216, 'value': 'suspended'},
+    {'time': '2016-01-03T00:00:00Z', 'event': 'discarded', 'atmo_id': 27217},
+]
+
+
+class TestInstanceHistoryImporter(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_uri = 'sqlite:///' + os.path.join(self.temp_dir, 'events.db')
+        self.app = AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri)
+        self.checkpoint_path = os.path.join(self.temp_dir, 'checkpoint.json')
+        self.reports = []
+
+    def tearDown(self):
+        self.app.close()
+        shutil.rmtree(self.temp_dir)
+        assert_event_handlers_empty()
+
+    def make_importer(self, batch_size=3, **kwargs):
+        return InstanceHistoryImporter(self.app.event_store, batch_size=batch_size, progress=self.reports.append,
+                                       **kwargs)
+
+    def check_history(self):
+        instance = self.app.instance_repo[make_instance_id(27216)]
+        self.assertEqual('suspended', instance.status)
+        self.assertEqual('suspending', instance.activity)
+        self.assertEqual((16, 65536, -1), instance.size)
+        self.assertEqual(2, instance.count_heartbeats())
+        self.assertEqual(8, instance.version)
+        self.assertAlmostEqual(parse_time('2016-01-01T00:00:00Z'), instance.created_on)
+        self.assertNotIn(make_instance_id(27217), self.app.instance_repo)
+
+        # Check the historical state.
+        until = uuid_from_timestamp(parse_time('2016-01-01T00:02:00Z')).hex
+        instance = self.app.instance_repo.get_entity(make_instance_id(27216), until=until)
+        self.assertEqual('build', instance.status)
+        self.assertEqual(0, instance.count_heartbeats())
+
+        # Check the imported Instances are indexed.
+        self.assertEqual(make_instance_id(27216), self.app.instance_repo.get_by_atmo_id(27216).id)
+
+    def test_import(self):
+        progress = self.make_importer().import_records(iter(HISTORY))
+        self.assertEqual((10, 10, 0), progress[:3])
+        self.check_history()
+
+        # Check progress is reported for each full batch, and at the end.
+        self.assertEqual([3, 6, 9, 10], [report.records for report in self.reports])
+        self.assertTrue(progress.records_per_second > 0)
+
+    def test_resume_from_checkpoint(self):
+        # Import the first part of the history, with a checkpoint.
+        self.make_importer(checkpoint_path=self.checkpoint_path).import_records(iter(HISTORY[:6]))
+        with open(self.checkpoint_path) as f:
+            self.assertEqual({'records': 6}, json.load(f))
+
+        # Check the import carries on from the checkpoint.
+        progress = self.make_importer(checkpoint_path=self.checkpoint_path).import_records(iter(HISTORY))
+        self.assertEqual((4, 4, 0), progress[:3])
+        self.check_history()
+
+    def test_resume_without_checkpoint(self):
+        # Check records already stored are skipped, when the checkpoint is behind.
+        self.make_importer().import_records(iter(HISTORY[:6]))
+        progress = self.make_importer().import_records(iter(HISTORY))
+        self.assertEqual((10, 4, 6), progress[:3])
+        self.check_history()
+
+    def test_resume_after_batch_stored_before_checkpoint(self):
+        # The 'active' status is stored, but the import stops before the checkpoint is updated. A
+        # batch per record keeps the size, at the same time as the status, for the next import.
+        self.stop_import(stored=True)
+        with open(self.checkpoint_path) as f:
+            self.assertEqual(4, json.load(f)['batch']['records'])
+        progress = self.make_importer(batch_size=1, checkpoint_path=self.checkpoint_path).import_records(iter(HISTORY))
+        self.assertEqual((6, 6, 0), progress[:3])
+        self.check_history()
+
+        # Check the Instance's events have times of their own.
+        stored_events = self.app.stored_event_repo.get_entity_events('Instance::' + make_instance_id(27216))
+        timestamps = [timestamp_long_from_uuid(e.event_id) for e in stored_events]
+        self.assertEqual(sorted(set(timestamps)), timestamps)
+
+    def test_resume_after_batch_not_stored(self):
+        self.stop_import(stored=False)
+        progress = self.make_importer(batch_size=1, checkpoint_path=self.checkpoint_path).import_records(iter(HISTORY))
+        self.assertEqual((7, 7, 0), progress[:3])
+        self.check_history()
+
+    def stop_import(self, stored):
+        # Imports the history a record at a time, stopping while storing the fourth record.
+        append_many = self.app.event_store.append_many
+        calls = []
+
+        def stopping_append_many(domain_events):
+            calls.append(domain_events)
+            if len(calls) == 4:
+                if stored:
+                    append_many(domain_events)
+                raise KeyboardInterrupt()
+            append_many(domain_events)
+
+        importer = self.make_importer(batch_size=1, checkpoint_path=self.checkpoint_path)
+        with mock.patch.object(self.app.event_store, 'append_many', side_effect=stopping_append_many):
+            self.assertRaises(KeyboardInterrupt, importer.import_records, iter(HISTORY))
+
+    def test_created_again(self):
+        # Check a second 'created' record for an Instance which hasn't been discarded is skipped.
+        record = dict(HISTORY[0], time='2016-01-01T00:00:30Z', name='CentOS 7')
+        progress = self.make_importer().import_records(iter(HISTORY[:2] + [record] + HISTORY[2:]))
+        self.assertEqual((11, 10, 1), progress[:3])
+        self.check_history()
+        self.assertEqual('Ubuntu 14.04.2 XFCE Base', self.app.instance_repo[make_instance_id(27216)].name)
+
+    def test_unknown_event(self):
+        with self.assertRaises(ValueError):
+            self.make_importer().import_records([{'time': 0, 'event': 'exploded', 'atmo_id': 1}])
+
+    def test_read_records(self):
+        jsonl_path = os.path.join(self.temp_dir, 'history.jsonl')
+        with open(jsonl_path, 'w') as f:
+            for record in HISTORY:
+                f.write(json.dumps(record) + '\n')
+        self.assertEqual(HISTORY, list(read_records(jsonl_path)))
+
+        csv_path = os.path.join(self.temp_dir, 'history.csv')
+        with open(csv_path, 'w') as f:
+            f.write('time,event,atmo_id,name,username,value\n')
+            f.write('1451606400,created,27216,Ubuntu 14.04.2 XFCE Base,amitj,\n')
+            f.write('1451606460.5,status,27216,,,active\n')
+        records = list(read_records(csv_path))
+        self.assertEqual(27216, records[0]['atmo_id'])
+        self.assertEqual('active', records[1]['value'])
+        self.assertEqual(1451606460.5, parse_time(records[1]['time']))
+
+        # Check the command line imports a file.
+        self.app.close()
+        main([self.db_uri, csv_path])
+        self.app = AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri)
+        self.assertEqual('active', self.app.instance_repo[make_instance_id(27216)].status)
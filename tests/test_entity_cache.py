@@ -0,0 +1,97 @@
+import unittest
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.infrastructure.persistence_subscriber import PersistenceSubscriber
+from eventsourcing.infrastructure.stored_events.python_objects_stored_events import PythonObjectsStoredEventRepository
+
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.domain.model.allocation_source import register_new_allocation_source
+from atmo_eventsourcing.domain.model.instance import register_new_instance
+from atmo_eventsourcing.infrastructure.event_sourced_repos.allocation_source_repo import AllocationSourceRepo
+from atmo_eventsourcing.infrastructure.event_sourced_repos.base import CacheInfo
+from atmo_eventsourcing.infrastructure.event_sourced_repos.instance_repo import InstanceRepo
+from atmo_eventsourcing.infrastructure.event_store import AtmoEventStore
+
+
+class TestEntityCache(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+        self.event_store = AtmoEventStore(PythonObjectsStoredEventRepository())
+        self.persistence_subscriber = PersistenceSubscriber(event_store=self.event_store)
+
+    def tearDown(self):
+        self.persistence_subscriber.close()
+        assert_event_handlers_empty()
+
+    def test_cache_size(self):
+        self.assertRaises(ValueError, InstanceRepo, self.event_store, cache_size=0)
+        self.assertEqual(CacheInfo(0, 0, 0, 0, 0, None), InstanceRepo(self.event_store).cache_info())
+
+    def test_hits_and_misses(self):
+        repo = InstanceRepo(self.event_store, cache_size=2)
+        instance = register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+
+        # Check the first lookup misses, and the next one hits.
+        self.assertEqual(instance, repo[instance.id])
+        self.assertEqual(instance, repo[instance.id])
+        self.assertEqual(CacheInfo(hits=1, tail_replays=0, misses=1, evictions=0, size=1, maxsize=2),
+                         repo.cache_info())
+
+        # Check newer events are replayed onto the cached entity.
+        entity = repo[instance.id]
+        entity.name = 'Ubuntu 16.04.1 XFCE Base'
+        entity.beat_heart()
+        cached = repo[instance.id]
+        self.assertEqual('Ubuntu 16.04.1 XFCE Base', cached.name)
+        self.assertEqual(1, cached.count_heartbeats())
+        self.assertEqual(entity, cached)
+        self.assertEqual((2, 1, 1), repo.cache_info()[:3])
+
+        # Check changes made to a returned entity don't change the cache.
+        cached._name = 'changed'
+        self.assertEqual('Ubuntu 16.04.1 XFCE Base', repo[instance.id].name)
+
+        # Check discarded entities aren't returned from the cache.
+        entity.discard()
+        self.assertRaises(KeyError, repo.__getitem__, instance.id)
+        self.assertEqual(0, repo.cache_info().size)
+
+    def test_eviction(self):
+        repo = AllocationSourceRepo(self.event_store, cache_size=2)
+        allocation_sources = [register_new_allocation_source(a=a, b=0) for a in range(3)]
+        for allocation_source in allocation_sources:
+            self.assertEqual(allocation_source, repo[allocation_source.id])
+
+        # Check the least recently used entity was evicted.
+        self.assertEqual((0, 0, 3, 1, 2), repo.cache_info()[:5])
+        repo[allocation_sources[2].id]
+        repo[allocation_sources[0].id]
+        self.assertEqual((1, 0, 4, 2, 2), repo.cache_info()[:5])
+
+        repo.cache_clear()
+        self.assertEqual(0, repo.cache_info().size)
+
+    def test_stale_version(self):
+        repo = InstanceRepo(self.event_store, cache_size=10)
+        instance = register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        repo[instance.id]
+
+        # Put an entity with the wrong version in the cache, and check it is replaced by a full replay.
+        entity, last_event_id = repo._entity_cache[instance.id]
+        entity._version = 5
+        instance.beat_heart()
+        self.assertEqual(instance, repo[instance.id])
+        self.assertEqual((0, 0, 2), repo.cache_info()[:3])
+
+
+class TestEntityCacheWithSQLAlchemy(unittest.TestCase):
+    def test_application(self):
+        with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///:memory:', entity_cache_size=10) as app:
+            instance = app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+            for _ in range(3):
+                app.instance_repo[instance.id].beat_heart()
+            self.assertEqual(3, app.instance_repo[instance.id].count_heartbeats())
+            self.assertEqual((0, 3, 1), app.instance_repo.cache_info()[:3])
+            app.instance_repo[instance.id].discard()
+            self.assertNotIn(instance.id, app.instance_repo)
+        assert_event_handlers_empty()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.domain.model.instance import Instance
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import PackedEventCodec, JSONEventCodec, \
+    pack_values, unpack_values, AtmoJSONEncoder, AtmoJSONDecoder
+
+
+class TestPackedEventCodec(unittest.TestCase):
+    def test_pack_values(self):
+        values = [None, True, False, 0, 1, -1, 300, -300, 2 ** 70, 1.5, u'active', u'\u00e9', [1, [2]],
+                  {u'cpu': 16, u'mem': 65536}, {1, 2}]
+        self.assertEqual(values, unpack_values(pack_values(values)))
+        self.assertEqual([[1, 2]], unpack_values(pack_values([(1, 2)])))
+        self.assertRaises(ValueError, unpack_values, b'?')
+
+        # Check UUID hex strings are packed as their 16 bytes, and others as strings.
+        entity_id = uuid.uuid4().hex
+        self.assertEqual(17, len(pack_values(entity_id)))
+        self.assertEqual([entity_id, entity_id.upper(), entity_id[:31]],
+                         unpack_values(pack_values([entity_id, entity_id.upper(), entity_id[:31]])))
+
+    def test_round_trip(self):
+        codec = PackedEventCodec()
+        events = [
+            Instance.Created(entity_id='1' * 32, atmo_id=27216, name=u'Ubuntu 14.04.2 XFCE Base', username=u'amitj'),
+            Instance.AttributeChanged(entity_id='1' * 32, entity_version=1, name=u'_status', value=u'active'),
+            Instance.AttributeChanged(entity_id='1' * 32, entity_version=2, name=u'_size', value=[16, 65536, 0]),
+            Instance.AttributeChanged(entity_id='1' * 32, entity_version=2, name=u'_allocation_source_id',
+                                      value=uuid.uuid4().hex),
+            Instance.Heartbeat(entity_id='1' * 32, entity_version=3),
+            Instance.HeartbeatsRecorded(entity_id='1' * 32, entity_version=4, count=10, first=1.5, last=2.5),
+            Instance.AttributesChanged(entity_id='1' * 32, entity_version=5,
+                                       values={u'_status': u'active', u'_size': [16, 65536, 0]}),
+        ]
+        for event in events:
+            stored_event = codec.serialize(event, json_encoder_cls=AtmoJSONEncoder, with_uuid1=True)
+            self.assertEqual(event.domain_event_id, stored_event.event_id)
+            self.assertEqual('Instance::' + '1' * 32, stored_event.stored_entity_id)
+            self.assertNotIn('#', stored_event.event_topic)
+            self.assertEqual(event, codec.deserialize(stored_event, json_decoder_cls=AtmoJSONDecoder, with_uuid1=True))
+
+            # Check the packed event is smaller than the JSON event.
+            json_stored_event = JSONEventCodec().serialize(event, json_encoder_cls=AtmoJSONEncoder, with_uuid1=True)
+            self.assertLess(len(stored_event.event_topic) + len(stored_event.event_attrs),
+                            len(json_stored_event.event_topic) + len(json_stored_event.event_attrs))
+
+            # Check each codec reads the other's events.
+            self.assertEqual(event, codec.deserialize(json_stored_event, with_uuid1=True))
+            self.assertEqual(event, JSONEventCodec().deserialize(stored_event, with_uuid1=True))
+
+
+class TestReencodeStoredEvents(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_uri = 'sqlite:///' + os.path.join(self.temp_dir, 'events.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        assert_event_handlers_empty()
+
+    def test_reencode_stored_events(self):
+        with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri) as app:
+            instance = app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+            instance.status = 'active'
+            instance.beat_heart()
+            app.instance_repo.event_player.take_snapshot(instance.id)
+
+        with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri, event_codec=PackedEventCodec()) as app:
+            # Check the old JSON events can be read, and new events are packed.
+            self.assertEqual(instance, app.instance_repo[instance.id])
+            app.instance_repo[instance.id].beat_heart()
+
+            # Check only the JSON Instance events are rewritten, a page at a time.
+            self.assertEqual(3, app.stored_event_repo.reencode_stored_events(page_size=2))
+            self.assertEqual(0, app.stored_event_repo.reencode_stored_events())
+            self.assertEqual(2, app.instance_repo[instance.id].count_heartbeats())
+
+        # Check the packed events can be moved back to JSON, including archived events.
+        with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri, event_codec=PackedEventCodec()) as app:
+            app.take_checkpoint()
+            self.assertEqual(3, app.archive_history())
+        with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri) as app:
+            self.assertEqual(4, app.stored_event_repo.reencode_stored_events())
+            self.assertEqual('active', app.instance_repo[instance.id].status)
+            self.assertEqual(2, app.instance_repo[instance.id].count_heartbeats())
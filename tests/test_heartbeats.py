@@ -0,0 +1,152 @@
+import gc
+import weakref
+from uuid import uuid1
+
+import mock
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.infrastructure.event_store import EventStore
+from eventsourcing.infrastructure.persistence_subscriber import PersistenceSubscriber
+from eventsourcing.infrastructure.stored_events.python_objects_stored_events import PythonObjectsStoredEventRepository
+from eventsourcingtests.test_stored_events import AbstractTestCase
+
+from atmo_eventsourcing.domain.model.allocation_source import AllocationSource, register_new_allocation_source
+from atmo_eventsourcing.domain.model.heartbeats import flush_all_heartbeats
+from atmo_eventsourcing.domain.model.instance import Instance, register_new_instance
+from atmo_eventsourcing.infrastructure.event_sourced_repos.allocation_source_repo import AllocationSourceRepo
+from atmo_eventsourcing.infrastructure.event_sourced_repos.instance_repo import InstanceRepo
+
+
+class HeartbeatsTestCase(AbstractTestCase):
+    entity_class = None
+
+    def setUp(self):
+        super(HeartbeatsTestCase, self).setUp()
+        assert_event_handlers_empty()
+        self.event_store = EventStore(PythonObjectsStoredEventRepository())
+        self.persistence_subscriber = PersistenceSubscriber(event_store=self.event_store)
+        self.repo = self.create_repo()
+
+    def tearDown(self):
+        self.persistence_subscriber.close()
+        assert_event_handlers_empty()
+        super(HeartbeatsTestCase, self).tearDown()
+
+    def create_repo(self):
+        raise NotImplementedError()
+
+    def register(self):
+        raise NotImplementedError()
+
+    def change_attribute(self, entity):
+        raise NotImplementedError()
+
+    def get_stored_events(self, entity):
+        return list(self.event_store.get_entity_events(self.entity_class.__name__ + '::' + entity.id))
+
+    def test_coalesced_heartbeats(self):
+        entity = self.register()
+
+        with mock.patch.object(self.entity_class, '__heartbeat_batch_size__', 100):
+            for _ in range(250):
+                entity.beat_heart()
+
+            # Check the count is exact, including heartbeats still in the buffer.
+            self.assertEqual(250, entity.count_heartbeats())
+
+            # Check only two events were written for the two full batches.
+            self.assertEqual(3, entity.version)
+            self.assertEqual(200, self.repo[entity.id].count_heartbeats())
+
+            # Check a partial batch can be flushed.
+            entity.flush_heartbeats()
+            self.assertEqual(4, entity.version)
+            self.assertEqual(250, entity.count_heartbeats())
+            self.assertEqual(entity, self.repo[entity.id])
+
+            # Check flushing an empty buffer writes nothing.
+            entity.flush_heartbeats()
+            self.assertEqual(4, entity.version)
+
+        with mock.patch.object(self.entity_class, '__heartbeat_batch_interval__', 60):
+            with mock.patch('atmo_eventsourcing.domain.model.heartbeats.utc_now') as utc_now:
+                utc_now.return_value = 1000.0
+                entity.beat_heart()
+                utc_now.return_value = 1030.0
+                entity.beat_heart()
+                self.assertEqual(4, entity.version)
+                utc_now.return_value = 1060.0
+                entity.beat_heart()
+                self.assertEqual(5, entity.version)
+                self.assertEqual(253, self.repo[entity.id].count_heartbeats())
+
+                # Check the event records the number and times of the heartbeats.
+                event = self.get_stored_events(entity)[-1]
+                self.assertIsInstance(event, self.entity_class.HeartbeatsRecorded)
+                self.assertEqual((3, 1000.0, 1060.0), (event.count, event.first, event.last))
+
+                # Check buffered heartbeats are written before other events, in the order things happened.
+                entity.beat_heart()
+                self.change_attribute(entity)
+                events = self.get_stored_events(entity)[-2:]
+                self.assertEqual([self.entity_class.HeartbeatsRecorded, self.entity_class.AttributeChanged],
+                                 [type(e) for e in events])
+                self.assertEqual(entity, self.repo[entity.id])
+
+                # Check buffered heartbeats are written before the entity is discarded.
+                entity.beat_heart()
+                entity.discard()
+                self.assertEqual(255, entity.count_heartbeats())
+                self.assertNotIn(entity.id, self.repo)
+
+    def test_heartbeats_recorded_at_last_heartbeat(self):
+        entity = self.register()
+        with mock.patch.object(self.entity_class, '__heartbeat_batch_size__', 100):
+            entity.beat_heart()
+            entity.beat_heart()
+            timecheck = uuid1().hex
+            entity.flush_heartbeats()
+
+        # Check heartbeats written after a time, but which happened before it, are counted at that time.
+        self.assertEqual(2, self.repo.get_entity(entity.id, until=timecheck).count_heartbeats())
+
+    def test_dropped_entity_is_not_kept_alive(self):
+        entity = self.register()
+        with mock.patch.object(self.entity_class, '__heartbeat_batch_size__', 100):
+            entity.beat_heart()
+        entity_id = entity.id
+        entity_ref = weakref.ref(entity)
+        del entity
+        gc.collect()
+        self.assertIsNone(entity_ref())
+
+        # Check the dropped entity's heartbeats are still written.
+        self.assertEqual(1, flush_all_heartbeats())
+        self.assertEqual(1, self.repo[entity_id].count_heartbeats())
+        self.assertEqual(0, flush_all_heartbeats())
+
+
+class TestInstanceHeartbeats(HeartbeatsTestCase):
+    entity_class = Instance
+
+    def create_repo(self):
+        return InstanceRepo(self.event_store)
+
+    def register(self):
+        return register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+
+    def change_attribute(self, entity):
+        entity.status = 'active'
+
+
+class TestAllocationSourceHeartbeats(HeartbeatsTestCase):
+    entity_class = AllocationSource
+
+    def create_repo(self):
+        return AllocationSourceRepo(self.event_store)
+
+    def register(self):
+        return register_new_allocation_source(a=1, b=2)
+
+    def change_attribute(self, entity):
+        entity.a = 10
+
@@ -1,5 +1,8 @@
 import datetime
 import unittest
+from functools import reduce
+
+import mock
 
 from eventsourcing.domain.model.entity import EntityIDConsistencyError, EntityVersionConsistencyError
 from eventsourcing.domain.model.events import DomainEvent, assert_event_handlers_empty, publish
@@ -8,8 +11,11 @@ from eventsourcing.infrastructure.persistence_subscriber import PersistenceSubsc
 from eventsourcing.infrastructure.stored_events.python_objects_stored_events import PythonObjectsStoredEventRepository
 from eventsourcing.utils.time import utc_timezone
 
-from atmo_eventsourcing.domain.model.instance import register_new_instance, Instance
+from atmo_eventsourcing.domain.model.instance import register_new_instance, Instance, InstanceSize, InstanceState, \
+    UNKNOWN_SIZE
 from atmo_eventsourcing.infrastructure.event_sourced_repos.instance_repo import InstanceRepo
+from atmo_eventsourcing.utils import instrumentation
+from atmo_eventsourcing.utils.instrumentation import Instrumentation
 from atmo_eventsourcing.utils.time import datetime_to_timestamp
 from atmo_eventsourcing.utils.time import uuid_from_timestamp
 
@@ -35,7 +41,7 @@ class TestInstanceEntity(unittest.TestCase):
         self.assertEqual('amitj', instance1.username)
         self.assertEqual('unknown', instance1.status)
         self.assertEqual('', instance1.activity)
-        self.assertEqual({-1, -1, -1}, instance1.size)
+        self.assertEqual((-1, -1, -1), instance1.size)
 
         # Check the properties of the Instance class.
         self.assertTrue(instance1.id)
@@ -87,7 +93,11 @@ class TestInstanceEntity(unittest.TestCase):
         entity1.activity = 'networking'
         self.assertEqual('networking', repo[entity1.id].activity)
         entity1.size = {'mem': '65536', 'disk': '0', 'cpu': '16'}
-        self.assertEqual({'mem': '65536', 'disk': '0', 'cpu': '16'}, repo[entity1.id].size)
+        self.assertEqual((16, 65536, 0), repo[entity1.id].size)
+        self.assertEqual(16, repo[entity1.id].size.cpu)
+        entity1.size = (8, 32768, 20)
+        self.assertEqual(InstanceSize(cpu=8, mem=32768, disk=20), repo[entity1.id].size)
+        self.assertRaises(ValueError, setattr, entity1, 'size', {'cpu': 'lots'})
 
         self.assertEqual(0, entity1.count_heartbeats())
         entity1.beat_heart()
@@ -140,6 +150,122 @@ class TestInstanceEntity(unittest.TestCase):
         self.assertTrue(instance1.created_on)
         self.assertAlmostEqual(instance_created_timestamp, instance1.created_on)
 
+    def test_compact_state(self):
+        repo = InstanceRepo(self.event_store)
+        entity = register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        entity.status = 'active'
+        entity.size = {'cpu': 16, 'mem': 65536, 'disk': 0}
+        entity.beat_heart()
+
+        state = repo[entity.id].get_state()
+        self.assertEqual(InstanceState(id=entity.id, version=4, atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                       username='amitj', status='active', activity='', size=(16, 65536, 0),
+                                       heartbeats=1), state)
+        self.assertEqual((), type(state).__slots__)
+
+        # Check replayed Instances share their status strings.
+        other = register_new_instance(atmo_id=27217, name='CentOS 7', username='julianp')
+        other.status = ''.join(['act', 'ive'])
+        self.assertIs(repo[entity.id].status, repo[other.id].status)
+
+        # Check snapshots taken when the size was a set give the unknown size.
+        entity._size = {-1}
+        self.assertEqual((-1, -1, -1), entity.size)
+
+    def test_replay_unreadable_sizes(self):
+        repo = InstanceRepo(self.event_store)
+        entity = register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+
+        # Check stored sizes which can't be read, e.g. imported ones, replay as the unknown size.
+        for value in [None, {'cpu': None}, 'large', [1, 2]]:
+            self.event_store.append(Instance.AttributeChanged(entity_id=entity.id, entity_version=entity.version,
+                                                              name='_size', value=value))
+            entity = repo[entity.id]
+            self.assertEqual(UNKNOWN_SIZE, entity.size)
+        self.event_store.append(Instance.AttributesChanged(entity_id=entity.id, entity_version=entity.version,
+                                                           values={'_size': None, '_status': 'active'}))
+        self.assertEqual((UNKNOWN_SIZE, 'active'), (repo[entity.id].size, repo[entity.id].status))
+
+        # Check the setter still rejects them.
+        self.assertRaises(TypeError, setattr, entity, 'size', None)
+
+    def test_update(self):
+        repo = InstanceRepo(self.event_store)
+        entity = register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+
+        # Check the attributes are changed together, with one event.
+        entity.update(status='active', activity='networking', size={'cpu': 16, 'mem': 65536, 'disk': 0})
+        self.assertEqual(('active', 'networking', InstanceSize(16, 65536, 0)), (entity.status, entity.activity,
+                                                                                 entity.size))
+        self.assertEqual(2, entity.version)
+        events = list(self.event_store.get_entity_events('Instance::' + entity.id))
+        self.assertEqual([Instance.Created, Instance.AttributesChanged], [type(e) for e in events])
+        self.assertEqual(entity, repo[entity.id])
+        self.assertIsInstance(repo[entity.id].size, InstanceSize)
+
+        # Check only the given attributes are changed.
+        entity.update(status='suspended')
+        self.assertEqual(('suspended', 'networking'), (repo[entity.id].status, repo[entity.id].activity))
+
+        # Check nothing is written for an empty update, or an update of an unknown attribute.
+        entity.update()
+        self.assertRaises(TypeError, entity.update, status='active', username='julianp')
+        self.assertEqual(3, repo[entity.id].version)
+
+        entity.discard()
+        self.assertRaises(AssertionError, entity.update, status='deleted')
+
+    def test_suppress_unchanged_attributes(self):
+        repo = InstanceRepo(self.event_store)
+        entity = register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        entity.update(status='active', size=(16, 65536, 0))
+        metrics = Instrumentation()
+        instrumentation.install(metrics)
+        try:
+            with mock.patch.object(Instance, '__suppress_unchanged_attributes__', True):
+                # Check setting the values the Instance already has writes nothing.
+                entity.status = 'active'
+                entity.activity = ''
+                entity.allocation_source_id = None
+                entity = repo[entity.id]
+                entity.size = {'cpu': 16, 'mem': 65536, 'disk': 0}
+                entity.update(status='active', size=[16, 65536, 0])
+                self.assertEqual(2, repo[entity.id].version)
+
+                # Check an update only records the values which change.
+                entity.update(status='active', activity='networking')
+                event = list(self.event_store.get_entity_events('Instance::' + entity.id))[-1]
+                self.assertEqual({'_activity': 'networking'}, event.values)
+                entity.status = 'suspended'
+                self.assertEqual(entity, repo[entity.id])
+                self.assertEqual(4, entity.version)
+        finally:
+            instrumentation.install(None)
+        self.assertEqual({'suppressed_writes': {'Instance.AttributeChanged': 4, 'Instance.AttributesChanged': 1}},
+                         metrics.counters())
+
+    def test_mutate_all(self):
+        events = [
+            Instance.Created(entity_id='1', atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj'),
+            Instance.AttributeChanged(entity_id='1', entity_version=1, name='_status', value='active'),
+            Instance.Heartbeat(entity_id='1', entity_version=2),
+            Instance.HeartbeatsRecorded(entity_id='1', entity_version=3, count=5, first=1.0, last=2.0),
+        ]
+        # Check applying the events together gives the same entity as applying them one at a time.
+        entity = Instance.mutate_all(events)
+        self.assertEqual(reduce(Instance.mutate, events, None), entity)
+        self.assertEqual(6, entity.count_heartbeats())
+        self.assertEqual(4, entity.version)
+        self.assertIsNone(Instance.mutate_all([]))
+
+        # Check events after a discard are applied to the class.
+        discarded = Instance.Discarded(entity_id='1', entity_version=4)
+        self.assertIsNone(Instance.mutate_all(events[2:] + [discarded], entity=Instance.mutate_all(events[:2])))
+        self.assertEqual(entity, Instance.mutate_all([discarded] + events, entity=Instance.mutate_all(events)))
+
+        # Check the events are still checked against the entity.
+        self.assertRaises(EntityVersionConsistencyError, Instance.mutate_all, events[:2] + events[3:])
+
     def test_not_implemented_error(self):
         # Define an event class.
         class UnsupportedEvent(DomainEvent):
@@ -8,7 +8,11 @@ from eventsourcing.infrastructure.event_store import EventStore
 from eventsourcing.infrastructure.persistence_subscriber import PersistenceSubscriber
 from eventsourcing.infrastructure.stored_events.python_objects_stored_events import PythonObjectsStoredEventRepository
 
+from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
 from atmo_eventsourcing.domain.model.instance import Instance, register_new_instance
+from atmo_eventsourcing.infrastructure.event_player import AtmoEventPlayer
+from atmo_eventsourcing.utils.time import uuid_from_timestamp
 
 
 class TestInstanceEventPlayer(unittest.TestCase):
@@ -181,3 +185,23 @@ class TestInstanceEventPlayer(unittest.TestCase):
         # - should use the previous snapshot and the heartbeat event
         snapshot3 = event_player.take_snapshot(instance.id)
         self.assertNotEqual(snapshot3.at_event_id, snapshot1.at_event_id)
+
+    def test_pages_of_events_at_the_same_time(self):
+        # Events at the same time are told apart by their clock sequences.
+        times = [0, 1, 1, 1, 1, 2, 2, 3]
+        event_ids = [uuid_from_timestamp(1451606400.0 + t, clock_seq=i).hex for i, t in enumerate(times)]
+        events = [Instance.Created(entity_id='entity1', atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                   username='amitj', domain_event_id=event_ids[0])]
+        events += [Instance.Heartbeat(entity_id='entity1', entity_version=i, domain_event_id=event_id)
+                   for i, event_id in enumerate(event_ids[1:], 1)]
+
+        for app_class, kwargs in ((AtmoEventSourcingApplicationWithPythonObjects, {}),
+                                  (AtmoEventSourcingApplicationWithSQLAlchemy, {'db_uri': 'sqlite:///:memory:'})):
+            with app_class(**kwargs) as app:
+                app.event_store.append_many(events)
+                for page_size in range(1, 10):
+                    event_player = AtmoEventPlayer(app.event_store, id_prefix='Instance', mutate_func=Instance.mutate,
+                                                   mutate_all_func=Instance.mutate_all, page_size=page_size)
+                    pages = list(event_player.iterate_pages('Instance::entity1'))
+                    self.assertEqual(event_ids, [e.domain_event_id for page in pages for e in page], page_size)
+                    self.assertEqual(7, event_player.replay_events('entity1').count_heartbeats())
@@ -0,0 +1,78 @@
+import unittest
+
+import mock
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.utils import instrumentation
+from atmo_eventsourcing.utils.instrumentation import Instrumentation
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+
+    def tearDown(self):
+        instrumentation.install(None)
+        assert_event_handlers_empty()
+
+    def test_observe(self):
+        metrics = Instrumentation(buckets=(0.001, 0.01))
+        metrics.observe('append', 'Instance.Heartbeat', 0.0005)
+        metrics.observe('append', 'Instance.Heartbeat', 0.005)
+        metrics.observe('append', 'Instance.Heartbeat', 0.5)
+        snapshot = metrics.snapshot()
+        self.assertEqual(3, snapshot['append']['Instance.Heartbeat']['count'])
+        self.assertAlmostEqual(0.5055, snapshot['append']['Instance.Heartbeat']['seconds'])
+        self.assertEqual([(0.001, 1), (0.01, 2), (float('inf'), 3)],
+                         snapshot['append']['Instance.Heartbeat']['buckets'])
+
+        text = metrics.prometheus_text()
+        self.assertIn('# TYPE atmo_eventsourcing_stage_seconds histogram\n', text)
+        self.assertIn('atmo_eventsourcing_stage_seconds_bucket{stage="append",event_type="Instance.Heartbeat",'
+                      'le="0.01"} 2\n', text)
+        self.assertIn('atmo_eventsourcing_stage_seconds_bucket{stage="append",event_type="Instance.Heartbeat",'
+                      'le="+Inf"} 3\n', text)
+        self.assertIn('atmo_eventsourcing_stage_seconds_count{stage="append",event_type="Instance.Heartbeat"} 3\n',
+                      text)
+
+        metrics.increment('suppressed_writes', 'Instance.AttributeChanged')
+        metrics.increment('suppressed_writes', 'Instance.AttributeChanged', 2)
+        self.assertEqual({'suppressed_writes': {'Instance.AttributeChanged': 3}}, metrics.counters())
+        text = metrics.prometheus_text()
+        self.assertIn('# TYPE atmo_eventsourcing_suppressed_writes_total counter\n'
+                      'atmo_eventsourcing_suppressed_writes_total{event_type="Instance.AttributeChanged"} 3\n', text)
+
+        start_response = mock.Mock()
+        self.assertEqual([text.encode('utf8')], metrics.wsgi_app({}, start_response))
+        self.assertEqual('200 OK', start_response.call_args[0][0])
+
+        metrics.reset()
+        self.assertEqual({}, metrics.snapshot())
+        self.assertEqual({}, metrics.counters())
+
+    def test_application(self):
+        self.assertIsNone(instrumentation.get_installed())
+        metrics = Instrumentation()
+        with AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///:memory:', instrumentation=metrics) as app:
+            self.assertIs(metrics, instrumentation.get_installed())
+            instance = app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+            instance.status = 'active'
+            instance.beat_heart()
+            instance.beat_heart()
+            app.register_new_allocation_sources([dict(a=1, b=2), dict(a=3, b=4)])
+            app.instance_repo[instance.id].discard()
+
+        # Check the application uninstalls its instrumentation when it closes.
+        self.assertIsNone(instrumentation.get_installed())
+
+        snapshot = metrics.snapshot()
+        for stage in ('publish', 'append'):
+            self.assertEqual(1, snapshot[stage]['Instance.Created']['count'])
+            self.assertEqual(1, snapshot[stage]['Instance.AttributeChanged']['count'])
+            self.assertEqual(2, snapshot[stage]['Instance.Heartbeat']['count'])
+            self.assertEqual(1, snapshot[stage]['Instance.Discarded']['count'])
+            self.assertEqual(2, snapshot[stage]['AllocationSource.Created']['count'])
+        # Events are applied when they happen, and when the Instance is replayed before it is discarded.
+        self.assertEqual(4, snapshot['mutate']['Instance.Heartbeat']['count'])
+        self.assertEqual(1, snapshot['replay']['Instance']['count'])
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.domain.model.exceptions import ProgrammingError
+from eventsourcing.infrastructure.stored_events.transcoders import StoredEvent
+
+from atmo_eventsourcing.application.atmo.with_logfiles import AtmoEventSourcingApplicationWithLogFiles
+from atmo_eventsourcing.infrastructure.stored_events.log_file_stored_events import AtmoLogFileStoredEventRepository
+from atmo_eventsourcing.infrastructure.stored_events.transcoders import PackedEventCodec
+from atmo_eventsourcing.utils.time import uuid_hexes_from_timestamps
+
+
+class TestLogFileStoredEventRepository(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.repo = AtmoLogFileStoredEventRepository(path=self.temp_dir, segment_size=1000)
+
+    def tearDown(self):
+        self.repo.close()
+        shutil.rmtree(self.temp_dir)
+
+    def append_events(self, stored_entity_id, count, start=1000.0):
+        stored_events = [
+            StoredEvent(event_id=event_id, stored_entity_id=stored_entity_id, event_topic=u'topic',
+                        event_attrs=u'{"i": %d}' % i)
+            for i, event_id in enumerate(uuid_hexes_from_timestamps([start + i for i in range(count)]))
+        ]
+        self.repo.append_many(stored_events)
+        return stored_events
+
+    def reopen(self):
+        self.repo.close()
+        self.repo = AtmoLogFileStoredEventRepository(path=self.temp_dir, segment_size=1000)
+
+    def test_get_entity_events(self):
+        events = self.append_events(u'Instance::1', 10)
+        other_events = self.append_events(u'Instance::2', 3)
+        repo = self.repo
+        self.assertEqual(events, repo.get_entity_events(u'Instance::1'))
+        self.assertEqual(other_events, repo.get_entity_events(u'Instance::2'))
+        self.assertEqual([], repo.get_entity_events(u'Instance::3'))
+
+        # Check the range and limit, as the SQLAlchemy repository selects them.
+        after, until = events[2].event_id, events[6].event_id
+        self.assertEqual(events[3:7], repo.get_entity_events(u'Instance::1', after=after, until=until))
+        self.assertEqual(events[3:5], repo.get_entity_events(u'Instance::1', after=after, limit=2))
+        self.assertEqual(events[5:1:-1], repo.get_entity_events(u'Instance::1', after=after, until=until,
+                                                                query_ascending=False, results_ascending=False))
+        self.assertEqual(events[8:], repo.get_entity_events(u'Instance::1', limit=2, query_ascending=False))
+        self.assertEqual(events[9], repo.get_most_recent_event(u'Instance::1'))
+
+        self.assertEqual([u'Instance::1', u'Instance::2'], repo.get_stored_entity_ids(u'Instance::'))
+
+    def test_out_of_order_timestamps(self):
+        later = self.append_events(u'Instance::1', 2, start=2000.0)
+        earlier = self.append_events(u'Instance::1', 2, start=1000.0)
+        self.assertEqual(later + earlier, self.repo.get_entity_events(u'Instance::1'))
+        self.assertEqual(earlier[1:], self.repo.get_entity_events(u'Instance::1', after=earlier[0].event_id,
+                                                                  until=earlier[1].event_id))
+
+    def test_segments_and_reopen(self):
+        events = []
+        for _ in range(20):
+            events += self.append_events(u'Instance::1', 5, start=1000.0 + len(events))
+        self.assertGreater(len(os.listdir(self.temp_dir)), 1)
+
+        self.reopen()
+        self.assertEqual(events, self.repo.get_entity_events(u'Instance::1'))
+        self.assertEqual(events, list(self.repo.iterate_stored_events()))
+
+        # Check appending carries on after reopening.
+        more_events = self.append_events(u'Instance::1', 2, start=2000.0)
+        self.reopen()
+        self.assertEqual(events + more_events, self.repo.get_entity_events(u'Instance::1'))
+
+    def test_torn_record_is_cut_off(self):
+        events = self.append_events(u'Instance::1', 3)
+        self.repo.close()
+        path = os.path.join(self.temp_dir, '00000000.log')
+        size = os.path.getsize(path)
+        with open(path, 'r+b') as f:
+            f.truncate(size - 5)
+
+        self.reopen()
+        self.assertEqual(events[:2], self.repo.get_entity_events(u'Instance::1'))
+        more_events = self.append_events(u'Instance::1', 1, start=2000.0)
+        self.reopen()
+        self.assertEqual(events[:2] + more_events, self.repo.get_entity_events(u'Instance::1'))
+
+    def test_single_writer(self):
+        self.assertRaises(ProgrammingError, AtmoLogFileStoredEventRepository, path=self.temp_dir)
+
+        # Once the writer is closed, another can open the log.
+        self.reopen()
+        self.assertEqual(1, len(self.append_events(u'Instance::1', 1)))
+
+    def test_read_only(self):
+        events = self.append_events(u'Instance::1', 3)
+        path = os.path.join(self.temp_dir, '00000000.log')
+        size = os.path.getsize(path)
+
+        # Check a reader ignores a record still being appended, and leaves it alone.
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 10)
+        reader = AtmoLogFileStoredEventRepository(path=self.temp_dir, read_only=True)
+        try:
+            self.assertEqual(events, reader.get_entity_events(u'Instance::1'))
+            self.assertEqual(size + 10, os.path.getsize(path))
+            self.assertRaises(ProgrammingError, reader.append_many, events)
+        finally:
+            reader.close()
+
+    def test_segment_size_must_be_positive(self):
+        self.assertRaises(ValueError, AtmoLogFileStoredEventRepository, path=self.temp_dir, segment_size=0)
+
+
+class TestAtmoEventSourcingApplicationWithLogFiles(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        assert_event_handlers_empty()
+
+    def test_reopen(self):
+        with AtmoEventSourcingApplicationWithLogFiles(path=self.temp_dir, event_codec=PackedEventCodec()) as app:
+            instance1 = app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+            instance1.status = 'active'
+            instance1.beat_heart()
+            instance2 = app.register_new_instance(atmo_id=27217, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+            instance2.discard()
+            allocation_source = app.register_new_allocation_source(a=10, b=20)
+
+        # Check the entities and the instance index are the same after reopening.
+        with AtmoEventSourcingApplicationWithLogFiles(path=self.temp_dir, event_codec=PackedEventCodec()) as app:
+            self.assertEqual(instance1, app.instance_repo.get_by_atmo_id(27216))
+            self.assertEqual(1, app.instance_repo[instance1.id].count_heartbeats())
+            self.assertRaises(KeyError, app.instance_repo.get_by_atmo_id, 27217)
+            self.assertEqual([instance1], app.instance_repo.find_by_username('amitj'))
+            self.assertEqual(10, app.allocation_source_repo[allocation_source.id].a)
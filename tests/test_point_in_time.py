@@ -0,0 +1,114 @@
+import shutil
+import tempfile
+from uuid import uuid1
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.infrastructure.event_player import entity_from_snapshot
+from eventsourcingtests.test_stored_events import AbstractTestCase
+
+from atmo_eventsourcing.application.atmo.with_logfiles import AtmoEventSourcingApplicationWithLogFiles
+from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.utils import instrumentation
+from atmo_eventsourcing.utils.instrumentation import Instrumentation
+
+
+class PointInTimeTestCase(AbstractTestCase):
+    def setUp(self):
+        super(PointInTimeTestCase, self).setUp()
+        assert_event_handlers_empty()
+        self.app = self.create_app()
+
+    def create_app(self):
+        raise NotImplementedError()
+
+    def tearDown(self):
+        self.app.close()
+        assert_event_handlers_empty()
+        super(PointInTimeTestCase, self).tearDown()
+
+    def test_state_at(self):
+        instance1 = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        instance2 = self.app.register_new_instance(atmo_id=27217, name='CentOS 7', username='julianp')
+        allocation_source = self.app.register_new_allocation_source(a=1, b=2)
+        instance1.status = 'active'
+        timecheck1 = uuid1().hex
+
+        instance3 = self.app.register_new_instance(atmo_id=27218, name='CentOS 6', username='julianp')
+        instance1.status = 'suspended'
+        instance2.discard()
+        allocation_source.a = 10
+        timecheck2 = uuid1().hex
+
+        # Check the state of everything at each time.
+        state = self.app.get_state_at(timecheck1)
+        self.assertEqual({instance1.id, instance2.id}, set(state.instances))
+        self.assertEqual('active', state.instances[instance1.id].status)
+        self.assertEqual(1, state.allocation_sources[allocation_source.id].a)
+
+        state = self.app.get_state_at(timecheck2)
+        self.assertEqual({instance1.id, instance3.id}, set(state.instances))
+        self.assertEqual('suspended', state.instances[instance1.id].status)
+        self.assertEqual(10, state.allocation_sources[allocation_source.id].a)
+
+        # Check the current state.
+        self.assertEqual(instance1, self.app.get_state_at(None).instances[instance1.id])
+
+    def test_checkpoints(self):
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        discarded = self.app.register_new_instance(atmo_id=27217, name='CentOS 7', username='julianp')
+        discarded.discard()
+        for _ in range(10):
+            instance.beat_heart()
+        timecheck1 = uuid1().hex
+        for _ in range(10):
+            instance.beat_heart()
+        timecheck2 = uuid1().hex
+        for _ in range(5):
+            instance.beat_heart()
+
+        # Take checkpoints at both times, and check discarded entities are skipped.
+        self.app.take_checkpoint(until=timecheck1)
+        self.assertEqual(1, self.app.instance_repo.take_snapshots(until=timecheck2))
+        snapshot = self.app.instance_repo.event_player.get_snapshot(instance.id, until=timecheck2)
+        self.assertEqual(21, entity_from_snapshot(snapshot).version)
+
+        # Check the as-of query only replays the events after the nearest checkpoint.
+        def count_replayed(metrics):
+            return metrics.snapshot().get('mutate', {}).get('Instance.Heartbeat', {}).get('count', 0)
+
+        metrics = Instrumentation()
+        instrumentation.install(metrics)
+        try:
+            state = self.app.get_state_at(timecheck2)
+            self.assertEqual(20, state.instances[instance.id].count_heartbeats())
+            self.assertEqual(0, count_replayed(metrics))
+
+            state = self.app.get_state_at(None)
+            self.assertEqual(25, state.instances[instance.id].count_heartbeats())
+            self.assertEqual(5, count_replayed(metrics))
+        finally:
+            instrumentation.install(None)
+
+
+class TestPointInTimeWithPythonObjects(PointInTimeTestCase):
+    def create_app(self):
+        return AtmoEventSourcingApplicationWithPythonObjects()
+
+
+class TestPointInTimeWithSQLAlchemy(PointInTimeTestCase):
+    def create_app(self):
+        return AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///:memory:')
+
+
+class TestPointInTimeWithLogFiles(PointInTimeTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        super(TestPointInTimeWithLogFiles, self).setUp()
+
+    def tearDown(self):
+        super(TestPointInTimeWithLogFiles, self).tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def create_app(self):
+        return AtmoEventSourcingApplicationWithLogFiles(path=self.temp_dir)
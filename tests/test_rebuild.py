@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from functools import partial
+from uuid import uuid1
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcingtests.test_stored_events import AbstractTestCase
+
+from atmo_eventsourcing.application.atmo.rebuild import ParallelRebuilder
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+
+
+def get_heartbeats(entity):
+    return entity.count_heartbeats()
+
+
+class TestParallelRebuilder(AbstractTestCase):
+    def setUp(self):
+        super(TestParallelRebuilder, self).setUp()
+        assert_event_handlers_empty()
+        self.temp_dir = tempfile.mkdtemp()
+        self.app_factory = partial(AtmoEventSourcingApplicationWithSQLAlchemy,
+                                   db_uri='sqlite:///' + os.path.join(self.temp_dir, 'events.db'))
+        self.app = self.app_factory()
+
+    def tearDown(self):
+        self.app.close()
+        assert_event_handlers_empty()
+        shutil.rmtree(self.temp_dir)
+        super(TestParallelRebuilder, self).tearDown()
+
+    def register_fleet(self):
+        instances = self.app.register_new_instances(
+            dict(atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base', username='amitj') for atmo_id in range(25)
+        )
+        for i, instance in enumerate(instances):
+            for _ in range(i % 4):
+                instance.beat_heart()
+        allocation_sources = self.app.register_new_allocation_sources(dict(a=i, b=i * 2) for i in range(5))
+        return instances, allocation_sources
+
+    def test_rebuild_matches_replaying_serially(self):
+        instances, allocation_sources = self.register_fleet()
+        instances[0].discard()
+        progress = []
+
+        rebuilder = ParallelRebuilder(self.app_factory, processes=2, chunk_size=4, progress=progress.append)
+        state = rebuilder.rebuild()
+
+        self.assertEqual({i.id: i for i in instances[1:]}, state.instances)
+        self.assertEqual({a.id: a for a in allocation_sources}, state.allocation_sources)
+
+        # Check progress was reported after each chunk.
+        self.assertEqual(9, len(progress))
+        self.assertEqual(30, progress[-1].entities)
+        self.assertEqual(30, progress[-1].total)
+
+    def test_projection_and_until(self):
+        instances, _ = self.register_fleet()
+        timecheck = uuid1().hex
+        for instance in instances:
+            instance.beat_heart()
+
+        for processes in (1, 2):
+            rebuilder = ParallelRebuilder(self.app_factory, processes=processes, projection=get_heartbeats)
+            state = rebuilder.rebuild(until=timecheck)
+            self.assertEqual({i.id: i.count_heartbeats() - 1 for i in instances}, state.instances)
+
+    def test_chunk_size(self):
+        self.assertRaises(ValueError, ParallelRebuilder, self.app_factory, chunk_size=0)
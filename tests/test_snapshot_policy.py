@@ -0,0 +1,130 @@
+import unittest
+
+import mock
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.infrastructure.event_player import entity_from_snapshot
+from eventsourcingtests.test_stored_events import AbstractTestCase
+
+from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.infrastructure.event_sourced_repos.base import SnapshotPolicy
+
+
+class TestSnapshotPolicy(unittest.TestCase):
+    def test_needs_period_or_interval(self):
+        self.assertRaises(ValueError, SnapshotPolicy)
+        self.assertRaises(ValueError, SnapshotPolicy, period=0)
+        self.assertRaises(ValueError, SnapshotPolicy, interval=-1)
+
+    def test_is_due(self):
+        policy = SnapshotPolicy(period=10)
+        self.assertFalse(policy.is_due(9))
+        self.assertTrue(policy.is_due(10))
+        self.assertFalse(policy.is_due(11, seconds_since_snapshot=3600))
+
+        policy = SnapshotPolicy(interval=60)
+        self.assertFalse(policy.is_due(10))
+        self.assertFalse(policy.is_due(11, seconds_since_snapshot=59))
+        self.assertTrue(policy.is_due(12, seconds_since_snapshot=60))
+
+
+class SnapshottingApplicationTestCase(AbstractTestCase):
+    def setUp(self):
+        super(SnapshottingApplicationTestCase, self).setUp()
+        assert_event_handlers_empty()
+        self.app = self.create_app(snapshot_policy=SnapshotPolicy(period=10))
+
+    def create_app(self, **kwargs):
+        raise NotImplementedError()
+
+    def tearDown(self):
+        self.app.close()
+        assert_event_handlers_empty()
+        super(SnapshottingApplicationTestCase, self).tearDown()
+
+    def test_snapshot_every_n_events(self):
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        event_player = self.app.instance_repo.event_player
+
+        # No snapshot until the period is reached.
+        for _ in range(8):
+            instance.beat_heart()
+        self.assertIsNone(event_player.get_snapshot(instance.id))
+
+        # The tenth event triggers a snapshot.
+        instance.beat_heart()
+        self.assertEqual(10, entity_from_snapshot(event_player.get_snapshot(instance.id)).version)
+
+        # The latest snapshot moves on with the entity.
+        for _ in range(15):
+            instance.beat_heart()
+        snapshot = event_player.get_snapshot(instance.id)
+        self.assertEqual(20, entity_from_snapshot(snapshot).version)
+
+        # Check the repo gives the entity from the snapshot plus the tail.
+        entity = self.app.instance_repo[instance.id]
+        self.assertEqual(25, entity.version)
+        self.assertEqual(24, entity.count_heartbeats())
+        self.assertEqual(instance, entity)
+
+    def test_no_snapshots_in_batch(self):
+        with self.app.persistence_subscriber.batch():
+            instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                                      username='amitj')
+            for _ in range(9):
+                instance.beat_heart()
+        event_player = self.app.instance_repo.event_player
+        self.assertIsNone(event_player.get_snapshot(instance.id))
+        self.assertEqual(instance, self.app.instance_repo[instance.id])
+
+        # Snapshots are taken again after the batch.
+        for _ in range(10):
+            instance.beat_heart()
+        self.assertEqual(20, entity_from_snapshot(event_player.get_snapshot(instance.id)).version)
+
+    def test_allocation_source_snapshots(self):
+        allocation_source = self.app.register_new_allocation_source(a=1, b=2)
+        for _ in range(9):
+            allocation_source.beat_heart()
+        event_player = self.app.allocation_source_repo.event_player
+        self.assertEqual(10, entity_from_snapshot(event_player.get_snapshot(allocation_source.id)).version)
+        self.assertEqual(9, self.app.allocation_source_repo[allocation_source.id].count_heartbeats())
+
+        # Instance events don't trigger Allocation Source snapshots.
+        self.assertIsNone(self.app.instance_repo.event_player.get_snapshot(allocation_source.id))
+
+    def test_snapshot_every_t_seconds(self):
+        self.app.close()
+        self.app = self.create_app(snapshot_policy=SnapshotPolicy(interval=60))
+        with mock.patch('atmo_eventsourcing.infrastructure.event_sourced_repos.base.time') as mock_time:
+            mock_time.time.return_value = 1000.0
+            instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                                      username='amitj')
+            instance.beat_heart()
+            self.assertIsNone(self.app.instance_repo.event_player.get_snapshot(instance.id))
+
+            mock_time.time.return_value = 1060.0
+            instance.beat_heart()
+            snapshot = self.app.instance_repo.event_player.get_snapshot(instance.id)
+            self.assertEqual(3, entity_from_snapshot(snapshot).version)
+
+            mock_time.time.return_value = 1090.0
+            instance.beat_heart()
+            self.assertEqual(snapshot, self.app.instance_repo.event_player.get_snapshot(instance.id))
+
+    def test_discarded_entity(self):
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        for _ in range(8):
+            instance.beat_heart()
+        instance.discard()
+        self.assertNotIn(instance.id, self.app.instance_repo)
+
+
+class TestSnapshottingApplicationWithPythonObjects(SnapshottingApplicationTestCase):
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithPythonObjects(**kwargs)
+
+
+class TestSnapshottingApplicationWithSQLAlchemy(SnapshottingApplicationTestCase):
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithSQLAlchemy(db_uri='sqlite:///:memory:', **kwargs)
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.infrastructure.sqlite import is_sqlite_file_uri, create_indexes
+
+
+class TestSQLiteProfile(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_uri = 'sqlite:///' + os.path.join(self.temp_dir, 'events.db')
+        self.app = AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri)
+
+    def tearDown(self):
+        self.app.close()
+        shutil.rmtree(self.temp_dir)
+        assert_event_handlers_empty()
+
+    def execute(self, sql):
+        engine = self.app.db_session.get_bind()
+        return engine.execute(sql).fetchall()
+
+    def test_is_sqlite_file_uri(self):
+        self.assertTrue(is_sqlite_file_uri(self.db_uri))
+        self.assertFalse(is_sqlite_file_uri('sqlite:///:memory:'))
+        self.assertFalse(is_sqlite_file_uri('postgresql://localhost/atmo'))
+        self.assertFalse(is_sqlite_file_uri(None))
+
+    def test_pragmas(self):
+        self.assertEqual('wal', self.execute('PRAGMA journal_mode')[0][0])
+        self.assertEqual(1, self.execute('PRAGMA synchronous')[0][0])  # NORMAL
+        self.assertEqual(-65536, self.execute('PRAGMA cache_size')[0][0])
+
+    def test_replay_uses_index(self):
+        plan = self.execute("EXPLAIN QUERY PLAN SELECT * FROM stored_events WHERE stored_entity_id = 'Instance::1' "
+                            "AND timestamp_long > 1 AND timestamp_long <= 2 ORDER BY id")
+        self.assertIn('stored_events_replay_idx', ' '.join(row[3] for row in plan))
+
+        # Check the index is added to existing databases.
+        self.app.db_session.get_bind().execute('DROP INDEX stored_events_replay_idx')
+        create_indexes(self.app.db_session.get_bind())
+        self.assertIn('stored_events_replay_idx', [row[1] for row in self.execute('PRAGMA index_list(stored_events)')])
+
+    def test_threads(self):
+        errors = []
+
+        def register(first_atmo_id):
+            try:
+                for atmo_id in range(first_atmo_id, first_atmo_id + 20):
+                    instance = self.app.register_new_instance(atmo_id=atmo_id, name='CentOS 7', username='julianp')
+                    instance.beat_heart()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=register, args=(i * 100,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(80, len(self.app.instance_repo.get_entity_ids()))
+        self.assertEqual(1, self.app.instance_repo.get_by_atmo_id(301).count_heartbeats())
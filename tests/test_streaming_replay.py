@@ -0,0 +1,96 @@
+import os
+import unittest
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcing.utils.time import timestamp_long_from_uuid
+
+from atmo_eventsourcing.domain.model.instance import Instance
+from atmo_eventsourcing.infrastructure.event_sourced_repos.instance_repo import InstanceRepo
+from atmo_eventsourcing.infrastructure.event_store import AtmoEventStore
+from atmo_eventsourcing.infrastructure.stored_events.python_objects_stored_events import \
+    AtmoPythonObjectsStoredEventRepository
+from atmo_eventsourcing.utils.time import uuid_hexes_from_timestamps
+
+START = 1451606400.0  # 2016-01-01T00:00:00Z
+
+ENTITY_ID = 'a' * 32
+
+
+def get_rss():
+    """
+    Returns the resident set size of this process in bytes.
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class GeneratedHistoryRepository(AtmoPythonObjectsStoredEventRepository):
+    """
+    Stored event repository holding a single Instance, with a history of `length` events (a
+    Created event and heartbeats, a millisecond apart) which are made as they are queried,
+    so the history itself takes no memory. Records the peak resident set size seen when each
+    page is queried.
+    """
+
+    def __init__(self, length, **kwargs):
+        super(GeneratedHistoryRepository, self).__init__(**kwargs)
+        self.length = length
+        self.start = timestamp_long_from_uuid(self.make_event_ids(0, 1)[0])
+        self.peak_rss = 0
+
+    def make_event_ids(self, start, end):
+        return uuid_hexes_from_timestamps([START + i * 0.001 for i in range(start, end)], node=0, clock_seq=0)
+
+    def get_entity_events(self, stored_entity_id, after=None, until=None, limit=None, query_ascending=True,
+                          results_ascending=True):
+        if stored_entity_id != 'Instance::' + ENTITY_ID:
+            return []
+        assert query_ascending and results_ascending and until is None
+        self.peak_rss = max(self.peak_rss, get_rss())
+        # Event i is i milliseconds (10000 UUID time intervals) after the start.
+        first = 0 if after is None else (timestamp_long_from_uuid(after) - self.start + 5000) // 10000 + 1
+        last = self.length if limit is None else min(self.length, first + limit)
+        stored_events = []
+        for version, event_id in zip(range(first, last), self.make_event_ids(first, last)):
+            if version == 0:
+                event = Instance.Created(entity_id=ENTITY_ID, atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                         username='amitj', domain_event_id=event_id)
+            else:
+                event = Instance.Heartbeat(entity_id=ENTITY_ID, entity_version=version, domain_event_id=event_id)
+            stored_events.append(self.serialize(event))
+        return stored_events
+
+
+@unittest.skipUnless(os.path.exists('/proc/self/statm'), "Needs /proc/self/statm")
+class TestStreamingReplay(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+
+    def tearDown(self):
+        assert_event_handlers_empty()
+
+    def replay(self, length):
+        stored_event_repo = GeneratedHistoryRepository(length)
+        repo = InstanceRepo(AtmoEventStore(stored_event_repo))
+        try:
+            rss = get_rss()
+            instance = repo[ENTITY_ID]
+            return instance, stored_event_repo.peak_rss - rss
+        finally:
+            repo.close()
+
+    def check_replay(self, length):
+        # Replay a short history first, so memory allocated once (e.g. for caches) isn't counted.
+        self.replay(2000)
+        instance, rss_increase = self.replay(length)
+        self.assertEqual(length, instance.version)
+        self.assertEqual(length - 1, instance.count_heartbeats())
+        # Holding all the events in memory at once would need hundreds of bytes per event.
+        self.assertLess(rss_increase, length * 16)
+
+    def test_replay_long_history_in_bounded_memory(self):
+        self.check_replay(100000)
+
+    @unittest.skipUnless(os.environ.get('ATMO_SLOW_TESTS'), "Slow, set ATMO_SLOW_TESTS=1 to run")
+    def test_replay_million_events_in_bounded_memory(self):
+        self.check_replay(1000000)
@@ -0,0 +1,55 @@
+import datetime
+import unittest
+import uuid
+
+import mock
+from eventsourcing.utils.time import utc_timezone, timestamp_from_uuid
+
+from atmo_eventsourcing.utils import time as time_utils
+from atmo_eventsourcing.utils.time import datetime_to_timestamp, uuid_from_timestamp, uuids_from_timestamps, \
+    uuid_hexes_from_timestamps, get_node
+
+
+class TestBatchUUIDs(unittest.TestCase):
+    def setUp(self):
+        start = datetime_to_timestamp(datetime.datetime(2016, 1, 1, tzinfo=utc_timezone))
+        self.timestamps = [start + i * 0.25 for i in range(100)]
+
+    def test_same_as_scalar(self):
+        expected = [uuid_from_timestamp(t, node=0x123456789abc, clock_seq=42) for t in self.timestamps]
+        self.assertEqual(expected, uuids_from_timestamps(self.timestamps, node=0x123456789abc, clock_seq=42))
+        self.assertEqual([u.hex for u in expected],
+                         uuid_hexes_from_timestamps(self.timestamps, node=0x123456789abc, clock_seq=42))
+
+        # Check the node defaults to the hardware address.
+        self.assertEqual(uuid.getnode(), get_node())
+        self.assertEqual(get_node(), uuids_from_timestamps(self.timestamps[:1])[0].node)
+
+    def test_equal_timestamps(self):
+        t0, t1 = self.timestamps[0], self.timestamps[1]
+        timestamps = [t1, t0, t1, t1, t1 + 0.0000002]
+        uuids = uuids_from_timestamps(timestamps, clock_seq=0x3fff)
+
+        # Check repeated timestamps are moved on 100 ns at a time, so the times strictly increase.
+        times = [u.time for u in uuids]
+        self.assertEqual([times[0] + 1, times[0] + 2, times[0] + 3], times[2:])
+        self.assertLess(times[1], times[0])
+        self.assertEqual(uuid_from_timestamp(t1, clock_seq=0x3fff).time, times[0])
+        self.assertEqual([0x3fff] * len(timestamps), [u.clock_seq for u in uuids])
+        for u, t in zip(uuids, timestamps):
+            self.assertAlmostEqual(t, timestamp_from_uuid(u), places=5)
+            self.assertEqual(1, u.version)
+
+    def test_numpy_and_python_agree(self):
+        if time_utils.numpy is None:
+            self.skipTest("Numpy not installed")
+        timestamps = self.timestamps + self.timestamps[::3] + [self.timestamps[5] + 0.0000001] * 3
+        with_numpy = uuid_hexes_from_timestamps(time_utils.numpy.array(timestamps), clock_seq=7)
+        with mock.patch.object(time_utils, 'numpy', None):
+            with_python = uuid_hexes_from_timestamps(timestamps, clock_seq=7)
+        self.assertEqual(with_numpy, with_python)
+
+    def test_empty(self):
+        self.assertEqual([], uuids_from_timestamps([]))
+        with mock.patch.object(time_utils, 'numpy', None):
+            self.assertEqual([], uuid_hexes_from_timestamps([]))
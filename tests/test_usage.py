@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+
+from atmo_eventsourcing.application.atmo.usage import AllocationUsageEngine, AllocationUsage
+from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
+from atmo_eventsourcing.domain.model.instance import Instance
+from atmo_eventsourcing.utils.time import uuid_from_timestamp
+
+START = 1451606400.0  # 2016-01-01T00:00:00Z
+HOUR = 3600.0
+
+
+class TestAllocationUsageEngine(unittest.TestCase):
+    def setUp(self):
+        assert_event_handlers_empty()
+        self.app = AtmoEventSourcingApplicationWithPythonObjects()
+        self.engine = AllocationUsageEngine(self.app.event_store)
+        self.versions = {}
+
+    def tearDown(self):
+        self.engine.close()
+        self.app.close()
+        assert_event_handlers_empty()
+
+    def event(self, event_class, entity_id, hours, **kwargs):
+        version = self.versions.get(entity_id, 0)
+        self.versions[entity_id] = version + 1
+        return event_class(entity_id=entity_id, entity_version=version,
+                           domain_event_id=uuid_from_timestamp(START + hours * HOUR).hex, **kwargs)
+
+    def created(self, entity_id, hours):
+        return self.event(Instance.Created, entity_id, hours, atmo_id=1, name='CentOS 7', username='julianp')
+
+    def changed(self, entity_id, hours, name, value):
+        return self.event(Instance.AttributeChanged, entity_id, hours, name=name, value=value)
+
+    def test_usage(self):
+        self.engine.process([
+            self.created('i1', 0),
+            self.changed('i1', 0, '_allocation_source_id', 'a1'),
+            self.changed('i1', 0, '_size', [4, 8192, 20]),
+            self.changed('i1', 1, '_status', 'active'),
+            self.created('i2', 2),
+            self.changed('i2', 2, '_status', 'active'),
+            self.changed('i1', 3.5, '_status', 'suspended'),
+            self.changed('i2', 4, '_allocation_source_id', 'a1'),
+            self.event(Instance.Heartbeat, 'i2', 5),
+            self.event(Instance.Discarded, 'i2', 6),
+        ])
+
+        # i1 ran from 1:00 to 3:30 with 4 CPUs, i2 was charged to a1 from 4:00 until it was discarded at 6:00.
+        self.assertEqual(AllocationUsage(instance_hours=4.5, cpu_hours=10.0),
+                         self.engine.get_usage('a1', now=START + 24 * HOUR))
+        self.assertEqual(AllocationUsage(instance_hours=0.0, cpu_hours=0.0), self.engine.get_usage('a2'))
+
+        # Check usage in windows, which are rounded out to whole hours.
+        self.assertEqual(AllocationUsage(instance_hours=1.5, cpu_hours=6.0),
+                         self.engine.get_usage('a1', start=START + 2 * HOUR, end=START + 3.5 * HOUR))
+        self.assertEqual(AllocationUsage(instance_hours=2.5, cpu_hours=2.0),
+                         self.engine.get_usage('a1', start=START + 3.9 * HOUR))
+        self.assertEqual(AllocationUsage(instance_hours=1.0, cpu_hours=4.0),
+                         self.engine.get_usage('a1', end=START + 2 * HOUR))
+
+        # Check running Instances are charged up to now.
+        self.engine.process([self.changed('i1', 10, '_status', 'active')])
+        self.assertEqual(AllocationUsage(instance_hours=6.5, cpu_hours=18.0),
+                         self.engine.get_usage('a1', now=START + 12 * HOUR))
+        self.assertEqual(AllocationUsage(instance_hours=1.0, cpu_hours=4.0),
+                         self.engine.get_usage('a1', start=START + 11 * HOUR, now=START + 12 * HOUR))
+
+    def test_attributes_changed_together(self):
+        self.engine.process([
+            self.created('i1', 0),
+            self.event(Instance.AttributesChanged, 'i1', 1, values={'_status': 'active', '_size': [2, 4096, 20],
+                                                                    '_allocation_source_id': 'a1'}),
+            self.event(Instance.AttributesChanged, 'i1', 3, values={'_status': 'suspended', '_activity': ''}),
+        ])
+        self.assertEqual(AllocationUsage(instance_hours=2.0, cpu_hours=4.0),
+                         self.engine.get_usage('a1', now=START + 24 * HOUR))
+
+    def test_application_events(self):
+        allocation_source = self.app.register_new_allocation_source(a=1, b=2)
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        instance.allocation_source_id = allocation_source.id
+        instance.status = 'active'
+        self.assertEqual(allocation_source.id, self.app.instance_repo[instance.id].allocation_source_id)
+
+        self.assertGreater(self.engine.get_usage(allocation_source.id).instance_hours, 0.0)
+
+        # Check nothing more is charged once the Instance stops running.
+        instance.status = 'suspended'
+        stopped = self.engine.get_usage(allocation_source.id)
+        self.assertGreater(stopped.instance_hours, 0.0)
+        self.assertEqual(stopped, self.engine.get_usage(allocation_source.id))
+
+    def test_bucket_seconds(self):
+        self.assertRaises(ValueError, AllocationUsageEngine, self.app.event_store, bucket_seconds=0)
+
+    def test_save_and_load_state(self):
+        events = [
+            self.created('i1', 0),
+            self.changed('i1', 0, '_allocation_source_id', 'a1'),
+            self.changed('i1', 1, '_status', 'active'),
+            self.changed('i1', 3, '_status', 'suspended'),
+            self.changed('i1', 5, '_status', 'active'),
+            self.changed('i1', 6, '_status', 'suspended'),
+        ]
+        self.app.event_store.append_many(events[:4])
+        self.assertEqual(events[3].domain_event_id, self.engine.get_position('i1'))
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'usage.json')
+            self.engine.save_state(path)
+            self.engine.close()
+
+            # Events are stored while no engine is running.
+            self.app.event_store.append_many(events[4:])
+
+            # Check a new engine carries on from the saved positions.
+            engine = AllocationUsageEngine(self.app.event_store)
+            try:
+                engine.load_state(path)
+                self.assertEqual(2, engine.catch_up())
+                self.assertEqual(0, engine.catch_up())
+                self.assertEqual(AllocationUsage(instance_hours=3.0, cpu_hours=0.0),
+                                 engine.get_usage('a1', now=START + 24 * HOUR))
+                self.assertEqual(AllocationUsage(instance_hours=1.0, cpu_hours=0.0),
+                                 engine.get_usage('a1', start=START + 5 * HOUR))
+                self.assertEqual(events[5].domain_event_id, engine.get_position('i1'))
+
+                # Check events already processed aren't charged again.
+                engine.process(events)
+                self.assertEqual(AllocationUsage(instance_hours=3.0, cpu_hours=0.0),
+                                 engine.get_usage('a1', now=START + 24 * HOUR))
+            finally:
+                engine.close()
+
+            # Check a new engine without saved state catches up with the whole history.
+            engine = AllocationUsageEngine(self.app.event_store)
+            try:
+                self.assertEqual(6, engine.catch_up())
+                self.assertEqual(AllocationUsage(instance_hours=3.0, cpu_hours=0.0),
+                                 engine.get_usage('a1', now=START + 24 * HOUR))
+            finally:
+                engine.close()
+
+            # Check the state is only loaded with the same buckets.
+            engine = AllocationUsageEngine(self.app.event_store, bucket_seconds=60)
+            try:
+                self.assertRaises(ValueError, engine.load_state, path)
+            finally:
+                engine.close()
+        finally:
+            shutil.rmtree(temp_dir)
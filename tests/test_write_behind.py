@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+from eventsourcing.domain.model.events import assert_event_handlers_empty
+from eventsourcingtests.test_stored_events import AbstractTestCase
+
+from atmo_eventsourcing.application.atmo.with_pythonobjects import AtmoEventSourcingApplicationWithPythonObjects
+from atmo_eventsourcing.application.atmo.with_sqlalchemy import AtmoEventSourcingApplicationWithSQLAlchemy
+from atmo_eventsourcing.infrastructure.persistence_subscriber import WriteBehindPersistenceSubscriber
+
+
+class WriteBehindApplicationTestCase(AbstractTestCase):
+    def setUp(self):
+        super(WriteBehindApplicationTestCase, self).setUp()
+        assert_event_handlers_empty()
+        self.app = self.create_app(write_behind_batch_size=10)
+
+    def create_app(self, **kwargs):
+        raise NotImplementedError()
+
+    def tearDown(self):
+        self.app.close()
+        assert_event_handlers_empty()
+        super(WriteBehindApplicationTestCase, self).tearDown()
+
+    def test_batch_size(self):
+        self.assertIsInstance(self.app.persistence_subscriber, WriteBehindPersistenceSubscriber)
+
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        for _ in range(8):
+            instance.beat_heart()
+
+        # Check nothing has been stored yet.
+        self.assertNotIn(instance.id, self.app.instance_repo)
+
+        # Check the tenth event stores the batch.
+        instance.beat_heart()
+        self.assertEqual(9, self.app.instance_repo[instance.id].count_heartbeats())
+
+        # Check flush() stores a partial batch.
+        instance.beat_heart()
+        self.assertEqual(9, self.app.instance_repo[instance.id].count_heartbeats())
+        self.app.flush()
+        self.assertEqual(instance, self.app.instance_repo[instance.id])
+
+        # Check flushing with nothing pending does nothing.
+        with mock.patch.object(self.app.event_store, 'append_many') as append_many:
+            self.app.flush()
+        self.assertEqual(0, append_many.call_count)
+
+    def test_interval(self):
+        self.app.close()
+        self.app = self.create_app(write_behind_interval=5)
+        path = 'atmo_eventsourcing.infrastructure.persistence_subscriber.utc_now'
+        with mock.patch(path) as utc_now:
+            utc_now.return_value = 1000.0
+            instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base',
+                                                      username='amitj')
+            utc_now.return_value = 1004.0
+            instance.beat_heart()
+            self.assertNotIn(instance.id, self.app.instance_repo)
+
+            utc_now.return_value = 1005.0
+            instance.beat_heart()
+            self.assertEqual(instance, self.app.instance_repo[instance.id])
+
+    def test_interval_without_further_events(self):
+        self.app.close()
+        self.app = self.create_app(write_behind_interval=0.05)
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+
+        # Check the pending events are stored by the timer, without anything else being published.
+        for _ in range(100):
+            if instance.id in self.app.instance_repo:
+                break
+            time.sleep(0.05)
+        self.assertEqual(instance, self.app.instance_repo[instance.id])
+
+    def test_failed_flush_keeps_events(self):
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        with mock.patch.object(self.app.event_store, 'append_many', side_effect=IOError()):
+            self.assertRaises(IOError, self.app.flush)
+        self.app.flush()
+        self.assertIn(instance.id, self.app.instance_repo)
+
+    def test_deterministic_instance_ids(self):
+        self.app.close()
+        self.app = self.create_app(write_behind_batch_size=100, deterministic_instance_ids=True)
+        instance1 = self.app.register_new_instance(atmo_id=1, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+
+        # Check registering the atmo_id again finds the Instance whose Created event is still pending.
+        instance2 = self.app.register_new_instance(atmo_id=1, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        self.assertEqual(instance1, instance2)
+        self.app.flush()
+        self.assertEqual(1, len(list(self.app.event_store.get_entity_events('Instance::' + instance1.id))))
+        self.assertEqual(instance1, self.app.instance_repo[instance1.id])
+
+    def test_register_new_instances(self):
+        instances = self.app.register_new_instances(
+            dict(atmo_id=atmo_id, name='Ubuntu 14.04.2 XFCE Base', username='amitj') for atmo_id in range(3)
+        )
+        self.assertEqual(3, len([i for i in instances if i.id in self.app.instance_repo]))
+
+
+class TestWriteBehindApplicationWithPythonObjects(WriteBehindApplicationTestCase):
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithPythonObjects(**kwargs)
+
+
+class TestWriteBehindApplicationWithSQLAlchemy(WriteBehindApplicationTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_uri = 'sqlite:///' + os.path.join(self.temp_dir, 'events.db')
+        super(TestWriteBehindApplicationWithSQLAlchemy, self).setUp()
+
+    def tearDown(self):
+        super(TestWriteBehindApplicationWithSQLAlchemy, self).tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def create_app(self, **kwargs):
+        return AtmoEventSourcingApplicationWithSQLAlchemy(db_uri=self.db_uri, **kwargs)
+
+    def test_close_flushes(self):
+        instance = self.app.register_new_instance(atmo_id=27216, name='Ubuntu 14.04.2 XFCE Base', username='amitj')
+        instance.beat_heart()
+        self.app.close()
+
+        self.app = self.create_app()
+        self.assertEqual(instance, self.app.instance_repo[instance.id])